@@ -0,0 +1,183 @@
+"""
+Benchmark of the restricted language detector against langdetect.
+
+A set of subtitle files is written in English and Spanish (the default target
+languages) and a few other languages, which the restricted detector hands over to
+langdetect. Each detector runs in a fresh interpreter, so the time and memory to load
+its tables are measured too. Each detector runs twice over the files to check that
+the results are reproducible. The last mode runs detect_languages twice, first with an
+empty language cache and then with the languages it cached, like a retried run.
+
+Usage:
+    python benchmarks/bench_detect.py [--files 200] [--other 0.1]
+
+With --other 0 langdetect is never loaded by the restricted detector.
+"""
+
+import argparse, json, os, random, resource, shutil, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+DIALOGUE = {
+    "en": [
+        "Where are you going tonight?",
+        "I told you it was not my fault.",
+        "We need to leave before the sun comes up.",
+        "Nobody knows what happened to the money.",
+        "Can you hear me? Stay with me, please.",
+        "I think we should call the police.",
+    ],
+    "es": [
+        "¿A dónde vas esta noche?",
+        "Te dije que no era mi culpa.",
+        "Tenemos que irnos antes de que salga el sol.",
+        "Nadie sabe qué pasó con el dinero.",
+        "¿Me oyes? Quédate conmigo, por favor.",
+        "Creo que deberíamos llamar a la policía.",
+    ],
+    "fr": [
+        "Où vas-tu ce soir ?",
+        "Je t'ai dit que ce n'était pas ma faute.",
+        "Nous devons partir avant le lever du soleil.",
+        "Personne ne sait ce qui est arrivé à l'argent.",
+    ],
+    "pt": [
+        "Aonde você vai esta noite?",
+        "Eu te disse que não foi minha culpa.",
+        "Precisamos sair antes do sol nascer.",
+        "Ninguém sabe o que aconteceu com o dinheiro.",
+    ],
+    "de": [
+        "Wohin gehst du heute Abend?",
+        "Ich habe dir gesagt, dass es nicht meine Schuld war.",
+        "Wir müssen vor Sonnenaufgang gehen.",
+        "Niemand weiß, was mit dem Geld passiert ist.",
+    ],
+}
+
+
+def make_subtitles(folder, files, other, seed=0):
+    rng = random.Random(seed)
+    paths = {}
+    for i in range(files):
+        if rng.random() < other:
+            language = rng.choice(["fr", "pt", "de"])
+        else:
+            language = "en" if i % 2 == 0 else "es"
+        lines = []
+        for cue in range(300):
+            start = cue * 3
+            lines += [
+                str(cue + 1),
+                f"00:{start // 60 % 60:02d}:{start % 60:02d},000 --> 00:{start // 60 % 60:02d}:{start % 60:02d},900",
+                rng.choice(DIALOGUE[language]),
+                "",
+            ]
+        path = os.path.join(folder, f"sub{i:04d}.{language}.srt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        paths[path] = language
+    return paths
+
+
+def run_mode(mode, paths):
+    """Run one detector over the files (in a fresh interpreter) and print JSON."""
+    from detectLanguage import (
+        detect_language,
+        detect_languages,
+        detect_subtitle_language,
+        sample_subtitle_text,
+        to_iso639_2,
+    )
+
+    if mode == "cache":
+        runs, times = [], []
+        for _ in range(2):
+            start = time.perf_counter()
+            detected = detect_languages(paths, workers=1)
+            times.append(time.perf_counter() - start)
+            runs.append([detected[path][0] for path in paths])
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        print(json.dumps({"first": times[0] / len(paths), "per_file": times[1] / len(paths), "peak": peak, "runs": runs}))
+        return
+
+    def detect(path):
+        if mode == "langdetect":
+            return to_iso639_2(detect_language(sample_subtitle_text(path)))
+        return detect_subtitle_language(path)[0]
+
+    start = time.perf_counter()
+    detect(paths[0])
+    first = time.perf_counter() - start
+    runs = []
+    start = time.perf_counter()
+    for _ in range(2):
+        runs.append([detect(path) for path in paths])
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"first": first, "per_file": elapsed / (2 * len(paths)), "peak": peak, "runs": runs}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--other", type=float, default=0.1)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--paths", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        with open(args.paths, encoding="utf-8") as f:
+            run_mode(args.mode, json.load(f))
+        return
+
+    from detectLanguage import to_iso639_2
+
+    work = tempfile.mkdtemp(prefix="mdr-bench-")
+    try:
+        expected = make_subtitles(work, args.files, args.other)
+        paths_file = os.path.join(work, "paths.json")
+        with open(paths_file, "w", encoding="utf-8") as f:
+            json.dump(list(expected), f)
+        env = dict(os.environ, STATE_DIR=os.path.join(work, "state"))
+        print(f"{args.files} subtitles, {args.other:.0%} in languages outside en,es")
+        for mode, label in (
+            ("langdetect", "langdetect (detect_language)"),
+            ("restricted", "restricted, first run"),
+            ("restricted", "restricted, cached tables"),
+            ("cache", "language cache"),
+        ):
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--paths", paths_file],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            first, second = result["runs"]
+            correct = sum(
+                1
+                for path, language in zip(expected, first)
+                if language == to_iso639_2(expected[path])
+            )
+            changed = sum(1 for a, b in zip(first, second) if a != b)
+            if mode == "cache":
+                print(
+                    f"{label + ', empty':<30} {result['first'] * 1000:7.2f} ms/file\n"
+                    f"{label + ', warm':<30} {result['per_file'] * 1000:7.2f} ms/file  "
+                    f"{correct}/{len(first)} correct  {changed} changed between runs"
+                )
+                continue
+            print(
+                f"{label:<30} first file {result['first'] * 1000:8.1f} ms  "
+                f"{result['per_file'] * 1000:7.2f} ms/file  {result['peak'] / 1024 / 1024:7.1f} MiB max RSS  "
+                f"{correct}/{len(first)} correct  {changed} changed between runs"
+            )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
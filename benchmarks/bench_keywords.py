@@ -0,0 +1,83 @@
+"""
+Microbenchmark of the keyword matching: the checkName / keyword_in_track /
+remove_keyword_from_name functions against a KeywordMatcher built once.
+
+Usage:
+    python benchmarks/bench_keywords.py [--keywords 50] [--tracks 20000]
+"""
+
+import argparse, os, random, string, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from utils import (
+    KeywordMatcher,
+    checkName,
+    keyword_in_track,
+    remove_keyword_from_name,
+)
+
+
+def make_data(n_keywords, n_tracks, seed=0):
+    rng = random.Random(seed)
+    keywords = [
+        " " + "".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 8)))
+        for _ in range(n_keywords)
+    ]
+    names = ["English", "Spanish", "Forced", "SDH", "Commentary", "5.1", "Stereo"]
+    tracks = []
+    for _ in range(n_tracks):
+        name = " ".join(rng.sample(names, 2))
+        if rng.random() < 0.2:
+            name += f" [{rng.choice(keywords).strip()}]"
+        tracks.append(name)
+    return keywords, tracks
+
+
+def old_clean(track_name, keywords, new_name):
+    if not checkName(track_name, keywords):
+        return track_name
+    for keyword in keywords:
+        if keyword_in_track(track_name, keyword.lower()):
+            cleaned = remove_keyword_from_name(track_name, keyword)
+            if cleaned == track_name:
+                cleaned = track_name.replace(keyword.strip(), new_name)
+            return cleaned
+    return track_name
+
+
+def new_clean(track_name, matcher, new_name):
+    if not matcher.is_match(track_name):
+        return track_name
+    return matcher.clean(track_name, new_name)
+
+
+def bench(label, func, tracks, *args):
+    start = time.perf_counter()
+    result = [func(track, *args) for track in tracks]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed * 1000:10.1f} ms  {len(tracks) / elapsed:12.0f} tracks/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--keywords", type=int, default=50)
+    parser.add_argument("--tracks", type=int, default=20000)
+    args = parser.parse_args()
+    keywords, tracks = make_data(args.keywords, args.tracks)
+    print(f"{args.keywords} keywords, {args.tracks} track names")
+
+    bench("checkName", checkName, tracks, keywords)
+    start = time.perf_counter()
+    matcher = KeywordMatcher(keywords)
+    print(f"{'KeywordMatcher build':<28}{(time.perf_counter() - start) * 1000:10.1f} ms")
+    bench("KeywordMatcher.is_match", matcher.is_match, tracks)
+    old = bench("old clean (first keyword)", old_clean, tracks, keywords, " new")
+    new = bench("KeywordMatcher.clean", new_clean, tracks, matcher, " new")
+    differ = sum(1 for a, b in zip(old, new) if a != b)
+    print(f"{differ} cleaned names differ (names with more than one keyword)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark of process_directory and read_srt_files over a synthetic library.
+
+The library has N videos with M tracks each and K subtitle files per video. The
+MKVToolNix executables are replaced by the stubs in benchmarks/stubs, which log
+every call and sleep to simulate the latency of the real tools, so no media files
+or MKVToolNix install are needed.
+
+Usage:
+    python benchmarks/bench_library.py [--videos 200] [--tracks 8] [--subs 2]
+        [--latency 0.02] [--mux-latency 0.1] [--workers 8] [--mux-jobs 4]
+
+The last line runs options 1 and 2 again on a new library as a single pass (option 6),
+where the videos that get subtitles are cleaned by their mkvmerge remux.
+"""
+
+import argparse, contextlib, io, json, os, random, shutil, sys, tempfile, time
+import tracemalloc
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+KEYWORDS = [" GRP", " RlsGroup", " www.example.org"]
+DIALOGUE = {
+    "en": ["Where are you going tonight?", "I told you it was not my fault.", "We need to leave before the sun comes up."],
+    "es": ["¿A dónde vas esta noche?", "Te dije que no era mi culpa.", "Tenemos que irnos antes de que salga el sol."],
+}
+
+
+def make_subtitle(path, language, cues, rng):
+    lines = []
+    for i in range(cues):
+        start = i * 3
+        lines += [
+            str(i + 1),
+            f"00:{start // 60:02d}:{start % 60:02d},000 --> 00:{(start + 2) // 60:02d}:{(start + 2) % 60:02d},000",
+            rng.choice(DIALOGUE[language]),
+            "",
+        ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def make_library(root, videos, tracks, subs, seed=0):
+    """Create N synthetic videos (stub MKV descriptions) and K subtitles per video."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "subs"), exist_ok=True)
+    for v in range(videos):
+        name = f"Show.S01E{v + 1:03d}"
+        description = {
+            "title": f"Show S01E{v + 1:03d}{rng.choice(KEYWORDS)}",
+            "tracks": [{"type": "video", "codec": "V_MPEGH/ISO/HEVC", "language": "und"}],
+            "attachments": [{"file_name": "font.ttf"}, {"file_name": "GRP-logo.png"}],
+        }
+        for t in range(tracks - 1):
+            kind = "audio" if t % 2 == 0 else "subtitles"
+            track_name = rng.choice(["English", "Spanish", "Commentary", "Forced"])
+            if rng.random() < 0.5:
+                track_name += rng.choice(KEYWORDS)
+            description["tracks"].append(
+                {"type": kind, "codec": "A_AAC" if kind == "audio" else "S_TEXT/UTF8", "name": track_name}
+            )
+        with open(os.path.join(root, name + ".mkv"), "w", encoding="utf-8") as f:
+            json.dump(description, f)
+        for s in range(subs):
+            language = "en" if s % 2 == 0 else "es"
+            suffix = f".{language}" if s < 2 else f".{language}{s}"
+            make_subtitle(os.path.join(root, "subs", f"{name}{suffix}.srt"), language, 400, rng)
+
+
+def count_calls(log):
+    if not os.path.exists(log):
+        return Counter(), 0
+    tools, files = Counter(), set()
+    with open(log, encoding="utf-8") as f:
+        for line in f:
+            tool, path = line.rstrip("\n").split("\t", 1)
+            tools[tool] += 1
+            files.add(path)
+    os.remove(log)
+    return tools, len(files)
+
+
+def measure(label, func, log, videos):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tools, _ = count_calls(log)
+    calls = sum(tools.values())
+    detail = ", ".join(f"{tool}={count}" for tool, count in sorted(tools.items()))
+    print(
+        f"{label:<30}{elapsed:9.2f} s {videos / elapsed:9.1f} files/s "
+        f"{calls / videos:6.2f} calls/file {peak / 1024 / 1024:8.2f} MiB peak  ({detail})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--tracks", type=int, default=8)
+    parser.add_argument("--subs", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--mux-latency", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--mux-jobs", type=int, default=4)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="mdr-bench-")
+    library = os.path.join(work, "library")
+    log = os.path.join(work, "calls.log")
+    os.environ.update(
+        {
+            "PATH": os.path.join(HERE, "stubs") + os.pathsep + os.environ["PATH"],
+            "STUB_LOG": log,
+            "STUB_LATENCY": str(args.latency),
+            "STUB_MUX_LATENCY": str(args.mux_latency),
+            "WORKERS": str(args.workers),
+            "MUX_JOBS": str(args.mux_jobs),
+            "STATE_DIR": os.path.join(work, "state"),
+            "DELETE_SUBS": "n",
+        }
+    )
+    from main import clean_and_mux_directory, process_directory
+    from detectLanguage import read_srt_files
+    from utils import KeywordMatcher
+
+    print(
+        f"{args.videos} videos, {args.tracks} tracks each, {args.subs} subtitles each, "
+        f"{args.workers} workers, {args.mux_jobs} mux jobs"
+    )
+    try:
+        make_library(library, args.videos, args.tracks, args.subs)
+        keywords = KeywordMatcher(KEYWORDS)
+        run = lambda: process_directory(library, keywords, " ")
+        measure("process_directory (cold)", run, log, args.videos)
+        measure("process_directory (cached)", run, log, args.videos)
+        measure("read_srt_files", lambda: read_srt_files(library), log, args.videos)
+        # the same work in a single pass, on a new library
+        shutil.rmtree(library)
+        shutil.rmtree(os.environ["STATE_DIR"], ignore_errors=True)
+        make_library(library, args.videos, args.tracks, args.subs)
+        measure(
+            "clean_and_mux_directory",
+            lambda: clean_and_mux_directory(library, keywords, " "),
+            log,
+            args.videos,
+        )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
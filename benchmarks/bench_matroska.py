@@ -0,0 +1,449 @@
+"""
+Check and benchmark of the built-in Matroska header reader and editor (src/matroska.py).
+
+Reference files are written with a small EBML writer, covering the layouts the reader
+has to handle: elements after the clusters found through the SeekHead, a second
+SeekHead, CRC-32 and Void elements, an unknown-size segment, default and BCP 47
+languages, frame count tags, and files the reader must leave to mkvmerge. The clusters
+are sparse, so a reference file can be several GB without using disk space. The reader
+output is compared with the expected metadata of each file, and its time is compared
+with probing through a mkvmerge -J process (the stub in benchmarks/stubs unless
+--real-mkvmerge is given). The in-place editor is checked on the same files: renames
+that fit in the Void padding, or not, CRC-32 elements computed again, names added to
+tracks without one, and a rename that leaves a single spare byte. Its time is compared
+with a mkvpropedit process.
+
+With --compare FOLDER the MKV files of a real library are read by both the reader and
+mkvmerge -J (which must be installed), and the differences are printed.
+
+Usage:
+    python benchmarks/bench_matroska.py [--files 50] [--cluster-gb 4]
+    python benchmarks/bench_matroska.py --compare /path/to/library
+"""
+
+import argparse, json, mmap, os, shutil, statistics, subprocess, sys, tempfile, time, zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import matroska as mk
+from matroska import MatroskaError, edit_header, identify
+from probe import Attachment, MkvInfo, Track, parse_identification
+
+
+def vint_size(size):
+    length = 1
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def element(element_id, payload, unknown_size=False):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    size = b"\x01\xff\xff\xff\xff\xff\xff\xff" if unknown_size else vint_size(len(payload))
+    return id_bytes + size + payload
+
+
+def uint(element_id, value, width=None):
+    width = width or max(1, (value.bit_length() + 7) // 8)
+    return element(element_id, value.to_bytes(width, "big"))
+
+
+def text(element_id, value, padding=0):
+    return element(element_id, value.encode("utf-8") + b"\0" * padding)
+
+
+def crc(payload):
+    # the reader skips CRC-32 elements, the editor has to compute them again
+    return element(mk.CRC32, zlib.crc32(payload).to_bytes(4, "little")) + payload
+
+
+def ebml_header(doc_type="matroska"):
+    return element(mk.EBML, text(mk.DOC_TYPE, doc_type) + uint(0x4287, 4))
+
+
+def track_entry(number, track_type, codec, name=None, language=None, bcp47=None, padding=0):
+    payload = uint(mk.TRACK_NUMBER, number) + uint(mk.TRACK_UID, 1000 + number)
+    payload += uint(mk.TRACK_TYPE, track_type) + text(mk.CODEC_ID, codec)
+    if name is not None:
+        payload += text(mk.NAME, name, padding)
+    if language is not None:
+        payload += text(mk.LANGUAGE, language)
+    if bcp47 is not None:
+        payload += text(mk.LANGUAGE_BCP47, bcp47)
+    return element(mk.TRACK_ENTRY, payload)
+
+
+def frames_tag(track_uid, frames):
+    targets = element(mk.TARGETS, uint(0x68CA, 50) + uint(mk.TAG_TRACK_UID, track_uid))
+    simple = element(
+        mk.SIMPLE_TAG, text(mk.TAG_NAME, "NUMBER_OF_FRAMES") + text(mk.TAG_STRING, str(frames))
+    )
+    return element(mk.TAG, targets + simple)
+
+
+def seek_head(entries):
+    """A SeekHead with fixed width positions, so its size doesn't depend on them."""
+    return element(
+        mk.SEEK_HEAD,
+        b"".join(
+            element(mk.SEEK, uint(mk.SEEK_ID, target) + uint(mk.SEEK_POSITION, position, 8))
+            for target, position in entries
+        ),
+    )
+
+
+def write_file(path, before, after, cluster_size, seek=(), unknown_segment=False,
+               doc_type="matroska", second_seek=()):
+    """
+    Write a Matroska file: the SeekHead, the elements before the cluster, a sparse
+    cluster, and the elements after it. seek lists the IDs the first SeekHead points to,
+    and second_seek the ones of a second SeekHead written at the end.
+    """
+    cluster_header = mk.CLUSTER.to_bytes(4, "big") + vint_size(cluster_size)
+    placeholder = seek_head([(t, 0) for t in seek] + ([(mk.SEEK_HEAD, 0)] if second_seek else []))
+    second_placeholder = seek_head([(t, 0) for t in second_seek]) if second_seek else b""
+    positions, offset = {}, len(placeholder) if seek or second_seek else 0
+    for element_id, data in before:
+        positions.setdefault(element_id, offset)
+        offset += len(data)
+    offset += len(cluster_header) + cluster_size
+    for element_id, data in after:
+        positions.setdefault(element_id, offset)
+        offset += len(data)
+    if second_seek:
+        positions[mk.SEEK_HEAD] = offset
+        second_placeholder = seek_head([(t, positions[t]) for t in second_seek])
+        offset += len(second_placeholder)
+    head = b""
+    if seek or second_seek:
+        head = seek_head(
+            [(t, positions[t]) for t in seek]
+            + ([(mk.SEEK_HEAD, positions[mk.SEEK_HEAD])] if second_seek else [])
+        )
+    segment_size = b"\x01\xff\xff\xff\xff\xff\xff\xff" if unknown_segment else (
+        (1 << 56) | offset
+    ).to_bytes(8, "big")
+    with open(path, "wb") as f:
+        f.write(ebml_header(doc_type) + mk.SEGMENT.to_bytes(4, "big") + segment_size)
+        f.write(head + b"".join(data for _, data in before) + cluster_header)
+        # the cluster is a hole, like the video data the reader must never read
+        f.seek(cluster_size, os.SEEK_CUR)
+        f.write(b"".join(data for _, data in after) + second_placeholder)
+        f.truncate()
+
+
+def reference_layouts():
+    """Get the layout and the expected metadata (None for mkvmerge) of each reference file."""
+    tracks = element(
+        mk.TRACKS,
+        crc(
+            track_entry(1, 1, "V_MPEGH/ISO/HEVC")
+            + element(mk.VOID, b"\0" * 32)
+            + track_entry(2, 2, "A_AAC", "Spanish GRP", "spa")
+            + track_entry(3, 0x11, "S_TEXT/UTF8", "Español", "spa", "es-419", padding=3)
+        ),
+    )
+    info = element(mk.INFO, crc(text(mk.TITLE, "Show S01E01 GRP") + uint(0x2AD7B1, 1000000)))
+    attachments = element(
+        mk.ATTACHMENTS,
+        element(
+            mk.ATTACHED_FILE,
+            text(mk.FILE_NAME, "font.ttf") + text(mk.FILE_MIME_TYPE, "font/ttf")
+            + uint(0x46AE, 1) + element(0x465C, b"\0" * 64),
+        )
+        + element(
+            mk.ATTACHED_FILE,
+            text(mk.FILE_NAME, "GRP-logo.png") + text(mk.FILE_MIME_TYPE, "image/png")
+            + uint(0x46AE, 2) + element(0x465C, b"\0" * 64),
+        ),
+    )
+    tags = element(mk.TAGS, frames_tag(1003, 412))
+    expected_tracks = [
+        Track(0, 1, "video", "V_MPEGH/ISO/HEVC", "", "eng", "", 0),
+        Track(1, 2, "audio", "A_AAC", "Spanish GRP", "spa", "", 0),
+        Track(2, 3, "subtitles", "S_TEXT/UTF8", "Español", "spa", "es-419", 412),
+    ]
+    expected_attachments = [
+        Attachment(1, "font.ttf", "font/ttf"),
+        Attachment(2, "GRP-logo.png", "image/png"),
+    ]
+    return {
+        # mkvmerge layout: SeekHead, Info, Tracks, clusters, then attachments and tags
+        "seekhead.mkv": (
+            dict(
+                before=[(mk.INFO, info), (mk.TRACKS, tracks)],
+                after=[(mk.ATTACHMENTS, attachments), (mk.TAGS, tags)],
+                seek=(mk.INFO, mk.TRACKS, mk.ATTACHMENTS, mk.TAGS),
+            ),
+            MkvInfo("", "Show S01E01 GRP", expected_tracks, expected_attachments),
+        ),
+        # everything before the clusters, no SeekHead, unknown segment size, no title
+        "streamed.webm": (
+            dict(
+                before=[(mk.TRACKS, tracks), (mk.TAGS, tags)],
+                after=[],
+                unknown_segment=True,
+                doc_type="webm",
+            ),
+            MkvInfo("", "", expected_tracks, []),
+        ),
+        # the tags are only listed in a second SeekHead at the end of the file
+        "second-seekhead.mkv": (
+            dict(
+                before=[(mk.INFO, info), (mk.TRACKS, tracks)],
+                after=[(mk.ATTACHMENTS, attachments), (mk.TAGS, tags)],
+                seek=(mk.INFO, mk.TRACKS, mk.ATTACHMENTS),
+                second_seek=(mk.TAGS,),
+            ),
+            MkvInfo("", "Show S01E01 GRP", expected_tracks, expected_attachments),
+        ),
+        # a track type mkvmerge may not report is left to mkvmerge
+        "complex-track.mkv": (
+            dict(
+                before=[(mk.TRACKS, element(mk.TRACKS, track_entry(1, 3, "V_COMPLEX")))],
+                after=[],
+            ),
+            None,
+        ),
+        # the Tracks are only after the clusters and not in a SeekHead
+        "no-seekhead.mkv": (
+            dict(before=[(mk.INFO, info)], after=[(mk.TRACKS, tracks)]),
+            None,
+        ),
+    }
+
+
+def reference_files(folder, cluster_size):
+    """Write the reference files, returning their paths and the expected metadata."""
+    files = {}
+    for name, (layout, expected) in reference_layouts().items():
+        path = os.path.join(folder, name)
+        write_file(path, cluster_size=cluster_size, **layout)
+        if expected is not None:
+            expected.path = path
+        files[path] = expected
+    # not Matroska at all, and a damaged header
+    path = os.path.join(folder, "description.mkv")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"title": "", "tracks": [], "attachments": []}, f)
+    files[path] = None
+    path = os.path.join(folder, "truncated.mkv")
+    with open(os.path.join(folder, "seekhead.mkv"), "rb") as source:
+        header = source.read(200)
+    with open(path, "wb") as f:
+        f.write(header)
+    files[path] = None
+    path = os.path.join(folder, "empty.mkv")
+    open(path, "wb").close()
+    files[path] = None
+    return files
+
+
+def crc_ok(path):
+    """Check the CRC-32 elements of the Info and Tracks of a file."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        _, found = mk._segment(data)
+        for element_id in (mk.INFO, mk.TRACKS):
+            if element_id not in found:
+                continue
+            _, start, end = found[element_id]
+            child_id, crc_start, crc_end = mk.read_element(data, start, end)
+            if child_id == mk.CRC32 and int.from_bytes(
+                data[crc_start:crc_end], "little"
+            ) != zlib.crc32(data[crc_end:end]):
+                return False
+    return True
+
+
+def edit_cases():
+    """Get the file layout, the changes and the expected outcome of each edit check."""
+    layouts = reference_layouts()
+    seekhead, _ = layouts["seekhead.mkv"]
+    before = dict(seekhead["before"])
+    padded = dict(
+        seekhead,
+        before=[
+            (mk.INFO, before[mk.INFO]),
+            (mk.VOID, element(mk.VOID, b"\0" * 64)),
+            (mk.TRACKS, before[mk.TRACKS]),
+            (mk.VOID, element(mk.VOID, b"\0" * 1024)),
+        ],
+    )
+    long_name = "Spanish (Latin America) commentary by the director and cast"
+    return [
+        ("rename in the padding", padded, "Show S01E01", {2: long_name, 3: "Spanish"}, True),
+        ("add missing name", padded, None, {1: "Video"}, True),
+        ("shorter title, no padding", seekhead, "Show", None, True),
+        ("single spare byte", seekhead, "Show S01E01 GR", None, True),
+        ("tracks without padding", seekhead, None, {2: long_name}, False),
+        ("title without padding", seekhead, "Show S01E01 " + long_name, None, False),
+        ("unknown track", padded, None, {9: "Video"}, MatroskaError),
+        ("no Info, only tracks", layouts["streamed.webm"][0], None, {3: "Spa"}, True),
+    ]
+
+
+def check_edits(folder, cluster_size):
+    failures = 0
+    for label, layout, title, track_names, expected in edit_cases():
+        path = os.path.join(folder, "edit.mkv")
+        write_file(path, cluster_size=cluster_size, **layout)
+        original = parse_identification(path, identify(path))
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header = f.read(4096)
+        try:
+            outcome = edit_header(path, title, track_names)
+        except MatroskaError:
+            outcome = MatroskaError
+        info = parse_identification(path, identify(path))
+        with open(path, "rb") as f:
+            unchanged = f.read(4096) == header
+        if outcome is True:
+            names = {track.number: track.name for track in info.tracks}
+            ok = (
+                (title is None or info.title == title)
+                and all(names[n] == name for n, name in (track_names or {}).items())
+                and info.attachments == original.attachments
+                and crc_ok(path)
+            )
+        else:
+            # the file is left as it was for mkvpropedit
+            ok = unchanged
+        ok = ok and outcome is expected and os.path.getsize(path) == size
+        failures += not ok
+        result = {True: "written", False: "left to mkvpropedit"}.get(outcome, "error")
+        print(f"{'ok  ' if ok else 'FAIL'} edit {label:<28} {result}")
+    return failures
+
+
+def check(files):
+    failures = 0
+    for path, expected in files.items():
+        try:
+            info = parse_identification(path, identify(path))
+        except MatroskaError:
+            info = None
+        if info != expected:
+            failures += 1
+            print(f"FAIL {os.path.basename(path)}: expected {expected}, got {info}")
+        else:
+            outcome = "left to mkvmerge" if expected is None else "read"
+            print(f"ok   {os.path.basename(path):<22} {outcome}")
+    return failures
+
+
+def median_time(func, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark(folder, files, cluster_size, real_mkvmerge):
+    path = os.path.join(folder, "seekhead.mkv")
+    layout, _ = reference_layouts()["seekhead.mkv"]
+    copies = [path]
+    for i in range(files - 1):
+        copy = os.path.join(folder, f"copy{i:04d}.mkv")
+        write_file(copy, cluster_size=cluster_size, **layout)
+        copies.append(copy)
+    start = time.perf_counter()
+    for copy in copies:
+        parse_identification(copy, identify(copy))
+    reader = (time.perf_counter() - start) / len(copies)
+
+    env = dict(os.environ)
+    if real_mkvmerge:
+        target, label = path, "mkvmerge -J"
+    else:
+        # the stub reads a JSON description of the file instead of the file itself
+        env["PATH"] = os.path.join(HERE, "stubs") + os.pathsep + env["PATH"]
+        target, label = os.path.join(folder, "description.mkv"), "mkvmerge -J (stub)"
+    subprocess_time = median_time(
+        lambda: subprocess.run(
+            ["mkvmerge", "-J", target], env=env, capture_output=True, check=True
+        ),
+        min(files, 20),
+    )
+    start = time.perf_counter()
+    for i, copy in enumerate(copies):
+        edit_header(copy, f"Show S01E{i:03d}", {2: "Spanish", 3: "Spanish (Latin America)"})
+    editor = (time.perf_counter() - start) / len(copies)
+    if real_mkvmerge:
+        edit_target, edit_label = path, "mkvpropedit"
+    else:
+        edit_target, edit_label = target, "mkvpropedit (stub)"
+    mkvpropedit_time = median_time(
+        lambda: subprocess.run(
+            ["mkvpropedit", edit_target, "--edit", "info", "--set", "title=Show"],
+            env=env,
+            capture_output=True,
+            check=True,
+        ),
+        min(files, 20),
+    )
+    print(
+        f"\n{len(copies)} files of {os.path.getsize(path) / 1e9:.1f} GB (sparse clusters)\n"
+        f"{'built-in reader':<24}{reader * 1000:8.3f} ms/file\n"
+        f"{label:<24}{subprocess_time * 1000:8.3f} ms/file  "
+        f"({subprocess_time / reader:.0f}x slower)\n"
+        f"{'built-in editor':<24}{editor * 1000:8.3f} ms/file\n"
+        f"{edit_label:<24}{mkvpropedit_time * 1000:8.3f} ms/file  "
+        f"({mkvpropedit_time / editor:.0f}x slower)"
+    )
+
+
+def compare(folder):
+    from scanner import scan_files
+
+    differences = checked = 0
+    for path in scan_files(folder, (".mkv",)):
+        result = subprocess.run(
+            ["mkvmerge", "-J", path], capture_output=True, text=True, encoding="utf-8"
+        )
+        if result.returncode > 1:
+            continue
+        expected = parse_identification(path, json.loads(result.stdout))
+        try:
+            info = parse_identification(path, identify(path))
+        except MatroskaError as e:
+            print(f"{path}: left to mkvmerge ({e})")
+            continue
+        checked += 1
+        # mkvmerge derives language_ietf from the legacy language when it is missing
+        for track, reference in zip(info.tracks, expected.tracks):
+            if not track.language_ietf:
+                track.language_ietf = reference.language_ietf
+        if info != expected:
+            differences += 1
+            print(f"{path}:\n  reader:   {info}\n  mkvmerge: {expected}")
+    print(f"{checked} files compared, {differences} with differences")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--cluster-gb", type=float, default=4)
+    parser.add_argument("--real-mkvmerge", action="store_true")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(args.compare) else 0)
+
+    work = tempfile.mkdtemp(prefix="mdr-bench-")
+    try:
+        cluster_size = int(args.cluster_gb * 1e9)
+        files = reference_files(work, cluster_size)
+        failures = check(files) + check_edits(work, cluster_size)
+        benchmark(work, args.files, cluster_size, args.real_mkvmerge)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Demo of several workers sharing one library through the work queue (QUEUE_DIR).
+
+A synthetic library is processed by N worker processes at the same time, like N
+containers mounting the same volume, each with its own state folder. Every worker runs
+option 1 (process_directory) and then option 2 (read_srt_files). The MKVToolNix
+executables are replaced by the stubs in benchmarks/stubs, which log every call, so the
+demo checks that each video is edited and muxed exactly once. With --kill, the first
+worker is killed in the middle of the run, and the others take over its files once
+their leases expire.
+
+Usage:
+    python benchmarks/bench_queue.py [--videos 24] [--workers 1,2,4] [--kill]
+        [--latency 0.3] [--mux-latency 1.5] [--lease 2]
+
+Each stub call also costs a Python startup, so the latencies are kept well above it
+for the speedup to show the waits on MKVToolNix rather than the CPU of the machine.
+"""
+
+import argparse, json, os, shutil, subprocess, sys, tempfile, time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+
+from bench_library import KEYWORDS, make_library
+
+
+def run_worker(library):
+    """Run options 1 and 2 over the library (in a worker process)."""
+    from main import process_directory
+    from detectLanguage import read_srt_files
+    from utils import KeywordMatcher
+
+    process_directory(library, KeywordMatcher(KEYWORDS), " ")
+    read_srt_files(library)
+
+
+def run_workers(work, videos, workers, kill, env):
+    library = os.path.join(work, "library")
+    log = os.path.join(work, "calls.log")
+    shutil.rmtree(work, ignore_errors=True)
+    make_library(library, videos, 6, 2)
+    env = dict(env, STUB_LOG=log, QUEUE_DIR=os.path.join(work, "queue"))
+    processes, outputs = [], []
+    start = time.perf_counter()
+    for i in range(workers):
+        output = open(os.path.join(work, f"worker{i}.log"), "w", encoding="utf-8")
+        outputs.append(output)
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, __file__, "--worker", library],
+                env=dict(env, STATE_DIR=os.path.join(work, f"state{i}")),
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            )
+        )
+    if kill:
+        # wait until the first worker is busy with its files
+        time.sleep(1.5)
+        processes[0].kill()
+    for process in processes:
+        process.wait()
+    elapsed = time.perf_counter() - start
+    for output in outputs:
+        output.close()
+
+    calls = Counter()
+    with open(log, encoding="utf-8") as f:
+        for line in f:
+            tool, path = line.rstrip("\n").split("\t", 1)
+            calls[tool, os.path.basename(path)] += 1
+    names = [f"Show.S01E{v + 1:03d}.mkv" for v in range(videos)]
+    edits = Counter(calls["mkvpropedit", name] for name in names)
+    muxes = Counter(calls["mkvmerge", name] for name in names)
+    probes = sum(count for (tool, _), count in calls.items() if tool == "mkvmerge -J")
+    with open(os.path.join(library, names[0]), encoding="utf-8") as f:
+        tracks = len(json.load(f)["tracks"])
+    print(
+        f"{workers} workers{' (1 killed)' if kill else '':<11}{elapsed:8.2f} s "
+        f"{videos / elapsed:7.1f} videos/s  edited {dict(sorted(edits.items()))}  "
+        f"muxed {dict(sorted(muxes.items()))}  {probes} probes  {tracks} tracks in video 1"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--videos", type=int, default=24)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--kill", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--mux-latency", type=float, default=1.5)
+    parser.add_argument("--lease", type=float, default=2)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker)
+        return
+
+    env = dict(
+        os.environ,
+        PATH=os.path.join(HERE, "stubs") + os.pathsep + os.environ["PATH"],
+        STUB_LATENCY=str(args.latency),
+        STUB_MUX_LATENCY=str(args.mux_latency),
+        WORKERS="2",
+        MUX_JOBS="1",
+        DETECT_WORKERS="1",
+        DELETE_SUBS="n",
+        QUEUE_LEASE=str(args.lease),
+    )
+    print(
+        f"{args.videos} videos, edited and muxed once each is {{1: {args.videos}}}"
+    )
+    work = tempfile.mkdtemp(prefix="mdr-bench-")
+    try:
+        for workers in map(int, args.workers.split(",")):
+            run_workers(os.path.join(work, str(workers)), args.videos, workers, False, env)
+            if args.kill and workers > 1:
+                run_workers(
+                    os.path.join(work, f"{workers}-kill"), args.videos, workers, True, env
+                )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the startup time of the renamer.
+
+Each case runs in a fresh interpreter, like a launch from cron or a container, and the
+median of several runs is reported. The MKVToolNix executables are replaced by the
+stubs in benchmarks/stubs, and the toolchain cache is kept in a temporary folder.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 15]
+"""
+
+import argparse, os, shutil, statistics, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+
+CASES = [
+    ("python (baseline)", "pass"),
+    ("import main (option 1)", "import main"),
+    ("toolchain check (cold)", "from utils import check_mkv_toolnix_installed as c; c()"),
+    ("toolchain check (cached)", "from utils import check_mkv_toolnix_installed as c; c()"),
+    ("import detectLanguage", "import detectLanguage"),
+    ("first language detection", "import detectLanguage as d; d.detect_language('Where are you going tonight?')"),
+]
+
+
+def run_case(code, env, runs, before=None):
+    times = []
+    for _ in range(runs):
+        if before:
+            before()
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import sys; sys.path.insert(0, {SRC!r}); {code}"],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="mdr-bench-")
+    env = dict(
+        os.environ,
+        PATH=os.path.join(HERE, "stubs") + os.pathsep + os.environ["PATH"],
+        STATE_DIR=work,
+    )
+    toolchain_cache = os.path.join(work, "toolchain.json")
+
+    def clear_cache():
+        if os.path.exists(toolchain_cache):
+            os.remove(toolchain_cache)
+
+    try:
+        baseline = None
+        for label, code in CASES:
+            before = clear_cache if label.endswith("(cold)") else None
+            seconds = run_case(code, env, args.runs, before)
+            baseline = baseline if baseline is not None else seconds
+            print(
+                f"{label:<28}{seconds * 1000:9.1f} ms  (+{(seconds - baseline) * 1000:7.1f} ms over python)"
+            )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Shared code of the stand-in MKVToolNix executables used by the benchmarks.
+
+The synthetic "MKV" files are JSON documents describing the title, tracks and
+attachments of the file. The stubs read and update that description, log every
+call to the file in STUB_LOG and sleep STUB_LATENCY (or STUB_MUX_LATENCY for
+mkvmerge -o) seconds to simulate the work of the real tools.
+"""
+
+import json, os, sys, time
+
+
+def log_call(tool, path):
+    log = os.environ.get("STUB_LOG")
+    if log:
+        with open(log, "a", encoding="utf-8") as f:
+            f.write(f"{tool}\t{os.path.abspath(path)}\n")
+
+
+def sleep(mux=False, fraction=1.0):
+    name = "STUB_MUX_LATENCY" if mux else "STUB_LATENCY"
+    time.sleep(float(os.environ.get(name, "0")) * fraction)
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(path, description):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(description, f, ensure_ascii=False)
+
+
+def identification(path, description):
+    tracks = []
+    for i, track in enumerate(description["tracks"]):
+        properties = {
+            "number": i + 1,
+            "codec_id": track.get("codec", ""),
+            "language": track.get("language", "und"),
+        }
+        if track.get("name"):
+            properties["track_name"] = track["name"]
+        for key in ("tag_number_of_frames", "tag_number_of_bytes"):
+            if key in track:
+                properties[key] = track[key]
+        tracks.append(
+            {"id": i, "type": track["type"], "codec": track.get("codec", ""), "properties": properties}
+        )
+    attachments = [
+        {"id": i + 1, "file_name": a["file_name"], "content_type": a.get("content_type", "")}
+        for i, a in enumerate(description.get("attachments", []))
+    ]
+    return {
+        "container": {
+            "recognized": True,
+            "supported": True,
+            "type": "Matroska",
+            "properties": {"title": description.get("title", "")},
+        },
+        "file_name": path,
+        "tracks": tracks,
+        "attachments": attachments,
+    }
+
+
+def fail(message):
+    print(f"Error: {message}")
+    sys.exit(2)
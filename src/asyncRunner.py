@@ -0,0 +1,231 @@
+import asyncio, re, shutil, sys, time
+from dataclasses import dataclass, field
+import metrics
+
+_GUI_PROGRESS = re.compile(r"#GUI#progress\s+(\d+)%")
+
+
+def parse_gui_line(line):
+    """
+    Parse a line printed by a MKVToolNix tool started with --gui-mode.
+
+    In this mode the progress, warnings and errors are prefixed with #GUI# markers that
+    don't depend on the language of the installed MKVToolNix.
+
+    Args:
+        line (str): The output line.
+
+    Returns:
+        tuple: The kind of the line ("progress", "error", "warning", another #GUI# marker,
+            or "output" for the normal text) and its value (the percentage for progress,
+            the message otherwise).
+
+    >>> parse_gui_line("#GUI#progress 45%")
+    ('progress', 45)
+    >>> parse_gui_line("#GUI#error The file could not be opened.")
+    ('error', 'The file could not be opened.')
+    >>> parse_gui_line("Multiplexing took 3 seconds.")
+    ('output', 'Multiplexing took 3 seconds.')
+    """
+    line = line.strip()
+    if not line.startswith("#GUI#"):
+        return "output", line
+    match = _GUI_PROGRESS.match(line)
+    if match:
+        return "progress", int(match.group(1))
+    kind, _, message = line[len("#GUI#") :].partition(" ")
+    return kind, message.strip()
+
+
+@dataclass(eq=False)
+class Job:
+    """A MKVToolNix command run by run_jobs."""
+
+    label: str
+    command: list
+    stage: str = "mux"
+    file: str = None
+    size: int = 0
+    # called with the finished job, its return value is saved in result
+    on_done: object = None
+    progress: int = 0
+    started: float = None
+    finished: float = None
+    returncode: int = None
+    errors: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)
+    result: object = None
+    error: Exception = None
+
+    def eta(self, now):
+        """
+        Estimate the seconds left to finish the job from its progress.
+
+        Args:
+            now (float): The current time.monotonic() value.
+
+        Returns:
+            float: The seconds left, None if it can't be estimated yet.
+        """
+        if self.started is None or not self.progress:
+            return None
+        elapsed = now - self.started
+        return elapsed * (100 - self.progress) / self.progress
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class _ProgressView:
+    """
+    Single status line with the progress of all the running jobs.
+
+    The line is only drawn on a terminal; when the output is redirected only the
+    finished jobs are printed.
+    """
+
+    def __init__(self, show_progress):
+        self.jobs = []
+        self.finished = []
+        self.started = time.monotonic()
+        self._tty = show_progress and sys.stdout.isatty()
+        self._drawn = False
+
+    def throughput(self, now):
+        """Get the MB/s of all the jobs, counting the progress of the running ones."""
+        done = sum(job.size * job.progress / 100 for job in self.jobs)
+        elapsed = now - self.started
+        return done / 1000 / 1000 / elapsed if elapsed > 0 else 0.0
+
+    def render(self):
+        if not self._tty or not self.jobs:
+            return
+        now = time.monotonic()
+        finished = sum(1 for job in self.jobs if job.finished is not None)
+        running = [
+            f"{job.label[:24]} {job.progress:3d}% ETA {_format_seconds(job.eta(now))}"
+            for job in self.jobs
+            if job.finished is None
+        ]
+        line = f"[{finished}/{len(self.jobs)}] " + " | ".join(running)
+        line += f" | {self.throughput(now):.1f} MB/s"
+        width = shutil.get_terminal_size().columns - 1
+        print(f"\r{line[:width]:<{width}}", end="", flush=True)
+        self._drawn = True
+
+    def clear(self):
+        if self._drawn:
+            width = shutil.get_terminal_size().columns - 1
+            print(f"\r{' ' * width}\r", end="", flush=True)
+            self._drawn = False
+
+    def finish(self, job):
+        """Print the outcome of a finished job."""
+        self.finished.append(job)
+        self.clear()
+        seconds = job.finished - job.started
+        for warning in job.warnings:
+            print(f"Warning: {job.label}: {warning}")
+        for error in job.errors:
+            print(f"Error: {job.label}: {error}")
+        if job.returncode is not None and job.returncode <= 1:
+            speed = job.size / 1000 / 1000 / seconds if seconds > 0 else 0.0
+            print(f"{job.label} took {seconds:.1f} seconds ({speed:.1f} MB/s).")
+
+
+async def _run_job(job, view):
+    job.started = time.monotonic()
+    view.jobs.append(job)
+    with metrics.stage(job.stage, job.file, size=job.size, subprocesses=1):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *job.command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                kind, value = parse_gui_line(line.decode("utf-8", errors="replace"))
+                if kind == "progress":
+                    job.progress = value
+                elif kind == "error":
+                    job.errors.append(value)
+                elif kind == "warning":
+                    job.warnings.append(value)
+            job.returncode = await process.wait()
+        except OSError as e:
+            job.errors.append(str(e))
+    job.finished = time.monotonic()
+    if job.returncode is not None and job.returncode <= 1:
+        job.progress = 100
+    view.finish(job)
+    if job.on_done is not None:
+        try:
+            job.result = job.on_done(job)
+        except Exception as e:
+            job.error = e
+            print(f"Error processing {job.label}: {e}")
+
+
+async def _run_all(jobs, limit, view):
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(limit)
+    tasks = []
+
+    async def run(job):
+        try:
+            await _run_job(job, view)
+        finally:
+            slots.release()
+
+    async def refresh():
+        while True:
+            view.render()
+            await asyncio.sleep(0.5)
+
+    refresher = asyncio.ensure_future(refresh())
+    try:
+        while True:
+            await slots.acquire()
+            # the next job is prepared in a thread, so it doesn't stop the running ones
+            job = await loop.run_in_executor(None, next, jobs, None)
+            if job is None:
+                slots.release()
+                break
+            tasks.append(asyncio.ensure_future(run(job)))
+        await asyncio.gather(*tasks)
+    finally:
+        refresher.cancel()
+        view.clear()
+
+
+def run_jobs(jobs, limit, show_progress=True):
+    """
+    Run MKVToolNix commands (mkvmerge, mkvpropedit) concurrently from one thread.
+
+    Up to limit commands run at the same time. Their output is read with asyncio and the
+    --gui-mode markers are parsed, so the commands should be started with --gui-mode to
+    report their progress, warnings and errors. A single status line shows the progress
+    and ETA of each running job and the overall MB/s. The jobs are taken from the
+    iterable only when there is a free slot, so they can be prepared lazily.
+
+    Args:
+        jobs (iterable): The Job objects to run.
+        limit (int): The maximum number of commands running at the same time.
+        show_progress (bool): Whether to draw the status line on a terminal.
+
+    Returns:
+        list: The finished jobs, in the order they finished.
+    """
+    view = _ProgressView(show_progress)
+    asyncio.run(_run_all(iter(jobs), max(1, limit), view))
+    return view.finished
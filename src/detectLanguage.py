@@ -1,15 +1,90 @@
-import sys
-from decouple import config
-from langdetect import detect
+import hashlib, itertools, json, re, sys, threading
+from decouple import config, Csv
 import os
+import shutil
 import subprocess
-from utils import checkFileExists
-from pathlib import Path
+import tempfile
+import time
+import metrics
+from probe import probe_file
+from scanner import is_included, scan_directories, get_scan_options
+from utils import get_user_cache_dir, get_state_dir
+from jobJournal import JobJournal
+from metadataCache import MetadataCache
+from workQueue import file_signature, open_queue
+from workerPool import get_workers, iter_chunks
 
-# available_languages = {
-#     "en": "eng",
-#     "es": "spa",
-# }
+# ISO 639-2 (bibliographic, as used by Matroska) codes of the languages langdetect knows
+available_languages = {
+    "af": "afr",
+    "ar": "ara",
+    "bg": "bul",
+    "bn": "ben",
+    "ca": "cat",
+    "cs": "cze",
+    "cy": "wel",
+    "da": "dan",
+    "de": "ger",
+    "el": "gre",
+    "en": "eng",
+    "es": "spa",
+    "et": "est",
+    "fa": "per",
+    "fi": "fin",
+    "fr": "fre",
+    "gu": "guj",
+    "he": "heb",
+    "hi": "hin",
+    "hr": "hrv",
+    "hu": "hun",
+    "id": "ind",
+    "it": "ita",
+    "ja": "jpn",
+    "kn": "kan",
+    "ko": "kor",
+    "lt": "lit",
+    "lv": "lav",
+    "mk": "mac",
+    "ml": "mal",
+    "mr": "mar",
+    "ne": "nep",
+    "nl": "dut",
+    "no": "nor",
+    "pa": "pan",
+    "pl": "pol",
+    "pt": "por",
+    "ro": "rum",
+    "ru": "rus",
+    "sk": "slo",
+    "sl": "slv",
+    "so": "som",
+    "sq": "alb",
+    "sv": "swe",
+    "sw": "swa",
+    "ta": "tam",
+    "te": "tel",
+    "th": "tha",
+    "tl": "tgl",
+    "tr": "tur",
+    "uk": "ukr",
+    "ur": "urd",
+    "vi": "vie",
+    "zh": "chi",
+}
+
+
+def to_iso639_2(code):
+    """
+    Convert a language code (e.g. "es", "zh-cn" or "spa") to ISO 639-2.
+
+    Args:
+        code (str): The language code.
+
+    Returns:
+        str: The ISO 639-2 code, or the code itself if it is not known.
+    """
+    code = code.lower()
+    return available_languages.get(code.split("-")[0], code)
 
 
 def detect_language(text):
@@ -22,6 +97,9 @@ def detect_language(text):
     Returns:
     str: The detected language of the text, or "Unknown" if the language cannot be determined.
     """
+    # langdetect is imported here so the options that don't detect languages start faster
+    from langdetect import detect
+
     try:
         language = detect(text)
         return language
@@ -29,16 +107,425 @@ def detect_language(text):
         return "Unknown"
 
 
-def read_srt_files(directory):
+_SUBTITLE_TAGS = re.compile(r"<[^>]*>|\{[^}]*\}")
+_VTT_BLOCKS = ("WEBVTT", "NOTE", "STYLE", "REGION", "X-TIMESTAMP-MAP")
+
+
+def _detect_encoding(f):
+    """Get the encoding of a subtitle file from its byte order mark (UTF-8 by default)."""
+    f.seek(0)
+    start = f.read(2)
+    if start == b"\xff\xfe":
+        return "utf-16-le"
+    if start == b"\xfe\xff":
+        return "utf-16-be"
+    return "utf-8"
+
+
+def _read_window(f, offset, size, file_size, encoding="utf-8"):
+    f.seek(offset)
+    data = f.read(size)
+    # the windows after the first one have no byte order mark, so the encoding of the
+    # whole file is used, and the byte order mark of the first one is removed
+    text = data.decode(encoding, errors="ignore").lstrip("\ufeff")
+    lines = text.splitlines()
+    # the first line of a window in the middle of the file and the last line of any
+    # window may be cut, so they are left out
+    if offset > 0:
+        lines = lines[1:]
+    if offset + len(data) < file_size:
+        lines = lines[:-1]
+    return lines
+
+
+def sample_subtitle_text(path, max_chars=None, max_bytes=None, windows=3):
+    """
+    Read a bounded sample of the dialogue of a subtitle file.
+
+    Up to max_bytes are read, split in windows taken from the start, middle and end of
+    the file. Cue numbers, timestamps, WebVTT headers and markup tags are left out, and
+    the dialogue lines are collected until max_chars are reached.
+
+    Args:
+        path (str): The path of the subtitle file.
+        max_chars (int, optional): The amount of dialogue text to collect. Defaults to the
+            DETECT_SAMPLE_CHARS env var or 2000.
+        max_bytes (int, optional): The maximum number of bytes to read. Defaults to the
+            DETECT_SAMPLE_BYTES env var or 65536.
+        windows (int): The number of places of the file the sample is taken from.
+
+    Returns:
+        str: The sampled dialogue text, one line per subtitle line.
+    """
+    if max_chars is None:
+        max_chars = config("DETECT_SAMPLE_CHARS", default=2000, cast=int)
+    if max_bytes is None:
+        max_bytes = config("DETECT_SAMPLE_BYTES", default=65536, cast=int)
+    size = os.path.getsize(path)
+    window_size = max(max_bytes // windows, 1)
+    if size <= max_bytes:
+        offsets, window_size = [0], size
+    else:
+        step = (size - window_size) // (windows - 1) if windows > 1 else 0
+        offsets = [i * step for i in range(windows)]
+    per_window = max_chars // len(offsets) + 1
+    sample, total = [], 0
+    with open(path, "rb") as f:
+        encoding = _detect_encoding(f)
+        if encoding.startswith("utf-16"):
+            # the windows start and end between two characters
+            offsets = [offset - offset % 2 for offset in offsets]
+            window_size -= window_size % 2
+        for offset in offsets:
+            collected = 0
+            for line in _read_window(f, offset, window_size, size, encoding):
+                line = _SUBTITLE_TAGS.sub("", line).strip()
+                if (
+                    not line
+                    or line.isdigit()
+                    or "-->" in line
+                    or line.startswith(_VTT_BLOCKS)
+                ):
+                    continue
+                sample.append(line)
+                collected += len(line)
+                total += len(line)
+                if collected >= per_window or total >= max_chars:
+                    break
+            if total >= max_chars:
+                break
+    return "\n".join(sample)
+
+
+_detector = None
+# the DETECT_LANGUAGES the detector could not be built for
+_unavailable = None
+
+
+def check_detect_languages():
     """
-    Read all the SRT files in the current directory and return the content as a list of strings.
+    Check the DETECT_LANGUAGES target languages once, before the subtitles are detected.
+
+    If langdetect doesn't know one of them, a warning is shown (once per process) and
+    the subtitles are detected with langdetect only, instead of failing for each file.
+
+    Returns:
+        bool: True if the restricted detector can be used, False otherwise.
+    """
+    global _unavailable
+    from ngramDetector import unknown_languages
+
+    languages = config("DETECT_LANGUAGES", default="en,es", cast=Csv())
+    if not languages:
+        return False
+    if languages == _unavailable:
+        return False
+    unknown = unknown_languages(languages)
+    if not unknown:
+        return True
+    _unavailable = languages
+    print(
+        f"Unknown DETECT_LANGUAGES: {', '.join(unknown)}. Use the langdetect codes "
+        "(e.g. zh-cn or zh-tw for Chinese). The subtitles are detected with langdetect only."
+    )
+    return False
+
+
+def get_detector():
+    """
+    Get the detector restricted to the DETECT_LANGUAGES target languages (en,es by default).
+
+    The detector is loaded once per process. Its n-gram tables are cached in the user
+    cache folder.
 
     Returns:
-        list: A list of strings where each string represents the content of an SRT file.
+        NgramDetector: The detector, or None if DETECT_LANGUAGES is empty or has a
+            language langdetect doesn't know (see check_detect_languages).
+    """
+    global _detector, _unavailable
+    languages = config("DETECT_LANGUAGES", default="en,es", cast=Csv())
+    if not languages or languages == _unavailable:
+        return None
+    if _detector is None or _detector.languages != languages:
+        from ngramDetector import NgramDetector
+
+        try:
+            _detector = NgramDetector.load(languages, get_user_cache_dir())
+        except ValueError:
+            # the parent process warned about it in check_detect_languages
+            _unavailable = languages
+            return None
+    return _detector
+
+
+def _init_detector():
+    """Load the detector once in each worker process of detect_languages."""
+    get_detector()
+
+
+def _detect_with_langdetect(text):
+    # langdetect is random unless it is seeded
+    from langdetect import DetectorFactory, detect_langs
+
+    DetectorFactory.seed = 0
+    best = detect_langs(text)[0]
+    return best.lang, best.prob
+
+
+# Change it when the detection changes, so the languages cached before are detected again
+_DETECTION_VERSION = 1
+
+
+def detector_version():
+    """
+    Get the version of the language detection and its settings, which the cached
+    languages depend on.
+
+    Returns:
+        str: The version.
+    """
+    from importlib.metadata import PackageNotFoundError, version
+    from ngramDetector import NgramDetector
+
+    try:
+        langdetect = version("langdetect")
+    except PackageNotFoundError:
+        langdetect = ""
+    return json.dumps(
+        [
+            _DETECTION_VERSION,
+            NgramDetector.VERSION,
+            langdetect,
+            config("DETECT_LANGUAGES", default="en,es", cast=Csv()),
+            config("DETECT_MIN_CONFIDENCE", default=0.98, cast=float),
+        ]
+    )
+
+
+def detect_subtitle_language(path, text=None):
+    """
+    Detect the language of a subtitle file.
+
+    The restricted detector of get_detector is tried first. langdetect, which knows 55
+    languages but is much slower, is only used when the confidence of the restricted
+    detector is below DETECT_MIN_CONFIDENCE (0.98 by default).
+
+    Args:
+        path (str): The path of the subtitle file.
+        text (str, optional): The sampled dialogue of the file, if it was already read.
+
+    Returns:
+        tuple: The ISO 639-2 language code ("Unknown" if it could not be detected), the
+            confidence of the detection between 0 and 1, and the seconds it took.
+    """
+    from langdetect.lang_detect_exception import LangDetectException
+
+    start = time.perf_counter()
+    try:
+        if path.endswith(".idx"):
+            # VobSub subtitles are images, the language is written in the index
+            language = read_idx_language(path)
+            confidence = 0.0 if language == "Unknown" else 1.0
+        else:
+            if text is None:
+                text = sample_subtitle_text(path)
+            detector = get_detector()
+            language, confidence = "Unknown", 0.0
+            if detector is not None:
+                language, confidence = detector.detect(text)
+            if confidence < config("DETECT_MIN_CONFIDENCE", default=0.98, cast=float):
+                language, confidence = _detect_with_langdetect(text)
+    except (OSError, LangDetectException):
+        # an unreadable file, or a text without letters
+        language, confidence = "Unknown", 0.0
+    if language != "Unknown":
+        language = to_iso639_2(language)
+    return language, confidence, time.perf_counter() - start
+
+
+class DetectionPool:
+    """
+    The processes that detect the languages of the subtitle files, see detect_languages.
+
+    The processes and the language cache are kept open between the calls of detect, so
+    a library can be detected in chunks as it is scanned without starting them again
+    for each chunk.
+
+    Args:
+        workers (int, optional): The number of processes. Defaults to DETECT_WORKERS.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = get_workers(config("DETECT_WORKERS", default=None))
+        self.workers = workers
+        check_detect_languages()
+        self._executor = None
+        self._cache = None
+        self._cache_opened = False
+        self._lock = threading.Lock()
+
+    def _get_cache(self):
+        from languageCache import open_language_cache
+
+        with self._lock:
+            if not self._cache_opened:
+                self._cache = open_language_cache(detector_version())
+                self._cache_opened = True
+        return self._cache
+
+    def _get_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, initializer=_init_detector
+                )
+        return self._executor
+
+    def detect(self, paths):
+        """
+        Detect the languages of some subtitle files.
+
+        The sampled dialogue of each file is looked up first in the language cache (see
+        LanguageCache), and only the files that are not in it are detected.
+
+        Args:
+            paths (iterable): The paths of the subtitle files.
+
+        Returns:
+            dict: The language code and the confidence of each path.
+        """
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return {}
+        sample_bytes = config("DETECT_SAMPLE_BYTES", default=65536, cast=int)
+        cache = self._get_cache()
+        detected, texts = {}, {}
+        if cache is not None:
+            for path in paths:
+                # VobSub languages are read from the index, which is faster than the cache
+                if path.endswith(".idx"):
+                    continue
+                start = time.perf_counter()
+                try:
+                    text = sample_subtitle_text(path)
+                except OSError:
+                    continue
+                cached = cache.get(text)
+                if cached is None:
+                    texts[path] = text
+                    continue
+                size = min(metrics.file_size(path), sample_bytes)
+                metrics.record("detect", path, time.perf_counter() - start, size)
+                detected[path] = tuple(cached)
+        pending = [path for path in paths if path not in detected]
+        pending_texts = [texts.get(path) for path in pending]
+        workers = min(self.workers, len(pending))
+        if workers <= 1:
+            results = map(detect_subtitle_language, pending, pending_texts)
+        else:
+            chunksize = max(1, min(16, len(pending) // (workers * 4)))
+            results = self._get_executor().map(
+                detect_subtitle_language, pending, pending_texts, chunksize=chunksize
+            )
+        try:
+            for path, (language, confidence, seconds) in zip(pending, results):
+                size = min(metrics.file_size(path), sample_bytes)
+                metrics.record("detect", path, seconds, size)
+                detected[path] = (language, confidence)
+                if path in texts and language != "Unknown":
+                    cache.put(texts[path], language, confidence)
+        finally:
+            if cache is not None:
+                cache.flush()
+        return {path: detected[path] for path in paths}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_detection_pool():
+    """
+    Get the DetectionPool of this process for the subtitles that are detected one video
+    at a time (like the videos of the watch mode), so the language cache is opened once
+    per process and not for each video.
+
+    Returns:
+        DetectionPool: The pool. It detects the files in this process.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = DetectionPool(workers=1)
+    return _shared_pool
+
+
+def detect_languages(paths, workers=None):
+    """
+    Detect the languages of many subtitle files at the same time.
+
+    The sampled dialogue of each file is looked up first in the language cache (see
+    LanguageCache), and only the files that are not in it are detected. Detection is pure
+    Python, so they are spread over a pool of DETECT_WORKERS processes (the number of CPU
+    cores by default). Each process loads the detector once, when it starts. Use a
+    DetectionPool to detect several batches of files with the same processes.
+
+    Args:
+        paths (list): The paths of the subtitle files.
+        workers (int, optional): The number of processes. Defaults to DETECT_WORKERS.
+
+    Returns:
+        dict: The language code and the confidence of each path.
+    """
+    with DetectionPool(workers) as pool:
+        return pool.detect(paths)
+
+
+def read_idx_language(path):
+    """
+    Read the language of a VobSub .idx file from its "id:" line.
+
+    Args:
+        path (str): The path of the .idx file.
+
+    Returns:
+        str: The language code, or "Unknown" if the file doesn't have one.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if line.startswith("id:"):
+                return line[3:].split(",", 1)[0].strip() or "Unknown"
+    return "Unknown"
+
+
+def ask_delete_subs():
+    """
+    Get whether the subtitle files have to be deleted once they are added.
+
+    The answer is taken from the DELETE_SUBS env var, asked to the user when it isn't set,
+    and defaults to "y" when there is no terminal.
+
+    Returns:
+        str: "y" or "n".
     """
-    # TODO: check if the file is already in the mkv file
     delete_subs_config = config("DELETE_SUBS", default=None)
-    print(f"--------------- Adding Subtitles to MKV files {delete_subs_config} ---------------")
     if delete_subs_config:
         deleteSubs = delete_subs_config
     else:
@@ -61,91 +548,964 @@ def read_srt_files(directory):
             break
         else:
             print("Invalid option. Please enter Y or N.")
-    # check if subs folder exists
-    subsFolder = os.path.exists(os.path.join(directory, "subs"))
-    available_subs_extensions = [".srt", ".vtt", ".idx"]
+    return deleteSubs
+
+
+def iter_subtitle_groups(directory):
+    """
+    Find the videos with subtitle files to add in the directory and its subfolders.
+
+    The folders are indexed as the scanner finds them, and a "subs" folder is handled
+    together with the folder that contains it. The videos that don't match the
+    SCAN_INCLUDE globs are left out, with their subtitles.
+
+    Args:
+        directory (str): The library directory.
+
+    Yields:
+        tuple: The folder, the subsFolder flag, the video name without extension, the
+            video extension and the names of its subtitle files.
+    """
+    options = get_scan_options()
+    for folder in scan_directories(
+        directory, exclude=options["exclude"], max_depth=options["max_depth"]
+    ):
+        if os.path.basename(folder) == "subs":
+            continue
+        subsFolder = os.path.exists(os.path.join(folder, "subs"))
+        groups, orphans = build_subtitle_index(folder, subsFolder)
+        for fileName in orphans:
+            print(
+                f"Could not find a video file for the subtitle {fileName}. Skipping this file."
+            )
+        for fileWithoutExtension, (fileExtension, subs) in groups.items():
+            video_file = os.path.join(folder, f"{fileWithoutExtension}{fileExtension}")
+            if not is_included(directory, video_file, options["include"]):
+                continue
+            yield folder, subsFolder, fileWithoutExtension, fileExtension, subs
+
+
+def subtitle_paths(videos):
+    """
+    Get the paths of the subtitle files of some subtitle groups.
+
+    Args:
+        videos (list): The groups yielded by iter_subtitle_groups.
+
+    Returns:
+        list: The path of each subtitle file.
+    """
+    return [
+        os.path.join(folder, "subs" if subsFolder else "", sub)
+        for folder, subsFolder, _, _, subs in videos
+        for sub in subs
+    ]
+
+
+def remove_empty_subs_folders(folders):
+    """
+    Delete the "subs" folder of each folder if it is empty.
+
+    Args:
+        folders (iterable): The folders whose "subs" folder can be deleted.
+    """
+    for folder in dict.fromkeys(folders):
+        subs = os.path.join(folder, "subs")
+        if not os.path.isdir(subs):
+            continue
+        # check if the folder is empty
+        if not os.listdir(subs):
+            os.rmdir(subs)
+        else:
+            print(f"The subs folder of {folder} is not empty. Could not delete it.")
+
+
+def subtitle_group_key(path):
+    """
+    Find the video whose subtitles have to be added when a video or subtitle file lands.
+
+    Args:
+        path (str): The path of the new video or subtitle file.
+
+    Returns:
+        tuple: The folder and the video name without extension, or None if the file
+            doesn't belong to a video with subtitles.
+    """
+    folder = os.path.dirname(path)
+    if os.path.basename(folder) == "subs":
+        folder = os.path.dirname(folder)
+    subsFolder = os.path.exists(os.path.join(folder, "subs"))
+    groups, _ = build_subtitle_index(folder, subsFolder)
+    name = os.path.basename(path)
+    for fileWithoutExtension, (fileExtension, subs) in groups.items():
+        if name == fileWithoutExtension + fileExtension or name in subs:
+            return folder, fileWithoutExtension
+    return None
+
+
+def subtitle_group_subs(key):
+    """
+    Get the subtitle files that are currently next to a video.
+
+    Args:
+        key (tuple): The folder and video name returned by subtitle_group_key.
+
+    Returns:
+        list: The names of the subtitle files.
+    """
+    folder, fileWithoutExtension = key
+    subsFolder = os.path.exists(os.path.join(folder, "subs"))
+    groups, _ = build_subtitle_index(folder, subsFolder)
+    return groups.get(fileWithoutExtension, (None, []))[1]
+
+
+def subtitle_group(key):
+    """
+    Get the subtitle group of a video with the subtitle files that are currently next to it.
+
+    Args:
+        key (tuple): The folder and video name returned by subtitle_group_key.
+
+    Returns:
+        tuple: The group, like the ones yielded by iter_subtitle_groups, or None if the
+            video has no subtitle files.
+    """
+    folder, fileWithoutExtension = key
+    subsFolder = os.path.exists(os.path.join(folder, "subs"))
+    groups, _ = build_subtitle_index(folder, subsFolder)
+    if fileWithoutExtension not in groups:
+        return None
+    fileExtension, subs = groups[fileWithoutExtension]
+    return folder, subsFolder, fileWithoutExtension, fileExtension, subs
+
+
+def add_subtitles_to_group(key, deleteSubs):
+    """
+    Add the subtitle files that are currently next to a video to it.
+
+    Args:
+        key (tuple): The folder and video name returned by subtitle_group_key.
+        deleteSubs (str): "y" to delete the subtitle files once they are added.
+
+    Returns:
+        bool: True if the subtitles were added, False otherwise.
+    """
+    video = subtitle_group(key)
+    if video is None:
+        return False
+    folder, subsFolder = video[:2]
+    result = add_subtitles_to_video(*video, deleteSubs, show_progress=False)
+    if result and subsFolder and deleteSubs == "y":
+        remove_empty_subs_folders([folder])
+    return result
+
+
+# ".{video}.{random}.tmp.{extension}", see build_mkvmerge_command
+_TEMP_OUTPUT = re.compile(r"^\..+\.[a-z0-9_]{8}\.tmp\.(mkv|mp4|avi)$")
+# mkvmerge writes its output all the time, a temporary output untouched for this long
+# was left by a process that no longer runs
+_STALE_OUTPUT_SECONDS = 600
+
+
+def _is_stale(path):
+    try:
+        return time.time() - os.path.getmtime(path) > _STALE_OUTPUT_SECONDS
+    except OSError:
+        return True
+
+
+def resume_muxes(journal, folders):
+    """
+    Finish the muxes an interrupted run left behind and remove the orphaned temporary outputs.
+
+    A video whose mkvmerge output was complete is replaced with it, without muxing it
+    again. The temporary outputs of the muxes that did not finish are removed, also the
+    ones the journal doesn't know, once they are not written for a while.
+
+    Args:
+        journal (JobJournal): The journal of the interrupted run.
+        folders (iterable): The folders where temporary outputs are looked for.
+
+    Returns:
+        None
+    """
+    folders = set(folders)
+    in_use = set()
+    for video_file, entry in journal.entries("muxing", "muxed"):
+        output_file = entry.get("output", "")
+        if journal.is_running(entry) and not _is_stale(output_file):
+            in_use.add(output_file)
+            continue
+        folders.add(os.path.dirname(video_file))
+        try:
+            stat = os.stat(video_file)
+            unchanged = (stat.st_size, stat.st_mtime_ns) == (
+                entry.get("video_size"),
+                entry.get("video_mtime_ns"),
+            )
+        except OSError:
+            unchanged = False
+        if entry["state"] == "muxed" and unchanged and os.path.exists(output_file):
+            print(f"Finishing the interrupted mux of {os.path.basename(video_file)}.")
+            finalize_mkvmerge(0, output_file, video_file, journal)
+            journal.update(video_file, "finalized")
+            continue
+        if os.path.exists(output_file):
+            print(f"Removing the unfinished output {output_file}")
+            os.remove(output_file)
+        journal.forget(video_file)
+    remove_orphaned_outputs(folders, in_use)
+
+
+def remove_orphaned_outputs(folders, in_use=()):
+    """
+    Remove the temporary mkvmerge outputs left in some folders by the processes that no
+    longer run, once they are not written for a while.
+
+    Args:
+        folders (iterable): The folders where temporary outputs are looked for.
+        in_use (set): The outputs that are still being written.
+
+    Returns:
+        None
+    """
+    for folder in folders:
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
+            if (
+                _TEMP_OUTPUT.match(entry.name)
+                and entry.path not in in_use
+                and _is_stale(entry.path)
+            ):
+                print(f"Removing the orphaned output {entry.path}")
+                os.remove(entry.path)
+            elif entry.name in ("temp.mkv", "temp.mp4", "temp.avi"):
+                print(
+                    f"{entry.path} may have been left by an older version. "
+                    "Remove it if it is not one of your videos."
+                )
+
+
+def resume_video(journal, video, deleteSubs):
+    """
+    Finish a video whose subtitles were already added by an interrupted run.
+
+    Args:
+        journal (JobJournal): The journal of the interrupted run.
+        video (tuple): The group yielded by iter_subtitle_groups.
+        deleteSubs (str): "y" to delete the subtitle files.
+
+    Returns:
+        bool: True if the video was done, False if it still has to be processed.
+    """
+    folder, _, fileWithoutExtension, fileExtension, subs = video
+    entry = journal.get(os.path.join(folder, f"{fileWithoutExtension}{fileExtension}"))
+    if (
+        entry is None
+        or entry["state"] not in ("finalized", "subs-deleted")
+        or not set(subs) <= set(entry.get("subs", []))
+    ):
+        return False
+    kept = [i for i, sub in enumerate(subs) if sub in entry.get("kept", [])]
+    finish_subtitles_mux(*video, deleteSubs, [], journal, kept)
+    print(
+        f"Subtitles {', '.join(subs)} were already added to "
+        f"{fileWithoutExtension}{fileExtension} before the interruption."
+    )
+    return True
+
+
+def journaled_languages(journal, videos):
+    """
+    Get the languages an interrupted run detected for the subtitles of some videos.
+
+    Args:
+        journal (JobJournal): The journal of the interrupted run.
+        videos (list): The groups yielded by iter_subtitle_groups.
+
+    Returns:
+        dict: The language code and confidence of each subtitle path, like
+            detect_languages returns them.
+    """
+    detected = {}
+    for folder, subsFolder, fileWithoutExtension, fileExtension, subs in videos:
+        entry = journal.get(os.path.join(folder, f"{fileWithoutExtension}{fileExtension}"))
+        if entry is None or "languages" not in entry:
+            continue
+        saved = dict(zip(entry["subs"], entry["languages"]))
+        subsDirectory = os.path.join(folder, "subs") if subsFolder else folder
+        for sub in subs:
+            if sub in saved:
+                detected[os.path.join(subsDirectory, sub)] = (saved[sub], 1.0)
+    return detected
+
+
+def claimed_videos(queue):
+    """
+    Claim the videos of the work queue shared with the other workers.
+
+    Args:
+        queue (WorkQueue): The queue of the videos with subtitles to add.
+
+    Yields:
+        tuple: The group of each claimed video, like the ones yielded by
+            iter_subtitle_groups.
+    """
+    for video_file in queue.claims():
+        video = subtitle_group(
+            (
+                os.path.dirname(video_file),
+                os.path.splitext(os.path.basename(video_file))[0],
+            )
+        )
+        if video is None:
+            # the subtitles were added (and deleted) since the video was queued
+            queue.complete(video_file, file_signature(video_file))
+            continue
+        yield video
+
+
+def settle_claimed_video(queue, video, result):
+    """
+    Mark a claimed video as done, or give it back to the queue if it failed.
+
+    Args:
+        queue (WorkQueue): The queue the video was claimed from.
+        video (tuple): The group of the video.
+        result (bool): Whether its subtitles were added.
+    """
+    folder, _, fileWithoutExtension, fileExtension, subs = video
+    video_file = os.path.join(folder, f"{fileWithoutExtension}{fileExtension}")
+    if result:
+        queue.complete(video_file, file_signature(video_file, *subs))
+    else:
+        queue.release(video_file)
+
+
+def read_srt_files(directory, edits=None):
+    """
+    Add the subtitle files of the directory and its subfolders to their video files.
+
+    The videos are taken from the scanner in chunks of DETECT_CHUNK_SIZE (100 by
+    default), so the first videos are muxed while the rest of the library is still
+    unscanned. The languages of the subtitles of each chunk are detected by a pool of
+    processes that is kept for the whole run. Then up to MUX_JOBS videos (1 by default)
+    are muxed at the same time, with a single progress line for all of them. When the
+    QUEUE_DIR env var is set, each chunk is shared with the other workers that use the
+    same queue, and each worker detects the languages of the videos it claims.
+
+    Args:
+        directory (str): The library directory.
+        edits (tuple, optional): The keywords (KeywordMatcher) and the new name to clean
+            the metadata of the remuxed videos with, in the same mkvmerge call. The
+            videos left clean are saved in the metadata cache, unless CACHE is False.
+
+    Returns:
+        None
+    """
+    deleteSubs = ask_delete_subs()
+    print(f"--------------- Adding Subtitles to MKV files {deleteSubs} ---------------")
+
+    chunk_size = config("DETECT_CHUNK_SIZE", default=100, cast=int)
+    jobs = get_workers(config("MUX_JOBS", default="1"))
+    subs_folders = set()
+    settings = deleteSubs
+    cache = None
+    if edits is not None:
+        keywords, new_name = edits
+        settings = json.dumps([deleteSubs, keywords.keywords, new_name])
+        if config("CACHE", default=True, cast=bool):
+            cache = MetadataCache(
+                os.path.join(get_state_dir(directory), "cache.sqlite"), keywords
+            )
+    journal = JobJournal(
+        os.path.join(get_state_dir(directory), "journal.sqlite"), "mux", settings
+    )
+    queue = None
+    pool = DetectionPool()
+
+    def mux_chunk(videos):
+        detected = journaled_languages(journal, videos)
+        detected.update(
+            pool.detect(p for p in subtitle_paths(videos) if p not in detected)
+        )
+        if jobs == 1:
+            # a video that fails doesn't stop the others, like with mux_videos
+            for video in videos:
+                try:
+                    result = add_subtitles_to_video(
+                        *video,
+                        deleteSubs,
+                        languages=get_languages_codes(
+                            video[4], video[0], video[1], detected, pool
+                        ),
+                        journal=journal,
+                        edits=edits,
+                        cache=cache,
+                    )
+                except Exception as e:
+                    print(f"Error processing {video[2]}{video[3]}: {e}")
+                    result = False
+                if queue is not None:
+                    settle_claimed_video(queue, video, result)
+        else:
+            muxes = (
+                (
+                    video,
+                    deleteSubs,
+                    get_languages_codes(video[4], video[0], video[1], detected, pool),
+                )
+                for video in videos
+            )
+            for video, result, error in mux_videos(muxes, jobs, journal, edits, cache):
+                if queue is not None:
+                    settle_claimed_video(queue, video, result and error is None)
+
+    try:
+        # an interrupted run continues from the last step it saved
+        resume_muxes(journal, ())
+        queue = open_queue(directory, "mux", settings)
+        for videos in iter_chunks(iter_subtitle_groups(directory), chunk_size):
+            subs_folders.update(video[0] for video in videos if video[1])
+            remove_orphaned_outputs({video[0] for video in videos})
+            videos = [
+                video for video in videos if not resume_video(journal, video, deleteSubs)
+            ]
+            if queue is None:
+                mux_chunk(videos)
+                continue
+            queued = []
+            for folder, _, fileWithoutExtension, fileExtension, subs in videos:
+                video_file = os.path.join(folder, f"{fileWithoutExtension}{fileExtension}")
+                queued.append((video_file, file_signature(video_file, *subs)))
+            queue.add(queued)
+            # the claimed videos may have been queued by the other workers
+            mux_chunk(list(itertools.islice(claimed_videos(queue), chunk_size)))
+        if queue is not None:
+            for videos in iter_chunks(claimed_videos(queue), chunk_size):
+                mux_chunk(videos)
+        # the other workers may still be working on their videos
+        if queue is None or queue.is_drained():
+            journal.clear()
+    finally:
+        pool.close()
+        if queue is not None:
+            queue.close()
+        journal.close()
+        if cache is not None:
+            cache.close()
+    if deleteSubs == "y":
+        remove_empty_subs_folders(subs_folders)
+
+
+VIDEO_EXTENSIONS = (".mkv", ".mp4", ".avi")
+SUBTITLE_EXTENSIONS = (".srt", ".vtt", ".idx")
+
+
+def build_subtitle_index(directory, subsFolder):
+    """
+    Group the subtitle files of a directory by the video file they belong to.
+
+    The video files and the subtitle files are listed once, and each subtitle is matched
+    to the video with the same name, after removing its extension and, if needed, its
+    extra suffixes (e.g. "Ep1.forced.en.srt" belongs to "Ep1.mkv", but "Ep10.srt" does not).
+
+    Args:
+        directory (str): The directory where the video files are located.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+
+    Returns:
+        tuple: A dict of {video name without extension: (video extension, [subtitle files])}
+            and a list of the subtitle files without a video.
+    """
+    videos = {}
+    subtitles = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name, extension = os.path.splitext(entry.name)
+            if name.startswith("."):
+                continue
+            if extension in VIDEO_EXTENSIONS and entry.is_file():
+                # keep the first extension of VIDEO_EXTENSIONS if there are several
+                current = videos.get(name)
+                if current is None or VIDEO_EXTENSIONS.index(
+                    extension
+                ) < VIDEO_EXTENSIONS.index(current):
+                    videos[name] = extension
+            elif not subsFolder and extension in SUBTITLE_EXTENSIONS:
+                subtitles.append(entry.name)
     if subsFolder:
-        srt_files = [
+        subtitles = [
             f
             for f in os.listdir(os.path.join(directory, "subs"))
-            if f.endswith(tuple(available_subs_extensions))
+            if f.endswith(SUBTITLE_EXTENSIONS)
         ]
+    groups = {}
+    orphans = []
+    for fileName in sorted(subtitles):
+        stem = os.path.splitext(fileName)[0]
+        while stem not in videos and "." in stem:
+            stem = stem.rsplit(".", 1)[0]
+        if stem in videos:
+            groups.setdefault(stem, (videos[stem], []))[1].append(fileName)
+        else:
+            orphans.append(fileName)
+    return groups, orphans
 
-    else:
-        srt_files = [
-            f
-            for f in os.listdir(directory)
-            if f.endswith(tuple(available_subs_extensions))
-        ]
-    if not srt_files:
-        return
-    index_duplicate_files = {}
-    i = 0
-    while i < len(srt_files):
-        fileName = srt_files[i]
-        fileWithoutExtension = os.path.splitext(fileName)[0]
-        # check if have another .extension in the finals positions of the file
-        if "." in fileWithoutExtension[-4:]:
-            # find the last . and remove the extension
-            fileWithoutExtension = fileWithoutExtension[
-                : fileWithoutExtension.rfind(".")
-            ]
-        # find the index of the duplicate files using the fileWithoutExtension
-        index_duplicate_files[fileWithoutExtension] = [
-            (i, x)
-            for i, x in enumerate(srt_files)
-            if x.startswith(fileWithoutExtension)
-        ]
-        fileExtension = get_video_extension(directory, fileWithoutExtension)
-        if fileExtension == "":
+
+def plan_subtitles_mux(
+    directory,
+    subsFolder,
+    fileWithoutExtension,
+    fileExtension,
+    subs,
+    languages=None,
+    journal=None,
+    edits=None,
+):
+    """
+    Find the subtitles of a group that are not in their video yet.
+
+    With edits, the title, track names and attachments of a MKV video that has to be
+    remuxed are cleaned by the same mkvmerge call, see EditBatch.mkvmerge_options.
+
+    Args:
+        directory (str): The directory where the video file is located.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        fileWithoutExtension (str): The name of the video file without extension.
+        fileExtension (str): The extension of the video file.
+        subs (list): The names of the subtitle files.
+        languages (list, optional): The language code of each subtitle file. If not given,
+            the languages are detected.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        edits (tuple, optional): The keywords (KeywordMatcher) and the new name to clean
+            the metadata of the video with.
+
+    Returns:
+        tuple: The language code of each subtitle file, the indexes of the subtitles
+            that have to be muxed, the indexes of the ones that seem to be in the video
+            but can't be verified (see find_missing_subtitles), the mkvmerge options
+            of the metadata changes and whether the remuxed video will have no keyword
+            left.
+    """
+    if languages is None:
+        languages = get_languages_codes(subs, directory, subsFolder)
+    video_file = os.path.join(directory, f"{fileWithoutExtension}{fileExtension}")
+    if journal is not None:
+        journal.update(video_file, "planned", subs=subs, languages=languages)
+    try:
+        info = probe_file(video_file)
+    except Exception as e:
+        print(f"Could not read the tracks of {video_file}: {e}")
+        info = None
+    # only the subtitles that are not embedded yet are muxed
+    missing, unverified = list(range(len(subs))), []
+    if info is not None:
+        missing, unverified = find_missing_subtitles(
+            video_file,
+            os.path.join(directory, "subs") if subsFolder else directory,
+            languages,
+            subs,
+            info,
+        )
+    edit_options, clean = [], False
+    if not missing:
+        print(
+            f"Subtitles {', '.join(subs)} are already in "
+            f"{fileWithoutExtension}{fileExtension}. Skipping the remux."
+        )
+    elif edits is not None and info is not None and fileExtension == ".mkv":
+        from metaDataChanges import is_clean_after, plan_file_edits
+
+        keywords = edits[0]
+        batch, _ = plan_file_edits(video_file, *edits, info=info)
+        edit_options = batch.mkvmerge_options(info)
+        # the added subtitles are named after their language
+        clean = is_clean_after(batch, info, keywords) and not any(
+            keywords.is_match(subtitle_track_name(languages[i])) for i in missing
+        )
+    return languages, missing, unverified, edit_options, clean
+
+
+def finish_subtitles_mux(
+    directory,
+    subsFolder,
+    fileWithoutExtension,
+    fileExtension,
+    subs,
+    deleteSubs,
+    missing,
+    journal=None,
+    unverified=(),
+):
+    """
+    Delete the subtitle files of a group once they are in their video.
+
+    The subtitles that only seem to be in the video (their track has no hash to compare
+    with, see find_missing_subtitles) are never deleted.
+
+    Args:
+        directory (str): The directory where the video file is located.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        fileWithoutExtension (str): The name of the video file without extension.
+        fileExtension (str): The extension of the video file.
+        subs (list): The names of the subtitle files.
+        deleteSubs (str): "y" to delete the subtitle files.
+        missing (list): The indexes of the subtitles that were muxed.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        unverified (list, optional): The indexes of the subtitles that are kept.
+
+    Returns:
+        None
+    """
+    video_file = os.path.join(directory, f"{fileWithoutExtension}{fileExtension}")
+    kept = [subs[i] for i in unverified]
+    if journal is not None:
+        journal.update(video_file, "finalized", subs=subs, kept=kept)
+    if deleteSubs.lower() == "y":
+        subsDirectory = os.path.join(directory, "subs") if subsFolder else directory
+        if kept:
             print(
-                f"Could not find a video file for the subtitle {fileName}. Skipping this file."
+                f"Subtitles {', '.join(kept)} were not deleted, they can't be verified "
+                f"to be in {fileWithoutExtension}{fileExtension}."
             )
-            continue
-        languages = get_languages_codes(
-            index_duplicate_files[fileWithoutExtension], directory, subsFolder
-        )
-        # delete the subtitle file
-        result = execute_mkvmerge(
+        for deletedFile in subs:
+            if deletedFile in kept:
+                continue
+            # an interrupted run may have deleted some of them already
+            if os.path.exists(os.path.join(subsDirectory, deletedFile)):
+                os.remove(os.path.join(subsDirectory, deletedFile))
+        if journal is not None:
+            journal.update(video_file, "subs-deleted")
+    if missing:
+        added = ", ".join(subs[i] for i in missing)
+        print(f"Subtitles {added} added to {fileWithoutExtension}{fileExtension} file.")
+
+
+def add_subtitles_to_video(
+    directory,
+    subsFolder,
+    fileWithoutExtension,
+    fileExtension,
+    subs,
+    deleteSubs,
+    show_progress=True,
+    languages=None,
+    journal=None,
+    edits=None,
+    cache=None,
+):
+    """
+    Add a group of subtitle files to their video file.
+
+    Args:
+        directory (str): The directory where the video file is located.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        fileWithoutExtension (str): The name of the video file without extension.
+        fileExtension (str): The extension of the video file.
+        subs (list): The names of the subtitle files.
+        deleteSubs (str): "y" to delete the subtitle files once they are added.
+        show_progress (bool): Whether to print the mkvmerge progress.
+        languages (list, optional): The language code of each subtitle file. If not given,
+            the languages are detected.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        edits (tuple, optional): The keywords and the new name to clean the metadata of
+            the video with while it is remuxed, see plan_subtitles_mux.
+        cache (MetadataCache, optional): The cache where the video is saved when the
+            remux leaves it clean.
+
+    Returns:
+        bool: True if the subtitles were added (or were already in the video), False otherwise.
+    """
+    languages, missing, unverified, edit_options, clean = plan_subtitles_mux(
+        directory,
+        subsFolder,
+        fileWithoutExtension,
+        fileExtension,
+        subs,
+        languages,
+        journal,
+        edits,
+    )
+    result = not missing or execute_mkvmerge(
+        subsFolder,
+        fileWithoutExtension,
+        directory,
+        [languages[i] for i in missing],
+        [subs[i] for i in missing],
+        fileExtension,
+        show_progress,
+        journal,
+        edit_options,
+    )
+    if result:
+        if clean and cache is not None:
+            cache.mark_clean(
+                os.path.join(directory, f"{fileWithoutExtension}{fileExtension}")
+            )
+        finish_subtitles_mux(
+            directory,
             subsFolder,
             fileWithoutExtension,
-            directory,
-            languages,
-            index_duplicate_files[fileWithoutExtension],
             fileExtension,
+            subs,
+            deleteSubs,
+            missing,
+            journal,
+            unverified,
         )
-        if result:
-            if deleteSubs.lower() == "y":
-                if subsFolder:
-                    for deletedFile in index_duplicate_files[fileWithoutExtension]:
-                        os.remove(os.path.join(directory, "subs", deletedFile[1]))
-                else:
-                    for deletedFile in index_duplicate_files[fileWithoutExtension]:
-                        os.remove(os.path.join(directory, deletedFile[1]))
-            print(
-                f"Subtitles {fileName} added to {fileWithoutExtension}{fileExtension} file."
+    print("-" * 50)
+    return result
+
+
+def create_mux_job(
+    directory,
+    subsFolder,
+    fileWithoutExtension,
+    fileExtension,
+    subs,
+    deleteSubs,
+    languages=None,
+    journal=None,
+    edits=None,
+    cache=None,
+):
+    """
+    Prepare the mkvmerge job that adds a group of subtitle files to their video file.
+
+    Args:
+        directory (str): The directory where the video file is located.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        fileWithoutExtension (str): The name of the video file without extension.
+        fileExtension (str): The extension of the video file.
+        subs (list): The names of the subtitle files.
+        deleteSubs (str): "y" to delete the subtitle files once they are added.
+        languages (list, optional): The language code of each subtitle file. If not given,
+            the languages are detected.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        edits (tuple, optional): The keywords and the new name to clean the metadata of
+            the video with while it is remuxed, see plan_subtitles_mux.
+        cache (MetadataCache, optional): The cache where the video is saved when the
+            remux leaves it clean.
+
+    Returns:
+        Job: The job for run_jobs, or None if the subtitles are already in the video (the
+            subtitle files are deleted right away in that case).
+    """
+    from asyncRunner import Job
+
+    video = (directory, subsFolder, fileWithoutExtension, fileExtension, subs)
+    languages, missing, unverified, edit_options, clean = plan_subtitles_mux(
+        *video, languages, journal, edits
+    )
+    if not missing:
+        finish_subtitles_mux(*video, deleteSubs, missing, journal, unverified)
+        return None
+    command, output_file, video_file, size, tags_files = build_mkvmerge_command(
+        subsFolder,
+        fileWithoutExtension,
+        directory,
+        [languages[i] for i in missing],
+        [subs[i] for i in missing],
+        fileExtension,
+        journal,
+        edit_options,
+    )
+
+    def on_done(job):
+        if not finalize_mkvmerge(
+            job.returncode, output_file, video_file, journal, tags_files
+        ):
+            return False
+        if clean and cache is not None:
+            cache.mark_clean(video_file)
+        finish_subtitles_mux(*video, deleteSubs, missing, journal, unverified)
+        return True
+
+    return Job(
+        label=f"{fileWithoutExtension}{fileExtension}",
+        command=command,
+        file=video_file,
+        size=size,
+        on_done=on_done,
+    )
+
+
+def mux_videos(videos, jobs, journal=None, edits=None, cache=None):
+    """
+    Add the subtitles of several videos at the same time.
+
+    The mkvmerge processes are run by the asyncio runner, which shows a single progress
+    line for all of them, while the next videos are prepared (languages detected and
+    videos probed) in the background.
+
+    Args:
+        videos (iterable): Tuples of the group yielded by iter_subtitle_groups, the
+            deleteSubs answer and the language codes of the subtitles (None to detect them).
+        jobs (int): The number of mkvmerge processes running at the same time.
+        journal (JobJournal, optional): The journal where the steps of the videos are saved.
+        edits (tuple, optional): The keywords and the new name to clean the metadata of
+            the videos with while they are remuxed, see plan_subtitles_mux.
+        cache (MetadataCache, optional): The cache where the videos the remux leaves
+            clean are saved.
+
+    Returns:
+        list: A (video, result, error) tuple for each video, like run_pool.
+    """
+    from asyncRunner import run_jobs
+
+    results = []
+    job_videos = {}
+
+    def mux_jobs():
+        for video, deleteSubs, languages in videos:
+            try:
+                job = create_mux_job(
+                    *video, deleteSubs, languages, journal, edits, cache
+                )
+            except Exception as e:
+                print(f"Error processing {video[2]}{video[3]}: {e}")
+                results.append((video, None, e))
+                continue
+            if job is None:
+                results.append((video, True, None))
+                continue
+            job_videos[job] = video
+            yield job
+
+    for job in run_jobs(mux_jobs(), jobs):
+        results.append((job_videos[job], job.result, job.error))
+    return results
+
+
+def subtitle_track_name(language):
+    """
+    Get the track name given to a subtitle when it is added.
+
+    Args:
+        language (str): The language code of the subtitle.
+
+    Returns:
+        str: The track name, empty if the track doesn't get one.
+    """
+    return "Español" if to_iso639_2(language) == "spa" else ""
+
+
+def count_cues(path):
+    """
+    Count the cues of a subtitle file, which mkvmerge stores as the frames of its track.
+
+    Args:
+        path (str): The path of the subtitle file.
+
+    Returns:
+        int: The number of cues.
+    """
+    marker = "timestamp:" if path.endswith(".idx") else "-->"
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return sum(1 for line in f if marker in line)
+
+
+# The track tag where the hash of each subtitle added by the renamer is saved
+SUBTITLE_HASH_TAG = "METADATARENAMER_SUBTITLE_SHA256"
+
+
+def subtitle_fingerprint(path):
+    """
+    Get the hash of the cues of a subtitle file, saved in its track when it is added.
+
+    The timings and the text of the cues are hashed without the cue numbers, the blank
+    lines, the spaces around the lines and the byte order mark, so the same subtitle
+    saved with another encoding or line ending has the same hash, and a corrected or
+    resynced one doesn't.
+
+    Args:
+        path (str): The path of the subtitle file.
+
+    Returns:
+        str: The hex SHA-256 of the cues.
+    """
+    with open(path, "rb") as f:
+        encoding = _detect_encoding(f)
+        f.seek(0)
+        text = f.read().decode(encoding, errors="replace").lstrip("\ufeff")
+    lines = (line.strip() for line in text.splitlines())
+    cues = "\n".join(line for line in lines if line and not line.isdigit())
+    return hashlib.sha256(cues.encode("utf-8")).hexdigest()
+
+
+def find_missing_subtitles(video_file, subsDirectory, languages, subs, info=None):
+    """
+    Find the subtitle files that are not embedded in the video yet.
+
+    A subtitle is already embedded when the video has a subtitle track with the same
+    language and track name, and the hash of its cues saved in the track tags (see
+    subtitle_fingerprint). The tracks added before the hash was saved, or read by
+    mkvmerge -J (which doesn't show the tags), have no hash: a subtitle with the same
+    number of cues as one of them is not muxed again, but it is not verified either, so
+    it is never deleted.
+
+    Args:
+        video_file (str): The path of the video file.
+        subsDirectory (str): The directory where the subtitle files are located.
+        languages (list): The language code of each subtitle file.
+        subs (list): The names of the subtitle files.
+        info (MkvInfo, optional): The probed metadata of the video. If not given, the
+            video is probed.
+
+    Returns:
+        tuple: The indexes of the subtitle files that have to be added, and the indexes
+            of the ones that seem to be embedded but can't be verified.
+    """
+    if info is None:
+        try:
+            info = probe_file(video_file)
+        except Exception as e:
+            print(f"Could not read the tracks of {video_file}: {e}")
+            return list(range(len(subs))), []
+    tracks = [track for track in info.tracks if track.type == "subtitles"]
+    missing, unverified = [], []
+    for i, (language, sub) in enumerate(zip(languages, subs)):
+        path = os.path.join(subsDirectory, sub)
+        fingerprint, cues = subtitle_fingerprint(path), count_cues(path)
+        candidates = [
+            track
+            for track in tracks
+            if to_iso639_2(track.language_ietf or track.language) == to_iso639_2(language)
+            and track.name == subtitle_track_name(language)
+        ]
+        match = next((t for t in candidates if t.fingerprint == fingerprint), None)
+        if match is None:
+            match = next(
+                (t for t in candidates if not t.fingerprint and t.frames == cues), None
             )
-        print("-" * 50)
-        i += len(index_duplicate_files[fileWithoutExtension])
-    if subsFolder and deleteSubs.lower() == "y":
-        # check if the folder is empty
-        if not os.listdir(os.path.join(directory, "subs")):
-            os.rmdir(os.path.join(directory, "subs"))
+            if match is not None:
+                unverified.append(i)
+        if match is None:
+            missing.append(i)
         else:
-            print("The subs folder is not empty. Could not delete it.")
+            tracks.remove(match)
+    return missing, unverified
 
 
-def get_languages_codes(files, directory, subsFolder):
+def get_languages_codes(files, directory, subsFolder, detected=None, pool=None):
     """
     Get the language codes for a list of files.
 
     Args:
-        files (list): A list of files.
+        files (list): A list of subtitle file names.
         directory (str): The directory path.
         subsFolder (bool): Flag indicating whether the files are in a subfolder.
+        detected (dict, optional): The languages already found by detect_languages. The
+            files that are not in it are looked up in the language cache or detected.
+        pool (DetectionPool, optional): The pool that detects the missing files.
+            Defaults to the one of this process, see shared_detection_pool.
 
     Returns:
-        list: A list of language codes.
+        list: A list with the language code of each file, "und" if it could not be detected.
 
     """
     languages = []
@@ -153,40 +1513,129 @@ def get_languages_codes(files, directory, subsFolder):
         srtFile = os.path.join(directory, "subs")
     else:
         srtFile = directory
-    for file in files:
-        with open(
-            os.path.join(srtFile, file[1]), "r", encoding="utf-8", errors="ignore"
-        ) as f:
-            # get the first 30 lines of the file and join them into a single string
-            content = "".join(f.readlines()[:30])
-            language = detect_language(content)
-            if language != "Unknown":
-                languages.append(language)
-            else:
-                print(f"Could not detect language for {file}.")
+    paths = [os.path.join(srtFile, file) for file in files]
+    detected = detected or {}
+    missing = [path for path in paths if path not in detected]
+    if missing:
+        pool = pool or shared_detection_pool()
+        detected = {**detected, **pool.detect(missing)}
+    for file, path in zip(files, paths):
+        language, _ = detected[path]
+        if language == "Unknown":
+            print(f"Could not detect language for {file}.")
+            language = "und"
+        languages.append(language)
     return languages
 
 
-def get_video_extension(directory, file):
+def build_mkvmerge_command(
+    subsFolder,
+    input_file,
+    directory,
+    languages,
+    subs,
+    extension=".mkv",
+    journal=None,
+    edit_options=(),
+):
     """
-    Get the video file extension for a given directory and file name.
+    Build the mkvmerge command that adds the subtitle files to a video.
+
+    mkvmerge writes to a unique temporary file next to the video, which then replaces
+    the video with os.replace, so several videos can be muxed at the same time. The
+    command uses --gui-mode, so its progress and errors don't depend on the language of
+    the installed MKVToolNix. The hash of each subtitle (see subtitle_fingerprint) is
+    saved in the tags of its track, from a temporary tags file.
 
     Args:
-        directory (str): The directory where the file is located.
-        file (str): The name of the file (without extension).
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        input_file (str): The name of the input video file without extension.
+        directory (str): The directory where the video file is located.
+        languages (list): The language code of each subtitle file.
+        subs (list): The names of the subtitle files.
+        extension (str): The extension of the video file.
+        journal (JobJournal, optional): The journal where the temporary file is saved, so
+            it can be removed if the run is interrupted.
+        edit_options (list, optional): The mkvmerge options that change the metadata of
+            the video, see EditBatch.mkvmerge_options.
 
     Returns:
-        str: The video file extension (e.g., ".mkv", ".mp4", ".avi").
+        tuple: The command, the temporary output file, the video file, the number of
+            bytes the command reads and the temporary tags files.
+    """
+    subsDirectory = os.path.join(directory, "subs") if subsFolder else directory
+    video_file = os.path.join(directory, f"{input_file}{extension}")
+    fd, output_file = tempfile.mkstemp(
+        prefix=f".{input_file}.", suffix=f".tmp{extension}", dir=directory
+    )
+    os.close(fd)
+    if journal is not None:
+        stat = os.stat(video_file)
+        journal.update(
+            video_file,
+            "muxing",
+            output=output_file,
+            video_size=stat.st_size,
+            video_mtime_ns=stat.st_mtime_ns,
+        )
+    command = ["mkvmerge", "--gui-mode", "-o", output_file, *edit_options, video_file]
+    tags_files = []
+    for language, sub in zip(languages, subs):
+        sub_path = os.path.join(subsDirectory, sub)
+        fd, tags_file = tempfile.mkstemp(prefix=".mdr-tags-", suffix=".xml")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n<Tags><Tag><Targets/><Simple>'
+                f"<Name>{SUBTITLE_HASH_TAG}</Name>"
+                f"<String>{subtitle_fingerprint(sub_path)}</String>"
+                "</Simple></Tag></Tags>\n"
+            )
+        tags_files.append(tags_file)
+        if subtitle_track_name(language):
+            command += ["--default-track", "0:yes"]
+            command += ["--track-name", f"0:{subtitle_track_name(language)}"]
+        command += ["--language", f"0:{language}", "--tags", f"0:{tags_file}", sub_path]
+    size = metrics.file_size(video_file) + sum(
+        metrics.file_size(os.path.join(subsDirectory, sub)) for sub in subs
+    )
+    return command, output_file, video_file, size, tags_files
+
+
+def finalize_mkvmerge(returncode, output_file, video_file, journal=None, tags_files=()):
+    """
+    Replace the video with the output of mkvmerge, or remove the output if it failed.
+
+    Args:
+        returncode (int): The exit code of mkvmerge, None if it could not be started.
+        output_file (str): The temporary output file.
+        video_file (str): The video file.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        tags_files (list, optional): The temporary tags files of the command, removed.
 
+    Returns:
+        bool: True if the video was replaced, False otherwise.
     """
-    videoExtensions = [".mkv", ".mp4", ".avi"]
-    fileExtension = ""
-    # get the video file extension
-    for extension in videoExtensions:
-        if checkFileExists(os.path.join(directory, file + extension)):
-            fileExtension += extension
-            return fileExtension
-    return fileExtension
+    for tags_file in tags_files:
+        if os.path.exists(tags_file):
+            os.remove(tags_file)
+    # mkvmerge exits with 1 when there were only warnings
+    if returncode is None or returncode > 1:
+        print(f"Error muxing {os.path.basename(video_file)}")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        if journal is not None:
+            journal.forget(video_file)
+        return False
+    if journal is not None:
+        # the output is complete, an interrupted run only has to move it
+        journal.update(video_file, "muxed")
+    print(
+        f'Moving "{os.path.basename(output_file)}" to "{os.path.basename(video_file)}"'
+    )
+    # the temporary file is created private, keep the permissions of the video
+    shutil.copymode(video_file, output_file)
+    os.replace(output_file, video_file)
+    return True
 
 
 def execute_mkvmerge(
@@ -196,76 +1645,67 @@ def execute_mkvmerge(
     languages,
     subs,
     extension=".mkv",
+    show_progress=True,
+    journal=None,
+    edit_options=(),
 ):
     """
-    Execute the mkvmerge command to merge the input file with the subtitle file.
+    Execute the mkvmerge command to merge the input file with the subtitle files.
 
     Args:
-        input_file (str): The path of the input video file.
-        subtitle_file (str): The path of the subtitle file.
+        subsFolder (bool): Flag indicating whether the subtitles are in a "subs" subfolder.
+        input_file (str): The name of the input video file without extension.
+        directory (str): The directory where the video file is located.
+        languages (list): The language code of each subtitle file.
+        subs (list): The names of the subtitle files.
+        extension (str): The extension of the video file.
+        show_progress (bool): Whether to print the mkvmerge progress.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+        edit_options (list, optional): The mkvmerge options that change the metadata of
+            the video, see EditBatch.mkvmerge_options.
 
     Returns:
         bool: True if the command execution was successful, False otherwise.
     """
-    output_file = f"temp{extension}"
-    languagesCommand = ""
-    default = ""
-    for i, language in enumerate(languages):
-        if language == "es":
-            default = f' --default-track 0:yes --track-name 0:"Español"'
-        else:
-            default = ""
-        if subsFolder:
-            languagesCommand += (
-                f' {default} --language 0:{language} subs/"{subs[i][1]}"'
-            )
-        else:
-            languagesCommand += f' {default} --language 0:{language} "{subs[i][1]}"'
-    change_dir = "cd /d"
-    if os.name != "nt":
-        change_dir = "cd"
-    command = f'{change_dir} {directory} && mkvmerge -o {output_file} "{input_file}{extension}" {languagesCommand}'
+    from asyncRunner import parse_gui_line
+
+    command, output_file, video_file, size, tags_files = build_mkvmerge_command(
+        subsFolder,
+        input_file,
+        directory,
+        languages,
+        subs,
+        extension,
+        journal,
+        edit_options,
+    )
+    returncode = None
     try:
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        )
-        # Read and process the output line by line
-        for line in process.stdout:
-            # Process the output to extract progress information
-            if "progreso" in line.lower() or "progress" in line.lower():
-                # print in the same line
-                print(f"\r{line.strip()}", end="")
-            elif (
-                "el multiplexado tard" in line.lower() or "muxing took" in line.lower()
-            ):
-                print("")
-                print(line.strip())
-            elif "error" in line.lower() or "fatal" in line.lower():
-                print("")
-                print(f"Error: {line.strip()}")
-                return False
-        # Wait for the process to finish
-        process.wait()
-        # Check the return code
-        # if process.returncode != 0:
-        #     print(f"Error executing the command: {command}")
-        #     return False
-        directory = str(Path(directory))  # normalize
-        src = f'{output_file}'
-        dst = f'{input_file}{extension}'
-        print(f'\nMoving "{src}" to "{dst}"')
-        if os.name == "nt":  # Windows
-            cmd = f'{change_dir} "{directory}" && move /Y "{src}" "{dst}"'
-        else:                # Linux/macOS
-            cmd = f'{change_dir} "{directory}" && mv -f "{src}" "{dst}"'
-        subprocess.run(
-            cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-        return True
-    except subprocess.CalledProcessError:
-        print(f"Error executing the command: {command}")
-        return False
+        start = time.perf_counter()
+        with metrics.stage("mux", video_file, size=size, subprocesses=1):
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+            # Read and process the output line by line
+            for line in process.stdout:
+                kind, value = parse_gui_line(line)
+                if kind == "progress":
+                    # print in the same line
+                    if show_progress:
+                        print(f"\rProgress: {value}%", end="")
+                elif kind in ("error", "warning"):
+                    if show_progress:
+                        print("")
+                    print(f"{kind.capitalize()}: {value}")
+            returncode = process.wait()
+        if show_progress:
+            print("")
+        print(f"Muxing took {time.perf_counter() - start:.1f} seconds.")
+    except OSError as e:
+        print(f"Error executing the command: {e}")
+    return finalize_mkvmerge(returncode, output_file, video_file, journal, tags_files)
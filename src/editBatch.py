@@ -0,0 +1,176 @@
+import time
+from decouple import config
+import metrics
+from matroska import MatroskaError, edit_header
+
+
+class EditBatch:
+    """
+    Collects the mkvpropedit changes planned for a MKV file so all of them are written
+    with a single mkvpropedit call, instead of one process (and one header rewrite) per change.
+
+    Args:
+        input_file (str): The path of the MKV file to edit.
+    """
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.title = None
+        self.track_names = {}
+        self.attachments = []
+
+    def to_dict(self):
+        """
+        Get the planned changes as a JSON serializable dict.
+
+        Returns:
+            dict: The file, title, track names and attachments to delete.
+        """
+        return {
+            "file": self.input_file,
+            "title": self.title,
+            "track_names": {str(k): v for k, v in self.track_names.items()},
+            "attachments": list(self.attachments),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a batch from the dict returned by to_dict.
+
+        Args:
+            data (dict): The planned changes.
+
+        Returns:
+            EditBatch: The batch with the planned changes.
+        """
+        batch = cls(data["file"])
+        batch.title = data.get("title")
+        for track_number, name in data.get("track_names", {}).items():
+            batch.set_track_name(int(track_number), name)
+        for attachment_id in data.get("attachments", []):
+            batch.delete_attachment(attachment_id)
+        return batch
+
+    def set_title(self, title):
+        """
+        Plan a change of the segment title.
+
+        Args:
+            title (str): The new title.
+        """
+        self.title = title
+
+    def set_track_name(self, track_number, name):
+        """
+        Plan a change of a track name.
+
+        Args:
+            track_number (int): The track number (not the mkvmerge track ID).
+            name (str): The new name of the track.
+        """
+        self.track_names[track_number] = name
+
+    def delete_attachment(self, attachment_id):
+        """
+        Plan the removal of an attachment.
+
+        Args:
+            attachment_id (int): The attachment ID, as shown by mkvmerge -J.
+        """
+        if attachment_id not in self.attachments:
+            self.attachments.append(attachment_id)
+
+    def is_empty(self):
+        """
+        Check if there are no planned changes.
+
+        Returns:
+            bool: True if nothing has to be written, False otherwise.
+        """
+        return self.title is None and not self.track_names and not self.attachments
+
+    def command(self):
+        """
+        Build the mkvpropedit command with all the planned changes.
+
+        Returns:
+            list: The mkvpropedit command and its arguments.
+        """
+        command = ["mkvpropedit", self.input_file]
+        if self.title is not None:
+            command += ["--edit", "info", "--set", f"title={self.title}"]
+        for track_number, name in self.track_names.items():
+            command += ["--edit", f"track:@{track_number}", "--set", f"name={name}"]
+        for attachment_id in self.attachments:
+            command += ["--delete-attachment", f"{attachment_id}"]
+        return command
+
+    def mkvmerge_options(self, info):
+        """
+        Build the mkvmerge options that write the planned changes while the file is remuxed.
+
+        The options go before the file in the mkvmerge command.
+
+        Args:
+            info (MkvInfo): The probed metadata of the file, to find the mkvmerge track ID
+                of each track number.
+
+        Returns:
+            list: The mkvmerge options.
+        """
+        track_ids = {track.number: track.id for track in info.tracks}
+        options = []
+        if self.title is not None:
+            options += ["--title", self.title]
+        for track_number, name in self.track_names.items():
+            options += ["--track-name", f"{track_ids[track_number]}:{name}"]
+        if self.attachments:
+            # copy all the attachments except these ones
+            options += ["--attachments", "!" + ",".join(map(str, self.attachments))]
+        return options
+
+    def _apply_in_place(self):
+        """
+        Write the title and track names without mkvpropedit, see matroska.edit_header.
+
+        Returns:
+            bool: True if the changes were written, False if mkvpropedit has to write them.
+        """
+        if self.attachments or not config("NATIVE_EDIT", default=False, cast=bool):
+            return False
+        start = time.perf_counter()
+        try:
+            written = edit_header(self.input_file, self.title, self.track_names)
+        except (MatroskaError, OSError):
+            return False
+        if written:
+            # the files left to mkvpropedit are only counted once, by metrics.run
+            metrics.record("edit", self.input_file, time.perf_counter() - start)
+        return written
+
+    def apply(self):
+        """
+        Write all the planned changes to the file with one mkvpropedit call.
+
+        With NATIVE_EDIT=True, a title and track names that fit in the room of the header
+        (and its padding) are written in place without starting mkvpropedit.
+
+        Returns:
+            bool: True if the changes were written (or there was nothing to write), False otherwise.
+        """
+        if self.is_empty() or self._apply_in_place():
+            return True
+        result = metrics.run(
+            self.command(),
+            "edit",
+            self.input_file,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+        )
+        # mkvpropedit exits with 1 when there were only warnings
+        if result.returncode > 1:
+            print(f"Error editing {self.input_file}: {result.stdout.strip()}")
+            return False
+        return True
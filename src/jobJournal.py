@@ -0,0 +1,198 @@
+import json, os, socket, sqlite3, threading, time, uuid
+
+
+class JobJournal:
+    """
+    On-disk journal of the step each file of a run reached, so an interrupted run resumes.
+
+    The steps of a video are planned, probing, muxing, muxed, finalized and subs-deleted,
+    and the steps of a metadata change are probing, editing and finalized. Each step is
+    committed before the next one starts. The journal of a kind of run (e.g. "mux") is
+    cleared when the run finishes, and when the run is started again with a different
+    key (e.g. other keywords), since the saved steps don't apply to it.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        kind (str): The kind of run ("edit", "mux", "plan-edit" or "plan-mux").
+        key (str): The settings of the run the saved steps belong to.
+    """
+
+    def __init__(self, db_path, kind, key=""):
+        self.kind = kind
+        # the pid alone is not enough, a restarted container gets the same one
+        self._owner = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "run": uuid.uuid4().hex,
+        }
+        self._lock = threading.Lock()
+        # the state folder may be shared by the containers of a work queue
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False
+        )
+        self._connection.executescript(
+            """CREATE TABLE IF NOT EXISTS runs (
+                kind TEXT PRIMARY KEY,
+                key TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                detail TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (kind, path)
+            )"""
+        )
+        row = self._connection.execute(
+            "SELECT key FROM runs WHERE kind = ?", (kind,)
+        ).fetchone()
+        if row is None or row[0] != key:
+            self._connection.execute("DELETE FROM jobs WHERE kind = ?", (kind,))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?)", (kind, key)
+            )
+        self._connection.commit()
+
+    def get(self, file_path):
+        """
+        Get the last step saved for a file.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            dict: The step in "state" and the details saved with it, or None if the file
+                has no step saved.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state, detail FROM jobs WHERE kind = ? AND path = ?",
+                (self.kind, os.path.abspath(file_path)),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[1]), state=row[0])
+
+    def update(self, file_path, state, **detail):
+        """
+        Save the step a file reached, keeping the details saved with the previous steps.
+
+        Args:
+            file_path (str): The path of the file.
+            state (str): The step.
+            **detail: Values to save with the step (e.g. the temporary output file).
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT detail FROM jobs WHERE kind = ? AND path = ?",
+                (self.kind, path),
+            ).fetchone()
+            saved = json.loads(row[0]) if row else {}
+            saved.update(self._owner, **detail)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                (self.kind, path, state, json.dumps(saved), time.time()),
+            )
+            self._connection.commit()
+
+    def finish(self, file_path, state="finalized"):
+        """
+        Save the last step of a file together with its size and modification time.
+
+        Args:
+            file_path (str): The path of the file.
+            state (str): The step.
+        """
+        stat = os.stat(file_path)
+        self.update(file_path, state, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def is_finished(self, file_path, state="finalized"):
+        """
+        Check if a file reached its last step and did not change since then.
+
+        Args:
+            file_path (str): The path of the file.
+            state (str): The last step.
+
+        Returns:
+            bool: True if the file can be skipped, False otherwise.
+        """
+        entry = self.get(file_path)
+        if entry is None or entry["state"] != state:
+            return False
+        stat = os.stat(file_path)
+        return (entry.get("size"), entry.get("mtime_ns")) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def forget(self, file_path):
+        """
+        Remove the saved steps of a file.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM jobs WHERE kind = ? AND path = ?",
+                (self.kind, os.path.abspath(file_path)),
+            )
+            self._connection.commit()
+
+    def entries(self, *states):
+        """
+        Get the files whose last step is one of the given ones.
+
+        Args:
+            *states (str): The steps. All the files are returned if none is given.
+
+        Returns:
+            list: The path and the step (like get returns it) of each file.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, state, detail FROM jobs WHERE kind = ?", (self.kind,)
+            ).fetchall()
+        return [
+            (path, dict(json.loads(detail), state=state))
+            for path, state, detail in rows
+            if not states or state in states
+        ]
+
+    def is_running(self, entry):
+        """
+        Check if the process that saved a step may still be working on the file.
+
+        Args:
+            entry (dict): The step returned by get or entries.
+
+        Returns:
+            bool: True if the process is alive (or runs on another host), False otherwise.
+        """
+        if entry.get("run") == self._owner["run"]:
+            return True
+        if entry.get("host") != self._owner["host"]:
+            return True
+        if entry.get("pid") == self._owner["pid"]:
+            return False
+        if os.name == "nt":
+            # os.kill would terminate the process on Windows
+            return True
+        try:
+            os.kill(entry["pid"], 0)
+        except (OSError, KeyError, TypeError):
+            return False
+        return True
+
+    def clear(self):
+        """Remove the saved steps of all the files, once the run is finished."""
+        with self._lock:
+            self._connection.execute("DELETE FROM jobs WHERE kind = ?", (self.kind,))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
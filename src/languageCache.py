@@ -0,0 +1,142 @@
+import hashlib, os, sqlite3, threading, time
+from decouple import config
+from utils import get_user_cache_dir
+
+
+class LanguageCache:
+    """
+    On-disk cache of the languages detected in the sampled text of the subtitle files.
+
+    A subtitle is identified by a hash of its sampled dialogue and the version of the
+    detector, not by its path, so the same subtitle found again (in a retried mux, or
+    in another library) is not detected again, and a change to the detector or its
+    settings makes all the subtitles be detected again. Once the cache has more than
+    max_entries subtitles, the least recently used ones are removed.
+
+    The lookups are only read from the database, and the new languages and the use of
+    the cached ones are written at once by flush, so the database is never locked while
+    the languages are detected.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        version (str): The version of the detector and its settings.
+        max_entries (int): The maximum number of subtitles kept.
+    """
+
+    def __init__(self, db_path, version, max_entries):
+        self.version = version
+        self.max_entries = max_entries
+        self._pending = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        # the state folder may be shared by the containers of a work queue
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False
+        )
+        self._connection.executescript(
+            """CREATE TABLE IF NOT EXISTS languages (
+                key TEXT PRIMARY KEY,
+                language TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS languages_used ON languages (used)"""
+        )
+        self._connection.commit()
+
+    def key(self, text):
+        """
+        Get the key of a sampled text for the current detector.
+
+        Args:
+            text (str): The sampled dialogue of a subtitle.
+
+        Returns:
+            str: The hex SHA-256 of the detector version and the text.
+        """
+        return hashlib.sha256(f"{self.version}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """
+        Get the language detected before in a sampled text.
+
+        Args:
+            text (str): The sampled dialogue of a subtitle.
+
+        Returns:
+            tuple: The language code and the confidence, or None if the text is not cached.
+        """
+        key = self.key(text)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            row = self._connection.execute(
+                "SELECT language, confidence FROM languages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._used.add(key)
+        return row
+
+    def put(self, text, language, confidence):
+        """
+        Save the language detected in a sampled text. It is written by flush.
+
+        Args:
+            text (str): The sampled dialogue of a subtitle.
+            language (str): The detected language code.
+            confidence (float): The confidence of the detection.
+        """
+        with self._lock:
+            self._pending[self.key(text)] = (language, confidence)
+
+    def flush(self):
+        """Write the new languages and the use of the cached ones, and trim the cache."""
+        with self._lock:
+            if not self._pending and not self._used:
+                return
+            now = time.time()
+            self._connection.executemany(
+                "UPDATE languages SET used = ? WHERE key = ?",
+                [(now, key) for key in self._used],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO languages VALUES (?, ?, ?, ?)",
+                [
+                    (key, language, confidence, now)
+                    for key, (language, confidence) in self._pending.items()
+                ],
+            )
+            self._connection.execute(
+                "DELETE FROM languages WHERE key IN (SELECT key FROM languages "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+            self._pending.clear()
+            self._used.clear()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+
+def open_language_cache(version):
+    """
+    Open the language cache, saved as languages.sqlite in the user cache folder so it is
+    shared by all the libraries.
+
+    Args:
+        version (str): The version of the detector and its settings.
+
+    Returns:
+        LanguageCache: The cache, or None if DETECT_CACHE_SIZE is 0.
+    """
+    max_entries = config("DETECT_CACHE_SIZE", default=100000, cast=int)
+    if max_entries <= 0:
+        return None
+    cache_dir = get_user_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    return LanguageCache(
+        os.path.join(cache_dir, "languages.sqlite"), version, max_entries
+    )
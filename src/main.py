@@ -1,34 +1,248 @@
-import os
+import json, os
+import metrics
 from menu import mainMenu
 from decouple import config
-from utils import create_env_file, check_mkv_toolnix_installed
-from metaDataChanges import remove_attachment_by_name, replace_track_names
-from detectLanguage import read_srt_files
+from utils import (
+    create_env_file,
+    check_mkv_toolnix_installed,
+    KeywordMatcher,
+    get_state_dir,
+)
+from metaDataChanges import is_clean_after, plan_file_edits
+from metadataCache import MetadataCache
+from jobJournal import JobJournal
+from workQueue import file_signature, open_queue
+from scanner import scan_files, get_scan_options
+from workerPool import get_workers, run_pool
+
+# The modules of the other options (detectLanguage loads langdetect, the planner and the
+# watcher) are imported only when they are used, so option 1 starts faster.
+
+
+def process_file(input_file, keywords, new_name, cache=None, journal=None):
+    """
+    Process a single MKV file by removing the matching attachments and replacing the track names.
+
+    The file is probed once and all its changes are written at the end with a single mkvpropedit call.
+
+    Args:
+        input_file (str): The path of the MKV file.
+        keywords (list or KeywordMatcher): The keywords to search for in the track names.
+        new_name (str): The new name to replace the matched keywords in the track names.
+        cache (MetadataCache, optional): The cache where the file is saved once it is clean.
+        journal (JobJournal, optional): The journal where the steps of the file are saved.
+
+    Returns:
+        bool: True if the file was changed, False otherwise.
+    """
+    filename = os.path.basename(input_file)
+    keywords = KeywordMatcher.of(keywords)
+    if journal is not None:
+        journal.update(input_file, "probing")
+    batch, info = plan_file_edits(input_file, keywords, new_name)
+    changed = not batch.is_empty()
+    if changed and journal is not None:
+        journal.update(input_file, "editing")
+    if changed and not batch.apply():
+        raise Exception(f"Could not write the changes to {filename}")
+    if journal is not None:
+        journal.finish(input_file)
+    if cache is not None and is_clean_after(batch, info, keywords):
+        cache.mark_clean(input_file)
+    print(f"--------------- Processed {filename} ---------------")
+    return changed
 
 
 def process_directory(directory, keywords, new_name):
     """
-    Process all MKV files in the specified directory by replacing track names.
+    Process all MKV files in the specified directory and its subfolders by replacing track names.
+
+    The files are processed in parallel by a pool of workers, the size of the pool
+    is taken from the WORKERS env var and defaults to the number of CPU cores.
+    The files are handed to the pool as soon as the scanner finds them.
+    Files that were already verified clean and did not change since then are skipped,
+    unless the CACHE env var is set to False. The files a previous run finished before
+    it was interrupted are skipped too. When the QUEUE_DIR env var is set, the files are
+    shared with the other workers that use the same queue, and each one is processed by
+    only one of them. When the INDEX_QUERY env var is set, only the files of the track
+    index that match the query are processed.
 
     Args:
         directory (str): The directory path where the MKV files are located.
-        keywords (list): A list of keywords to search for in the track names.
+        keywords (list or KeywordMatcher): The keywords to search for in the track names.
         new_name (str): The new name to replace the matched keywords in the track names.
 
     Returns:
         None
     """
-    flag = True
-    for filename in os.listdir(directory):
-        if filename.endswith(".mkv"):
-            flag = False
-            input_file = os.path.join(directory, filename)
-            output_file = os.path.join(directory, f"modified_{filename}")
-            remove_attachment_by_name(input_file, words_to_remove)
-            replace_track_names(input_file, output_file, keywords, new_name)
-            print(f"--------------- Processed {filename} ---------------")
-    if flag:
+    keywords = KeywordMatcher.of(keywords)
+    cache = None
+    if config("CACHE", default=True, cast=bool):
+        cache = MetadataCache(
+            os.path.join(get_state_dir(directory), "cache.sqlite"), keywords
+        )
+    settings = json.dumps([keywords.keywords, new_name])
+    journal = JobJournal(
+        os.path.join(get_state_dir(directory), "journal.sqlite"), "edit", settings
+    )
+    queue = None
+    skipped = 0
+
+    def library_files():
+        query = config("INDEX_QUERY", default="")
+        if not query:
+            return scan_files(directory, (".mkv",), **get_scan_options())
+        from trackIndex import select_files
+
+        return select_files(directory, query)
+
+    def pending_files():
+        nonlocal skipped
+        found = []
+        for input_file in library_files():
+            if (cache is not None and cache.is_clean(input_file)) or journal.is_finished(
+                input_file
+            ):
+                skipped += 1
+            elif queue is None:
+                yield input_file
+            else:
+                found.append((input_file, file_signature(input_file)))
+        if queue is not None:
+            queue.add(found)
+            yield from queue.claims()
+
+    def process(input_file):
+        if queue is None:
+            return process_file(input_file, keywords, new_name, cache, journal)
+        try:
+            changed = process_file(input_file, keywords, new_name, cache, journal)
+        except Exception:
+            queue.release(input_file)
+            raise
+        queue.complete(input_file, file_signature(input_file))
+        return changed
+
+    workers = get_workers(config("WORKERS", default=None))
+    try:
+        queue = open_queue(directory, "edit", settings)
+        results = run_pool(process, pending_files(), workers)
+        # the other workers may still be working on their files
+        if queue is None or queue.is_drained():
+            journal.clear()
+    finally:
+        if queue is not None:
+            queue.close()
+        journal.close()
+        if cache is not None:
+            cache.close()
+    if not results and not skipped:
         print("No MKV files found in the specified directory.")
+        return
+    changed = sum(1 for _, result, error in results if error is None and result)
+    failed = [item for item, _, error in results if error is not None]
+    print(
+        f"--------------- Summary: {len(results) + skipped} files, {changed} changed, "
+        f"{len(results) - changed - len(failed)} unchanged, {skipped} skipped (cached or done), "
+        f"{len(failed)} failed ---------------"
+    )
+    for item in failed:
+        print(f"Failed: {os.path.basename(item)}")
+
+
+def clean_and_mux_directory(directory, keywords, new_name):
+    """
+    Run options 2 and 1 together, writing each video only once.
+
+    The videos with subtitles to add are remuxed by a single mkvmerge call that also
+    writes their cleaned title and track names and leaves out the matching attachments.
+    Then the other MKV files (the ones without new subtitles) are cleaned like option 1
+    does. The remuxed videos left clean are saved in the metadata cache by the remux, so
+    they are skipped without being probed again (unless CACHE is False).
+
+    Args:
+        directory (str): The library directory.
+        keywords (list or KeywordMatcher): The keywords to search for in the track names.
+        new_name (str): The new name to replace the matched keywords in the track names.
+
+    Returns:
+        None
+    """
+    from detectLanguage import read_srt_files
+
+    keywords = KeywordMatcher.of(keywords)
+    read_srt_files(directory, (keywords, new_name))
+    process_directory(directory, keywords, new_name)
+
+
+def watch_directory(directory, option, new_name):
+    """
+    Run option 1 or option 2 on each new file that lands in the library, until interrupted.
+
+    Args:
+        directory (str): The library directory.
+        option (str): "1" to change the metadata of new MKV files, "2" to add new subtitles.
+        new_name (str): The new name to replace the matched keywords in the track names.
+
+    Returns:
+        None
+    """
+    from watcher import watch
+
+    if option == "1":
+        keywords = load_keywords()
+        cache = None
+        if config("CACHE", default=True, cast=bool):
+            cache = MetadataCache(
+                os.path.join(get_state_dir(directory), "cache.sqlite"), keywords
+            )
+
+        def handle(input_file):
+            # our own edits are reported as changes too, the cache skips them
+            if cache is None or not cache.is_clean(input_file):
+                process_file(input_file, keywords, new_name, cache)
+
+        watch(directory, (".mkv",), handle)
+    else:
+        from detectLanguage import (
+            ask_delete_subs,
+            add_subtitles_to_group,
+            subtitle_group_key,
+            subtitle_group_subs,
+            VIDEO_EXTENSIONS,
+            SUBTITLE_EXTENSIONS,
+        )
+
+        deleteSubs = ask_delete_subs()
+        added = {}
+
+        def handle(key):
+            # the muxed video is reported as a change too, don't add the same subtitles again
+            subs = subtitle_group_subs(key)
+            if subs and added.get(key) != subs and add_subtitles_to_group(key, deleteSubs):
+                added[key] = subs
+
+        watch(
+            directory,
+            VIDEO_EXTENSIONS + SUBTITLE_EXTENSIONS,
+            handle,
+            key=subtitle_group_key,
+        )
+
+
+def load_keywords():
+    """
+    Read the keywords from the KEYWORDS env var.
+
+    Returns:
+        KeywordMatcher: The matcher built from the keywords.
+    """
+    words_to_remove = config("KEYWORDS")
+    words_to_remove = words_to_remove.split(",")
+    # check if the user has entered the keywords
+    if " Word1" in words_to_remove:
+        raise Exception("Please enter the keywords in the .env file")
+    return KeywordMatcher(words_to_remove)
 
 
 if __name__ == "__main__":
@@ -40,15 +254,36 @@ if __name__ == "__main__":
             )
         create_env_file()
         dirPath, new_name, option = mainMenu()
-        if option == "1":
-            words_to_remove = config("KEYWORDS")
-            words_to_remove = words_to_remove.split(",")
-            # check if the user has entered the keywords
-            if " Word1" in words_to_remove:
-                raise Exception("Please enter the keywords in the .env file")
-            process_directory(dirPath, words_to_remove, new_name)
+        if config("WATCH", default=False, cast=bool) and option in ["1", "2"]:
+            watch_directory(dirPath, option, new_name)
+        elif option == "1":
+            process_directory(dirPath, load_keywords(), new_name)
         elif option == "2":
+            from detectLanguage import read_srt_files
+
             read_srt_files(dirPath)
+        elif option == "3":
+            from planner import create_plan, get_plan_file
+
+            plan = config("PLAN", default="edits,subtitles")
+            keywords = load_keywords() if "edits" in plan else []
+            plan_file = get_plan_file(get_state_dir(dirPath))
+            create_plan(dirPath, keywords, new_name, plan_file)
+        elif option == "4":
+            from planner import apply_plan, get_plan_file
+
+            apply_plan(get_plan_file(get_state_dir(dirPath)))
+        elif option == "5":
+            from trackIndex import update_index
+
+            update_index(dirPath)
+        elif option == "6":
+            clean_and_mux_directory(dirPath, load_keywords(), new_name)
+        metrics.export(
+            config("METRICS_FILE", default="")
+            or os.path.join(get_state_dir(dirPath), "metrics.json"),
+            config("PROMETHEUS_TEXTFILE", default=None),
+        )
     except Exception as e:
         if "'NoneType' object has no attribute 'split'" in str(e):
             print("Please change the .env configuration file")
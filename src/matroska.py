@@ -0,0 +1,575 @@
+import mmap, os, zlib
+
+# EBML and Matroska element IDs (https://www.matroska.org/technical/elements.html)
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TITLE = 0x7BA9
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+ATTACHMENTS = 0x1941A469
+ATTACHED_FILE = 0x61A7
+FILE_NAME = 0x466E
+FILE_MIME_TYPE = 0x4660
+TAGS = 0x1254C367
+TAG = 0x7373
+TARGETS = 0x63C0
+TAG_TRACK_UID = 0x63C5
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+
+# The track types mkvmerge reports, a file with other tracks is left to mkvmerge
+TRACK_TYPES = {1: "video", 2: "audio", 0x11: "subtitles", 0x12: "buttons"}
+_HEADER_ELEMENTS = (INFO, TRACKS, ATTACHMENTS, TAGS)
+
+
+class MatroskaError(Exception):
+    """The file is not a Matroska file, or its header can't be read by this reader."""
+
+
+def read_id(data, pos):
+    """
+    Read an EBML element ID, keeping its length marker like the specification writes it.
+
+    Args:
+        data (bytes): The buffer.
+        pos (int): The position of the ID.
+
+    Returns:
+        tuple: The ID and the position after it.
+
+    >>> read_id(bytes([0x1A, 0x45, 0xDF, 0xA3]), 0) == (EBML, 4)
+    True
+    """
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if length > 4:
+        raise MatroskaError(f"Invalid element ID at byte {pos}")
+    return int.from_bytes(data[pos : pos + length], "big"), pos + length
+
+
+def read_size(data, pos):
+    """
+    Read an EBML element size.
+
+    Args:
+        data (bytes): The buffer.
+        pos (int): The position of the size.
+
+    Returns:
+        tuple: The size (None if it is unknown) and the position after it.
+
+    >>> read_size(bytes([0x81]), 0), read_size(bytes([0x40, 0x02]), 0)
+    ((1, 1), (2, 2))
+    >>> read_size(bytes([0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]), 0)
+    (None, 8)
+    """
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if length > 8:
+        raise MatroskaError(f"Invalid element size at byte {pos}")
+    value = first & ((1 << (8 - length)) - 1)
+    for byte in data[pos + 1 : pos + length]:
+        value = value << 8 | byte
+    if value == (1 << (7 * length)) - 1:
+        return None, pos + length
+    return value, pos + length
+
+
+def read_element(data, pos, end):
+    """
+    Read the header of the element at a position.
+
+    Args:
+        data (bytes): The buffer.
+        pos (int): The position of the element.
+        end (int): The end of its parent element.
+
+    Returns:
+        tuple: The ID, the start and the end of the element data. The end is None if
+            the element has an unknown size.
+    """
+    element_id, pos = read_id(data, pos)
+    size, pos = read_size(data, pos)
+    if size is not None and pos + size > end:
+        raise MatroskaError(f"Element {element_id:X} ends after its parent")
+    return element_id, pos, None if size is None else pos + size
+
+
+def children(data, start, end):
+    """
+    Iterate over the children of an element, skipping the Void and CRC-32 elements.
+
+    Args:
+        data (bytes): The buffer.
+        start (int): The start of the element data.
+        end (int): The end of the element data.
+
+    Yields:
+        tuple: The ID, the start and the end of the data of each child.
+    """
+    pos = start
+    while pos < end:
+        element_id, data_start, data_end = read_element(data, pos, end)
+        if data_end is None:
+            raise MatroskaError(f"Element {element_id:X} has an unknown size")
+        if element_id not in (VOID, CRC32):
+            yield element_id, data_start, data_end
+        pos = data_end
+
+
+def _uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _text(data, start, end):
+    # strings may be padded with zeros
+    return bytes(data[start:end]).rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+def _find_header_elements(data, segment_start, segment_end):
+    """
+    Find the Info, Tracks, Attachments and Tags elements of the segment, returning the
+    start of each element and the start and end of its data.
+    """
+    found = {}
+    seek_heads = []
+    pos = segment_start
+    # the elements before the first cluster are read in order, the SeekHead gives the
+    # position of the ones written after the clusters
+    while pos < segment_end:
+        # the last cluster of a file that is still being written may end after the file
+        if read_id(data, pos)[0] == CLUSTER:
+            break
+        element_id, data_start, data_end = read_element(data, pos, segment_end)
+        if data_end is None:
+            break
+        if element_id == SEEK_HEAD:
+            seek_heads.append((data_start, data_end))
+        elif element_id in _HEADER_ELEMENTS:
+            found.setdefault(element_id, (pos, data_start, data_end))
+        pos = data_end
+    read_seek_heads = set()
+    while seek_heads:
+        start, end = seek_heads.pop()
+        if start in read_seek_heads:
+            continue
+        read_seek_heads.add(start)
+        for element_id, seek_start, seek_end in children(data, start, end):
+            if element_id != SEEK:
+                continue
+            target, position = None, None
+            for child_id, child_start, child_end in children(
+                data, seek_start, seek_end
+            ):
+                if child_id == SEEK_ID:
+                    target = _uint(data, child_start, child_end)
+                elif child_id == SEEK_POSITION:
+                    position = segment_start + _uint(data, child_start, child_end)
+            if target in found or position is None:
+                continue
+            if target not in _HEADER_ELEMENTS and target != SEEK_HEAD:
+                continue
+            element_id, data_start, data_end = read_element(data, position, segment_end)
+            if element_id != target or data_end is None:
+                raise MatroskaError(f"The SeekHead entry of {target:X} is wrong")
+            if target == SEEK_HEAD:
+                seek_heads.append((data_start, data_end))
+            else:
+                found[target] = (position, data_start, data_end)
+    return found
+
+
+def _read_tracks(data, start, end):
+    tracks = []
+    for element_id, entry_start, entry_end in children(data, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+        # the defaults of the specification
+        entry = {"language": "eng"}
+        for child_id, child_start, child_end in children(data, entry_start, entry_end):
+            if child_id == TRACK_NUMBER:
+                entry["number"] = _uint(data, child_start, child_end)
+            elif child_id == TRACK_UID:
+                entry["uid"] = _uint(data, child_start, child_end)
+            elif child_id == TRACK_TYPE:
+                entry["type"] = _uint(data, child_start, child_end)
+            elif child_id == CODEC_ID:
+                entry["codec_id"] = _text(data, child_start, child_end)
+            elif child_id == NAME:
+                entry["track_name"] = _text(data, child_start, child_end)
+            elif child_id == LANGUAGE:
+                entry["language"] = _text(data, child_start, child_end)
+            elif child_id == LANGUAGE_BCP47:
+                entry["language_ietf"] = _text(data, child_start, child_end)
+        if entry.get("type") not in TRACK_TYPES or "number" not in entry:
+            raise MatroskaError("The file has a track mkvmerge may not report")
+        tracks.append(entry)
+    return tracks
+
+
+def _read_track_tags(data, start, end):
+    """
+    Get the NUMBER_OF_FRAMES statistics tag and the tags written by the renamer
+    (METADATARENAMER_*) of each track UID.
+    """
+    tags = {}
+    for element_id, tag_start, tag_end in children(data, start, end):
+        if element_id != TAG:
+            continue
+        uids, values = [], {}
+        for child_id, child_start, child_end in children(data, tag_start, tag_end):
+            if child_id == TARGETS:
+                uids += [
+                    _uint(data, s, e)
+                    for target_id, s, e in children(data, child_start, child_end)
+                    if target_id == TAG_TRACK_UID
+                ]
+            elif child_id == SIMPLE_TAG:
+                name, value = None, None
+                for simple_id, s, e in children(data, child_start, child_end):
+                    if simple_id == TAG_NAME:
+                        name = _text(data, s, e)
+                    elif simple_id == TAG_STRING:
+                        value = _text(data, s, e)
+                if name == "NUMBER_OF_FRAMES" and value and value.isdigit():
+                    values["tag_number_of_frames"] = int(value)
+                elif name and name.startswith("METADATARENAMER_") and value is not None:
+                    values[f"tag_{name.lower()}"] = value
+        for uid in uids:
+            tags.setdefault(uid, {}).update(values)
+    return tags
+
+
+def _read_attachments(data, start, end):
+    attachments = []
+    for element_id, file_start, file_end in children(data, start, end):
+        if element_id != ATTACHED_FILE:
+            continue
+        attachment = {"id": len(attachments) + 1, "file_name": "", "content_type": ""}
+        for child_id, child_start, child_end in children(data, file_start, file_end):
+            if child_id == FILE_NAME:
+                attachment["file_name"] = _text(data, child_start, child_end)
+            elif child_id == FILE_MIME_TYPE:
+                attachment["content_type"] = _text(data, child_start, child_end)
+        attachments.append(attachment)
+    return attachments
+
+
+def _segment(data):
+    """Check the EBML header and find the end of the segment and its header elements."""
+    element_id, start, end = read_element(data, 0, len(data))
+    if element_id != EBML or end is None:
+        raise MatroskaError("Not an EBML file")
+    doc_type = next(
+        (
+            _text(data, s, e)
+            for child, s, e in children(data, start, end)
+            if child == DOC_TYPE
+        ),
+        "matroska",
+    )
+    if doc_type not in ("matroska", "webm"):
+        raise MatroskaError(f"Unsupported document type {doc_type}")
+    element_id, segment_start, segment_end = read_element(data, end, len(data))
+    if element_id != SEGMENT:
+        raise MatroskaError("The file has no Segment")
+    segment_end = segment_end or len(data)
+    return segment_end, _find_header_elements(data, segment_start, segment_end)
+
+
+def _identify(data):
+    _, found = _segment(data)
+    if TRACKS not in found:
+        raise MatroskaError("The file has no Tracks element before its clusters")
+
+    title = ""
+    if INFO in found:
+        title = next(
+            (
+                _text(data, s, e)
+                for child, s, e in children(data, *found[INFO][1:])
+                if child == TITLE
+            ),
+            "",
+        )
+    tags = _read_track_tags(data, *found[TAGS][1:]) if TAGS in found else {}
+    tracks = []
+    for i, entry in enumerate(_read_tracks(data, *found[TRACKS][1:])):
+        properties = {
+            key: entry[key]
+            for key in ("number", "codec_id", "track_name", "language", "language_ietf")
+            if key in entry
+        }
+        properties.update(tags.get(entry.get("uid"), {}))
+        tracks.append(
+            {"id": i, "type": TRACK_TYPES[entry["type"]], "properties": properties}
+        )
+    attachments = (
+        _read_attachments(data, *found[ATTACHMENTS][1:]) if ATTACHMENTS in found else []
+    )
+    return {
+        "container": {"type": "Matroska", "properties": {"title": title}},
+        "tracks": tracks,
+        "attachments": attachments,
+    }
+
+
+def identify(path):
+    """
+    Read the title, tracks and attachments of a Matroska file without running mkvmerge.
+
+    The file is memory-mapped, and only the EBML header, the top-level elements before
+    the first cluster and the elements the SeekHead points to (Info, Tracks, Attachments
+    and Tags) are read, so the pages of the clusters are never touched. Track languages
+    default to "eng" like the specification says, and the frame count of a track is
+    taken from its NUMBER_OF_FRAMES statistics tag. The track tags written by the
+    renamer (like the hash of the subtitles it adds) are returned as tag_* properties
+    too, which mkvmerge -J doesn't show.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        dict: The same structure mkvmerge -J prints for the title, the tracks and the
+            attachments, for parse_identification.
+
+    Raises:
+        MatroskaError: If the file is not a Matroska file or its header can't be read,
+            in which case mkvmerge should be used.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            # an empty file can't be mapped
+            raise MatroskaError(str(e))
+    try:
+        return _identify(data)
+    except (IndexError, ValueError) as e:
+        raise MatroskaError(f"Truncated or damaged header: {e}")
+    finally:
+        data.close()
+
+
+def _encode_size(size, length=None):
+    if length is None:
+        length = 1
+        while size >= (1 << (7 * length)) - 1:
+            length += 1
+    if length > 8 or size >= (1 << (7 * length)) - 1:
+        raise MatroskaError(f"Size {size} doesn't fit in {length} bytes")
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def _encode_element(element_id, payload, size_length=None):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + _encode_size(len(payload), size_length) + payload
+
+
+def _void(length):
+    """Build a Void element of exactly length bytes (at least 2)."""
+    for size_length in range(1, 9):
+        payload = length - 1 - size_length
+        if 0 <= payload < (1 << (7 * size_length)) - 1:
+            return _encode_element(VOID, b"\0" * payload, size_length)
+    raise MatroskaError(f"Can't build a Void element of {length} bytes")
+
+
+def _rebuild(data, element_id, start, end, transform, extra=b""):
+    """
+    Build a master element again from its children, passing each one through transform.
+
+    The Void children are left out (their room goes to the Void written after the
+    element), and the CRC-32 of the element, if it has one, is computed again.
+    """
+    parts, has_crc = [], False
+    pos = start
+    while pos < end:
+        child_id, data_start, data_end = read_element(data, pos, end)
+        if data_end is None:
+            raise MatroskaError(f"Element {child_id:X} has an unknown size")
+        if child_id == CRC32:
+            has_crc = True
+        elif child_id != VOID:
+            parts.append(transform(child_id, pos, data_start, data_end))
+        pos = data_end
+    payload = b"".join(parts) + extra
+    if has_crc:
+        # the CRC-32 covers the other children and is stored little endian
+        payload = _encode_element(CRC32, zlib.crc32(payload).to_bytes(4, "little")) + payload
+    return element_id, payload
+
+
+def _with_child(data, element_id, start, end, child_id, value):
+    """Build a master element again with the given value in one of its string children."""
+    new_child = _encode_element(child_id, value.encode("utf-8"))
+    present = any(c == child_id for c, _, _ in children(data, start, end))
+
+    def transform(found_id, element_start, data_start, data_end):
+        if found_id == child_id:
+            return new_child
+        return bytes(data[element_start:data_end])
+
+    return _rebuild(
+        data, element_id, start, end, transform, b"" if present else new_child
+    )
+
+
+def _place(data, element_start, element_end, segment_end, element_id, payload):
+    """
+    Fit a rebuilt top-level element in the room of the old one and the Void elements
+    after it.
+
+    Returns:
+        bytes: The element and the Void that fills the rest of the room, or None if
+            there is not enough room.
+    """
+    end = element_end
+    while end < segment_end and read_id(data, end)[0] == VOID:
+        _, _, void_end = read_element(data, end, segment_end)
+        if void_end is None:
+            break
+        end = void_end
+    room = end - element_start
+    new = _encode_element(element_id, payload)
+    if len(new) > room:
+        return None
+    if room - len(new) == 1:
+        # a Void needs 2 bytes at least, a longer size takes the extra byte instead
+        size_length = len(_encode_size(len(payload))) + 1
+        if size_length > 8:
+            return None
+        return _encode_element(element_id, payload, size_length)
+    if room > len(new):
+        new += _void(room - len(new))
+    return new
+
+
+def edit_header(path, title=None, track_names=None):
+    """
+    Change the title and track names of a Matroska file in place, without mkvpropedit.
+
+    The Info and Tracks elements are written again at the same position, and the size
+    they gain or lose is taken from or given to the Void elements after them, like
+    mkvpropedit does, so the rest of the file is never moved. CRC-32 elements are
+    computed again. The header is read back after writing it, and the old bytes are
+    restored if it doesn't show the new values.
+
+    Args:
+        path (str): The path of the file.
+        title (str, optional): The new title. The title is not changed if it is None.
+        track_names (dict, optional): The new name of each track number.
+
+    Returns:
+        bool: True if the changes were written, False if there is not enough room
+            after the elements (mkvpropedit has to move them).
+
+    Raises:
+        MatroskaError: If the file is not a Matroska file, its header can't be read,
+            or one of the tracks doesn't exist.
+    """
+    track_names = dict(track_names or {})
+    writes = []
+    with open(path, "r+b") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise MatroskaError(str(e))
+        try:
+            segment_end, found = _segment(data)
+            if title is not None:
+                if INFO not in found:
+                    return False
+                start, data_start, data_end = found[INFO]
+                new = _place(
+                    data,
+                    start,
+                    data_end,
+                    segment_end,
+                    *_with_child(data, INFO, data_start, data_end, TITLE, title),
+                )
+                if new is None:
+                    return False
+                writes.append((start, new, bytes(data[start : start + len(new)])))
+            if track_names:
+                if TRACKS not in found:
+                    raise MatroskaError("The file has no Tracks element")
+                start, data_start, data_end = found[TRACKS]
+                missing = set(track_names)
+
+                def transform(child_id, element_start, entry_start, entry_end):
+                    if child_id == TRACK_ENTRY:
+                        number = next(
+                            (
+                                _uint(data, s, e)
+                                for c, s, e in children(data, entry_start, entry_end)
+                                if c == TRACK_NUMBER
+                            ),
+                            None,
+                        )
+                        if number in track_names:
+                            missing.discard(number)
+                            return _encode_element(
+                                *_with_child(
+                                    data,
+                                    TRACK_ENTRY,
+                                    entry_start,
+                                    entry_end,
+                                    NAME,
+                                    track_names[number],
+                                )
+                            )
+                    return bytes(data[element_start:entry_end])
+
+                rebuilt = _rebuild(data, TRACKS, data_start, data_end, transform)
+                if missing:
+                    raise MatroskaError(f"Tracks {sorted(missing)} don't exist")
+                new = _place(data, start, data_end, segment_end, *rebuilt)
+                if new is None:
+                    return False
+                writes.append((start, new, bytes(data[start : start + len(new)])))
+        except (IndexError, ValueError) as e:
+            raise MatroskaError(f"Truncated or damaged header: {e}")
+        finally:
+            data.close()
+        # each element is replaced with a single write
+        for position, new, _ in writes:
+            f.seek(position)
+            f.write(new)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        info = identify(path)
+        names = {
+            track["properties"]["number"]: track["properties"].get("track_name", "")
+            for track in info["tracks"]
+        }
+        written = (title is None or info["container"]["properties"]["title"] == title) and all(
+            names.get(number) == name for number, name in track_names.items()
+        )
+    except MatroskaError:
+        written = False
+    if not written:
+        with open(path, "r+b") as f:
+            for position, _, old in writes:
+                f.seek(position)
+                f.write(old)
+        raise MatroskaError("The edited header could not be read back, it was restored")
+    return True
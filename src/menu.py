@@ -2,6 +2,19 @@ from decouple import config
 from utils import checkValidPath
 
 
+OPTIONS = ["1", "2", "3", "4", "5", "6"]
+MENU_TEXT = (
+    "What do you want to do?\n"
+    "1. Change the metadata info \n"
+    "2. Add the subtitle to the .mkv file \n"
+    "3. Plan the changes of options 1 and 2 without applying them \n"
+    "4. Apply a saved plan \n"
+    "5. Update the track index and list the files that match INDEX_QUERY \n"
+    "6. Change the metadata info and add the subtitles in a single pass \n"
+    "\nEnter the number of the option: "
+)
+
+
 def mainMenu():
     """
     Displays the main menu and prompts the user to enter the folder path and new name.
@@ -15,22 +28,18 @@ def mainMenu():
     if config("OPTION", default=None):
         option = config("OPTION")
     else:
-        option = input(
-            "What do you want to do?\n1. Change the metadata info \n2. Add the subtitle to the .mkv file \n\nEnter the number of the option: "
-        )
-    while option not in ["1", "2"]:
-        option = input(
-            "What do you want to do?\n1. Change the metadata info \n2. Add the subtitle to the .mkv file \n\nEnter the number of the option: "
-        )
-        if option == "1":
+        option = input(MENU_TEXT)
+    while option not in OPTIONS:
+        option = input(MENU_TEXT)
+        if option in ["1", "3", "6"]:
             new_name = input(
                 "Enter the new name to replace the match keywords(if you leave blank or press enter, it will be replaced with a blank space): "
             )
             break
-        elif option == "2":
+        elif option in OPTIONS:
             break
         else:
-            print("\nInvalid option. Please enter 1 or 2.\n")
+            print(f"\nInvalid option. Please enter {', '.join(OPTIONS)}.\n")
     dirPath = get_path()
     return dirPath, " " + new_name, option
 
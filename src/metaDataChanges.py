@@ -1,157 +1,156 @@
-import subprocess, re, time
-from utils import checkName, remove_keyword_from_name, keyword_in_track
+from utils import KeywordMatcher
+from editBatch import EditBatch
+from probe import probe_file
 
 
-def remove_attachment_by_name(input_file, keywords):
+def plan_file_edits(input_file, keywords, new_name, info=None):
+    """
+    Plan the attachment removals, title change and track renames of a MKV file.
+
+    Only the probe is run, nothing is written to the file.
+
+    Args:
+        input_file (str): The path to the input MKV file.
+        keywords (list or KeywordMatcher): The keywords to search for.
+        new_name (str): The new name to replace the keywords with.
+        info (MkvInfo, optional): The probed metadata of the file. If not given, the file is probed.
+
+    Returns:
+        tuple: The EditBatch with the planned changes and the MkvInfo of the file.
+    """
+    if info is None:
+        info = probe_file(input_file)
+    keywords = KeywordMatcher.of(keywords)
+    batch = EditBatch(input_file)
+    remove_attachment_by_name(input_file, keywords, batch, info)
+    replace_track_names(input_file, None, keywords, new_name, batch, info)
+    return batch, info
+
+
+def is_clean_after(batch, info, keywords):
+    """
+    Check if the file will have no keyword left once the changes of the batch are written.
+
+    Args:
+        batch (EditBatch): The changes planned for the file.
+        info (MkvInfo): The probed metadata of the file.
+        keywords (KeywordMatcher): The keywords to search for.
+
+    Returns:
+        bool: True if no track name, title or attachment will match the keywords.
+    """
+    names = [batch.track_names.get(track.number, track.name) for track in info.tracks]
+    names.append(info.title if batch.title is None else batch.title)
+    names += [
+        attachment.file_name
+        for attachment in info.attachments
+        if attachment.id not in batch.attachments
+    ]
+    return not any(name and keywords.is_match(name) for name in names)
+
+
+def remove_attachment_by_name(input_file, keywords, batch=None, info=None):
     """
     Removes attachments from a Matroska (MKV) file based on the attachment name.
 
     Args:
         input_file (str): The path to the input MKV file.
-        keywords (list): A list of keywords to match against the attachment names.
+        keywords (list or KeywordMatcher): The keywords to match against the attachment names.
+        batch (EditBatch, optional): The batch where the removals are added. If not given,
+            the removals are written right away.
+        info (MkvInfo, optional): The probed metadata of the file. If not given, the file is probed.
 
     Returns:
         None
     """
-    cmd = ["mkvmerge", "--identify", input_file]
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
-        # check if the command was successful
-        if result.returncode != 0:
-            print("Error identifying tracks info")
-            return
-        # check if result.stdout includes "Attachment ID"
-        check = (
-            "Attachment ID" in result.stdout
-            or "ID del archivo adjunto" in result.stdout
-        )
-        if not check:
-            return
-        lines = result.stdout.splitlines()
-        attachment_id = None
-        for line in lines:
-            if ("Attachment ID") in line or ("ID del archivo adjunto") in line:
-                # save the attachment id
-                attachment_id = int(re.search(r"\d+", line).group())
-                pattern = r"file name '([^']+)'"
-                pattern2 = r"nombre de archivo '([^']+)'"
-                match = re.search(pattern, line)
-                match2 = re.search(pattern2, line)
-                file_name = None
-                if match:
-                    file_name = match.group(1)
-                elif match2:
-                    file_name = match2.group(1)
-                if file_name:
-                    if checkName(file_name, keywords):
-                        print(f"Removing attachment {attachment_id}...")
-                        # Remove the attachment
-                        mkvpropedit_command = [
-                            "mkvpropedit",
-                            input_file,
-                            "--delete-attachment",
-                            f"{attachment_id}",
-                        ]
-                        subprocess.run(mkvpropedit_command)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-
-
-def replace_track_names(input_file, output_file, keywords, new_name):
+    if batch is None:
+        batch = EditBatch(input_file)
+        remove_attachment_by_name(input_file, keywords, batch, info)
+        batch.apply()
+        return
+    if info is None:
+        info = probe_file(input_file)
+    keywords = KeywordMatcher.of(keywords)
+    for attachment in info.attachments:
+        if attachment.file_name and keywords.is_match(attachment.file_name):
+            print(f"Removing attachment {attachment.id}...")
+            batch.delete_attachment(attachment.id)
+
+
+def replace_track_names(
+    input_file, output_file, keywords, new_name, batch=None, info=None
+):
     """
     Replaces track names in an MKV file based on specified keywords.
 
     Args:
         input_file (str): Path to the input MKV file.
         output_file (str): Path to the output MKV file with modified track names.
-        keywords (list): List of keywords to search for in track names.
+        keywords (list or KeywordMatcher): The keywords to search for in track names.
         new_name (str): The new name to replace the keywords with.
+        batch (EditBatch, optional): The batch where the changes are added. If not given,
+            the changes are written right away.
+        info (MkvInfo, optional): The probed metadata of the file. If not given, the file is probed.
 
     Returns:
-        None
+        bool: True if the file was changed, False otherwise.
     """
-    # Get track info using mkvinfo
-    mkvinfo_command = ["mkvinfo", input_file]
-    result = subprocess.run(
-        mkvinfo_command, capture_output=True, text=True, encoding="utf-8"
-    )
-    if result.returncode != 0:
-        print("Error identifying tracks. Check if mkvinfo is installed.")
-        return
+    if batch is None:
+        batch = EditBatch(input_file)
+        changed = replace_track_names(
+            input_file, output_file, keywords, new_name, batch, info
+        )
+        return batch.apply() and changed
+    if info is None:
+        info = probe_file(input_file)
+    keywords = KeywordMatcher.of(keywords)
 
-    # Parse track info
-    tracks = []
-    lines = result.stdout.splitlines()
-    track_id = None
+    tracks = [
+        (track.number, track.name)
+        for track in info.tracks
+        if track.name and keywords.is_match(track.name)
+    ]
     original_title = None
-    for line in lines:
-        if ("Track number:") in line or ("Número de pista:") in line:
-            # get the first number on the left in string using regex
-            track_id = int(re.search(r"\d+", line).group())
-        elif ("Name:") in line or ("Nombre:") in line:
-            track_name = line.split(":", 1)[1].strip()
-            if checkName(track_name, keywords):
-                tracks.append((track_id, track_name))
-        elif ("Title:") in line or ("Título:") in line:
-            if checkName(line.split(":", 1)[1].strip(), keywords):
-                original_title = line.split(":", 1)[1].strip()
+    if info.title and keywords.is_match(info.title):
+        original_title = info.title
     if not tracks and not original_title:
         print("No changes needed.")
-        return
+        return False
     elif original_title:
         print(f"Changing title...")
-        changeTitle(input_file, new_name, keywords, original_title)
+        changeTitle(input_file, new_name, keywords, original_title, batch)
 
-    # Replace track names if any of the specified keywords are present
+    # Remove all the keywords present in each track name in a single pass
     for track_id, track_name in tracks:
-        for keyword in keywords:
-            if keyword_in_track(track_name, keyword.lower()):
-                new_track_name = remove_keyword_from_name(track_name, keyword)
-                print(
-                    f"Changed. {track_id} {track_name} To -> {new_track_name} / Removed X {keyword}"
-                )
-                if new_track_name == track_name:
-                    new_track_name = track_name.replace(keyword.strip(), new_name)
-                mkvpropedit_command = [
-                    "mkvpropedit",
-                    input_file,
-                    "--edit",
-                    f"track:{track_id}",
-                    "--set",
-                    f"name={new_track_name}",
-                ]
-                subprocess.run(mkvpropedit_command)
-                # print(f"Track {track_id} renamed to {new_track_name}")
-                break
-
-
-def changeTitle(input_file, new_name, keywords, original_title):
+        new_track_name = keywords.clean(track_name, new_name)
+        removed = ", ".join(k.strip() for k in keywords.matches(track_name))
+        print(
+            f"Changed. {track_id} {track_name} To -> {new_track_name} / Removed X {removed}"
+        )
+        batch.set_track_name(track_id, new_track_name)
+    return True
+
+
+def changeTitle(input_file, new_name, keywords, original_title, batch=None):
     """
     Change the title of a video file by replacing specified keywords in the original title with a new name.
 
     Args:
         input_file (str): The path to the input video file.
         new_name (str): The new name to replace the keywords in the original title.
-        keywords (list): A list of keywords to search for in the original title.
+        keywords (list or KeywordMatcher): The keywords to search for in the original title.
         original_title (str): The original title of the video file.
+        batch (EditBatch, optional): The batch where the change is added. If not given,
+            the change is written right away.
 
     Returns:
         None
     """
-    for keyword in keywords:
-        if keyword_in_track(original_title, keyword.lower()):
-            original_title = remove_keyword_from_name(new_name, keyword)
-            if original_title == original_title:
-                original_title = original_title.replace(
-                    keyword.strip(), new_name
-                ).strip()
-            mkvpropedit_command = [
-                "mkvpropedit",
-                input_file,
-                "--edit",
-                "info",
-                "--set",
-                f"title={original_title}",
-            ]
-            subprocess.run(mkvpropedit_command)
-            break
+    if batch is None:
+        batch = EditBatch(input_file)
+        changeTitle(input_file, new_name, keywords, original_title, batch)
+        batch.apply()
+        return
+    keywords = KeywordMatcher.of(keywords)
+    if keywords.is_match(original_title):
+        batch.set_title(keywords.clean(new_name, new_name).strip())
@@ -0,0 +1,76 @@
+import hashlib, os, sqlite3, threading
+from utils import normalize_name
+
+
+class MetadataCache:
+    """
+    On-disk cache of the MKV files that are already clean for a set of keywords.
+
+    A file is identified by its path, size and modification time, so any change to the
+    file (or to the keywords) makes it be probed again.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        keywords (list): The keywords the files were checked against.
+    """
+
+    def __init__(self, db_path, keywords):
+        self.keywords_hash = hashlib.sha1(
+            "\n".join(sorted(normalize_name(k) for k in keywords)).encode("utf-8")
+        ).hexdigest()
+        self._lock = threading.Lock()
+        # the state folder may be shared by the containers of a work queue
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS clean_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                keywords_hash TEXT NOT NULL
+            )"""
+        )
+        self._connection.commit()
+
+    def is_clean(self, file_path):
+        """
+        Check if a file was already verified clean and did not change since then.
+
+        Args:
+            file_path (str): The path of the MKV file.
+
+        Returns:
+            bool: True if the file can be skipped, False otherwise.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, keywords_hash FROM clean_files WHERE path = ?",
+                (os.path.abspath(file_path),),
+            ).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns, self.keywords_hash)
+
+    def mark_clean(self, file_path):
+        """
+        Save a file as clean with its current size and modification time.
+
+        Args:
+            file_path (str): The path of the MKV file.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO clean_files VALUES (?, ?, ?, ?)",
+                (
+                    os.path.abspath(file_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    self.keywords_hash,
+                ),
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
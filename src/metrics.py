@@ -0,0 +1,172 @@
+import json, os, subprocess, threading, time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_stages = {}
+_files = {}
+_started = time.time()
+
+
+def _add(name, file, seconds, size, subprocesses):
+    with _lock:
+        totals = _stages.setdefault(
+            name, {"calls": 0, "seconds": 0.0, "bytes": 0, "subprocesses": 0}
+        )
+        totals["calls"] += 1
+        totals["seconds"] += seconds
+        totals["bytes"] += size
+        totals["subprocesses"] += subprocesses
+        if file is not None:
+            per_file = _files.setdefault(file, {}).setdefault(
+                name, {"seconds": 0.0, "bytes": 0, "subprocesses": 0}
+            )
+            per_file["seconds"] += seconds
+            per_file["bytes"] += size
+            per_file["subprocesses"] += subprocesses
+
+
+def record(name, file=None, seconds=0.0, size=0, subprocesses=0):
+    """
+    Record a stage that was timed somewhere else (e.g. in a worker process).
+
+    Args:
+        name (str): The stage name.
+        file (str, optional): The file the stage worked on.
+        seconds (float): The time the stage took.
+        size (int): The number of bytes the stage read or wrote.
+        subprocesses (int): The number of processes the stage spawned.
+    """
+    _add(name, file, seconds, size, subprocesses)
+
+
+@contextmanager
+def stage(name, file=None, size=0, subprocesses=0):
+    """
+    Time a stage of the processing of a file.
+
+    Args:
+        name (str): The stage name (e.g. "probe", "edit", "detect", "mux").
+        file (str, optional): The file the stage works on.
+        size (int): The number of bytes the stage reads or writes.
+        subprocesses (int): The number of processes the stage spawns.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(name, file, time.perf_counter() - start, size, subprocesses)
+
+
+def run(command, name, file=None, size=0, **kwargs):
+    """
+    Run a command with subprocess.run and record it as a stage.
+
+    Args:
+        command (list): The command and its arguments.
+        name (str): The stage name.
+        file (str, optional): The file the command works on.
+        size (int): The number of bytes the command reads or writes.
+        **kwargs: Passed to subprocess.run.
+
+    Returns:
+        subprocess.CompletedProcess: The result of the command.
+    """
+    with stage(name, file, size, subprocesses=1):
+        return subprocess.run(command, **kwargs)
+
+
+def file_size(path):
+    """
+    Get the size of a file, 0 if it can't be read.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        int: The size in bytes.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def summary():
+    """
+    Get the metrics recorded so far.
+
+    Returns:
+        dict: The run duration, the totals of each stage and the stages of each file.
+    """
+    with _lock:
+        return {
+            "started": _started,
+            "duration": time.time() - _started,
+            "files": len(_files),
+            "stages": json.loads(json.dumps(_stages)),
+            "per_file": json.loads(json.dumps(_files)),
+        }
+
+
+def prometheus_text(data):
+    """
+    Format the metrics in the Prometheus text exposition format.
+
+    Args:
+        data (dict): The metrics returned by summary.
+
+    Returns:
+        str: The metrics, ready for the node_exporter textfile collector.
+    """
+    lines = [
+        "# TYPE metadatarenamer_run_duration_seconds gauge",
+        f"metadatarenamer_run_duration_seconds {data['duration']:.3f}",
+        "# TYPE metadatarenamer_run_files gauge",
+        f"metadatarenamer_run_files {data['files']}",
+        "# TYPE metadatarenamer_run_timestamp_seconds gauge",
+        f"metadatarenamer_run_timestamp_seconds {data['started']:.0f}",
+    ]
+    for metric, key, kind in (
+        ("stage_seconds", "seconds", "gauge"),
+        ("stage_calls", "calls", "gauge"),
+        ("stage_bytes", "bytes", "gauge"),
+        ("stage_subprocesses", "subprocesses", "gauge"),
+    ):
+        lines.append(f"# TYPE metadatarenamer_{metric} {kind}")
+        for name, totals in sorted(data["stages"].items()):
+            value = totals[key]
+            value = f"{value:.3f}" if isinstance(value, float) else value
+            lines.append(f'metadatarenamer_{metric}{{stage="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def export(metrics_file, prometheus_file=None):
+    """
+    Print a short summary of the stages and save the metrics of the run.
+
+    Args:
+        metrics_file (str): The path of the JSON summary.
+        prometheus_file (str, optional): The path of the Prometheus textfile.
+
+    Returns:
+        None
+    """
+    data = summary()
+    if not data["stages"]:
+        return
+    print("--------------- Stages ---------------")
+    for name, totals in sorted(data["stages"].items()):
+        print(
+            f"{name:<8} {totals['seconds']:10.2f} s  {totals['calls']:7} calls  "
+            f"{totals['subprocesses']:7} processes  {totals['bytes'] / 1024 / 1024:10.1f} MiB"
+        )
+    _write_atomic(metrics_file, json.dumps(data, indent=2))
+    if prometheus_file:
+        _write_atomic(prometheus_file, prometheus_text(data))
@@ -0,0 +1,190 @@
+import json, math, os, re
+from collections import Counter
+
+# The average log-likelihood gap per n-gram is multiplied by this before the softmax
+# that gives the confidence, so the confidence doesn't depend on the length of the text.
+_SHARPNESS = 8.0
+# Probability given to the n-grams a profile doesn't have
+_FLOOR = 1e-6
+# Smallest probability of the n-grams kept for the other languages
+_OTHERS_CUTOFF = 2e-5
+_WORDS = re.compile(r"[^\W\d_]+")
+# Maximum number of words whose scores are kept between texts
+_WORD_CACHE_SIZE = 50000
+
+
+def _profiles_dir():
+    import langdetect
+
+    return os.path.join(os.path.dirname(langdetect.__file__), "profiles")
+
+
+def unknown_languages(languages):
+    """
+    Find the target languages langdetect doesn't have a profile for.
+
+    Args:
+        languages (list): The langdetect codes of the target languages (e.g. "en").
+
+    Returns:
+        list: The unknown codes (e.g. "zh", which langdetect splits in "zh-cn" and "zh-tw").
+    """
+    available = set(os.listdir(_profiles_dir()))
+    return [language for language in languages if language not in available]
+
+
+def _ngrams(word):
+    word = f" {word} "
+    grams = list(word[1:-1])
+    grams += [word[i : i + 2] for i in range(len(word) - 1)]
+    grams += [word[i : i + 3] for i in range(len(word) - 2)]
+    return grams
+
+
+class NgramDetector:
+    """
+    Naive Bayes language detector restricted to a few target languages.
+
+    It uses the 1 to 3 character n-gram frequencies of the langdetect profiles of the
+    target languages, plus one "other" class with the pooled frequencies of all the
+    other profiles. The confidence is the softmax of the average log-likelihood of each
+    class per n-gram: text in a target language gets a confidence close to 1, and text
+    in another language (even a close one, like Portuguese for Spanish) gets a low one.
+    """
+
+    # Change it when the tables or the scoring change, so the cached tables are built
+    # again and the cached languages are detected again
+    VERSION = 1
+
+    def __init__(self, languages, table):
+        self.languages = list(languages)
+        self._table = table
+        self._words = {}
+
+    def _word_scores(self, word):
+        # the dialogue of a subtitle repeats the same words a lot
+        scores = self._words.get(word)
+        if scores is None:
+            rows = [row for row in map(self._table.get, _ngrams(word)) if row]
+            scores = [sum(column) for column in zip(*rows)], len(rows)
+            if len(self._words) >= _WORD_CACHE_SIZE:
+                self._words.clear()
+            self._words[word] = scores
+        return scores
+
+    @classmethod
+    def build(cls, languages):
+        """
+        Build the n-gram tables from the langdetect profiles.
+
+        Args:
+            languages (list): The langdetect codes of the target languages (e.g. "en").
+
+        Returns:
+            NgramDetector: The detector.
+
+        Raises:
+            ValueError: If langdetect doesn't have a profile for one of the languages.
+        """
+        directory = _profiles_dir()
+        available = set(os.listdir(directory))
+        unknown = unknown_languages(languages)
+        if unknown:
+            raise ValueError(f"Unknown detection languages: {', '.join(unknown)}")
+        size = len(languages) + 1
+        probabilities = {}
+        others = {}
+        other_languages = sorted(available - set(languages))
+        for profile_name in sorted(available):
+            with open(os.path.join(directory, profile_name), "r", encoding="utf-8") as f:
+                profile = json.load(f)
+            totals = profile["n_words"]
+            if profile_name in languages:
+                column = languages.index(profile_name)
+                for gram, count in profile["freq"].items():
+                    probabilities.setdefault(gram, [0.0] * size)[column] = (
+                        count / totals[len(gram) - 1]
+                    )
+            else:
+                for gram, count in profile["freq"].items():
+                    others[gram] = others.get(gram, 0.0) + count / totals[
+                        len(gram) - 1
+                    ] / len(other_languages)
+        for gram, probability in others.items():
+            if probability >= _OTHERS_CUTOFF or gram in probabilities:
+                probabilities.setdefault(gram, [0.0] * size)[-1] = probability
+        table = {
+            gram: tuple(math.log(max(p, _FLOOR)) for p in values)
+            for gram, values in probabilities.items()
+        }
+        return cls(languages, table)
+
+    @classmethod
+    def load(cls, languages, cache_dir):
+        """
+        Load the detector from its cached tables, building and saving them if needed.
+
+        The tables are saved in cache_dir and keyed by the target languages and the
+        langdetect profiles folder, so the profiles are only read again after langdetect
+        is updated.
+
+        Args:
+            languages (list): The langdetect codes of the target languages.
+            cache_dir (str): The folder of the cached tables.
+
+        Returns:
+            NgramDetector: The detector.
+        """
+        directory = _profiles_dir()
+        profiles = f"{directory}:{os.stat(directory).st_mtime_ns}"
+        cache_file = os.path.join(
+            cache_dir, f"ngrams-{'-'.join(languages)}.json"
+        )
+        key = [cls.VERSION, profiles, languages]
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return cls(languages, {g: tuple(v) for g, v in cached["table"].items()})
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        detector = cls.build(languages)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{cache_file}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"key": key, "table": detector._table}, f, ensure_ascii=False)
+            os.replace(f"{cache_file}.tmp", cache_file)
+        except OSError:
+            pass
+        return detector
+
+    def detect(self, text):
+        """
+        Detect the language of a text.
+
+        Args:
+            text (str): The text to analyze.
+
+        Returns:
+            tuple: The langdetect code of the most likely target language and the
+                confidence between 0 and 1, or ("Unknown", 0.0) if the text has no known
+                n-gram or looks like another language.
+        """
+        scores = [0.0] * (len(self.languages) + 1)
+        count = 0
+        for word, times in Counter(_WORDS.findall(text)).items():
+            word_scores, grams = self._word_scores(word)
+            if not grams:
+                continue
+            count += grams * times
+            for i, value in enumerate(word_scores):
+                scores[i] += value * times
+        if not count:
+            return "Unknown", 0.0
+        best = max(range(len(scores)), key=scores.__getitem__)
+        top = scores[best]
+        weights = [math.exp((score - top) / count * _SHARPNESS) for score in scores]
+        confidence = weights[best] / sum(weights)
+        if best == len(self.languages):
+            return "Unknown", 0.0
+        return self.languages[best], confidence
@@ -0,0 +1,345 @@
+import json, os
+from decouple import config, Csv
+from utils import KeywordMatcher
+from editBatch import EditBatch
+from metaDataChanges import plan_file_edits
+from jobJournal import JobJournal
+from detectLanguage import (
+    ask_delete_subs,
+    add_subtitles_to_video,
+    DetectionPool,
+    get_languages_codes,
+    iter_subtitle_groups,
+    mux_videos,
+    remove_empty_subs_folders,
+    resume_muxes,
+    resume_video,
+    subtitle_paths,
+)
+from scanner import scan_files, get_scan_options
+from workerPool import get_workers, iter_chunks, iter_pool, run_pool
+
+
+def plan_edit(input_file, keywords, new_name):
+    """
+    Plan the metadata changes of a MKV file.
+
+    Args:
+        input_file (str): The path of the MKV file.
+        keywords (KeywordMatcher): The keywords to search for.
+        new_name (str): The new name to replace the keywords with.
+
+    Returns:
+        dict: The plan record, or None if the file doesn't need changes.
+    """
+    batch, _ = plan_file_edits(input_file, keywords, new_name)
+    if batch.is_empty():
+        return None
+    stat = os.stat(input_file)
+    record = {"type": "edit", "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    record.update(batch.to_dict())
+    return record
+
+
+def plan_mux(video, deleteSubs, detected=None):
+    """
+    Plan the subtitles to add to a video, detecting their languages.
+
+    Args:
+        video (tuple): The group yielded by iter_subtitle_groups.
+        deleteSubs (str): "y" to delete the subtitle files once they are added.
+        detected (dict, optional): The languages already found by detect_languages.
+
+    Returns:
+        dict: The plan record.
+    """
+    folder, subsFolder, fileWithoutExtension, fileExtension, subs = video
+    return {
+        "type": "mux",
+        "directory": folder,
+        "subs_folder": subsFolder,
+        "video": fileWithoutExtension,
+        "extension": fileExtension,
+        "subtitles": subs,
+        "languages": get_languages_codes(subs, folder, subsFolder, detected),
+        "delete_subs": deleteSubs == "y",
+    }
+
+
+def create_plan(directory, keywords, new_name, plan_file):
+    """
+    Write the plan of all the changes for the library to a NDJSON file, one operation per line.
+
+    Only read-only tools are run. The PLAN env var chooses what is planned: "edits" (the
+    metadata changes of option 1), "subtitles" (the subtitles of option 2) or both. Each
+    operation is written as soon as it is planned, so the memory doesn't grow with the
+    library and an interrupted run keeps the operations planned so far.
+
+    Args:
+        directory (str): The library directory.
+        keywords (list or KeywordMatcher): The keywords to search for.
+        new_name (str): The new name to replace the keywords with.
+        plan_file (str): The path of the plan file.
+
+    Returns:
+        int: The number of planned operations.
+    """
+    kinds = config("PLAN", default="edits,subtitles", cast=Csv())
+    keywords = KeywordMatcher.of(keywords)
+    workers = get_workers(config("WORKERS", default=None))
+    count = 0
+    with open(plan_file, "w", encoding="utf-8") as f:
+
+        def write(results):
+            nonlocal count
+            for _, record, error in results:
+                if error is None and record is not None:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    count += 1
+
+        if "edits" in kinds:
+            files = scan_files(directory, (".mkv",), **get_scan_options())
+            write(
+                iter_pool(
+                    lambda input_file: plan_edit(input_file, keywords, new_name),
+                    files,
+                    workers,
+                )
+            )
+        if "subtitles" in kinds:
+            deleteSubs = ask_delete_subs()
+            chunk_size = config("DETECT_CHUNK_SIZE", default=100, cast=int)
+            # the languages are detected in chunks as the library is scanned, by the
+            # same processes
+            with DetectionPool() as pool:
+                for videos in iter_chunks(iter_subtitle_groups(directory), chunk_size):
+                    detected = pool.detect(subtitle_paths(videos))
+                    write(
+                        iter_pool(
+                            lambda video: plan_mux(video, deleteSubs, detected),
+                            videos,
+                            workers,
+                        )
+                    )
+    print(f"--------------- Planned {count} operations in {plan_file} ---------------")
+    return count
+
+
+def read_plan(plan_file):
+    """
+    Read the operations of a plan file.
+
+    Args:
+        plan_file (str): The path of the plan file.
+
+    Yields:
+        dict: Each planned operation.
+    """
+    with open(plan_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def apply_edit(record, journal=None):
+    """
+    Write the planned metadata changes of a file with a single mkvpropedit call.
+
+    The file is skipped if it changed since the plan was made.
+
+    Args:
+        record (dict): The planned operation.
+        journal (JobJournal, optional): The journal where the steps of the file are saved.
+
+    Returns:
+        bool: True if the changes were written, False otherwise.
+    """
+    if journal is not None and journal.is_finished(record["file"]):
+        print(f"{record['file']} was already changed before the interruption.")
+        return True
+    stat = os.stat(record["file"])
+    if (stat.st_size, stat.st_mtime_ns) != (record["size"], record["mtime_ns"]):
+        print(f"{record['file']} changed since the plan was made. Skipping this file.")
+        return False
+    if journal is not None:
+        journal.update(record["file"], "editing")
+    if not EditBatch.from_dict(record).apply():
+        raise Exception(f"Could not write the changes to {record['file']}")
+    if journal is not None:
+        journal.finish(record["file"])
+    print(f"--------------- Processed {os.path.basename(record['file'])} ---------------")
+    return True
+
+
+def record_video(record):
+    """
+    Get the subtitle group of a planned mux.
+
+    Args:
+        record (dict): The planned operation.
+
+    Returns:
+        tuple: The group, like the ones yielded by iter_subtitle_groups.
+    """
+    return (
+        record["directory"],
+        record["subs_folder"],
+        record["video"],
+        record["extension"],
+        record["subtitles"],
+    )
+
+
+def planned_video(record):
+    """
+    Get the subtitle group of a planned mux, checking that its subtitles still exist.
+
+    Args:
+        record (dict): The planned operation.
+
+    Returns:
+        tuple: The group, like the ones yielded by iter_subtitle_groups, or None if some
+            subtitle files no longer exist.
+    """
+    subsDirectory = record["directory"]
+    if record["subs_folder"]:
+        subsDirectory = os.path.join(subsDirectory, "subs")
+    missing = [
+        sub
+        for sub in record["subtitles"]
+        if not os.path.exists(os.path.join(subsDirectory, sub))
+    ]
+    if missing:
+        print(f"Subtitles {', '.join(missing)} no longer exist. Skipping this video.")
+        return None
+    return record_video(record)
+
+
+def apply_mux(record, journal=None):
+    """
+    Add the planned subtitles to a video.
+
+    Args:
+        record (dict): The planned operation.
+        journal (JobJournal, optional): The journal where the steps of the video are saved.
+
+    Returns:
+        bool: True if the subtitles were added, False otherwise.
+    """
+    deleteSubs = "y" if record["delete_subs"] else "n"
+    if journal is not None and resume_video(journal, record_video(record), deleteSubs):
+        return True
+    video = planned_video(record)
+    if video is None:
+        return False
+    return add_subtitles_to_video(
+        *video,
+        deleteSubs,
+        show_progress=False,
+        languages=record["languages"],
+        journal=journal,
+    )
+
+
+def apply_muxes(records, jobs, journal=None):
+    """
+    Add the planned subtitles to several videos at the same time.
+
+    Args:
+        records (iterable): The planned mux operations.
+        jobs (int): The number of mkvmerge processes running at the same time.
+        journal (JobJournal, optional): The journal where the steps of the videos are saved.
+
+    Returns:
+        list: A (video, result, error) tuple for each operation, like run_pool.
+    """
+    results = []
+
+    def videos():
+        for record in records:
+            deleteSubs = "y" if record["delete_subs"] else "n"
+            if journal is not None and resume_video(
+                journal, record_video(record), deleteSubs
+            ):
+                results.append((record, True, None))
+                continue
+            video = planned_video(record)
+            if video is None:
+                results.append((record, False, None))
+                continue
+            yield video, deleteSubs, record["languages"]
+
+    results += mux_videos(videos(), jobs, journal)
+    return results
+
+
+def apply_plan(plan_file):
+    """
+    Execute the operations of a plan file.
+
+    The metadata changes are written first, using WORKERS files at the same time, and then
+    the subtitles are added, using MUX_JOBS videos at the same time. The steps are saved in
+    a journal next to the plan file, so applying the same plan again after an interruption
+    continues where it stopped.
+
+    Args:
+        plan_file (str): The path of the plan file.
+
+    Returns:
+        None
+    """
+    journal_file = os.path.join(
+        os.path.dirname(os.path.abspath(plan_file)), "journal.sqlite"
+    )
+    # the steps saved for another plan (or an edited one) don't apply
+    key = f"{os.path.abspath(plan_file)}:{os.stat(plan_file).st_mtime_ns}"
+    edit_journal = JobJournal(journal_file, "plan-edit", key)
+    mux_journal = JobJournal(journal_file, "plan-mux", key)
+    try:
+        edits = (r for r in read_plan(plan_file) if r["type"] == "edit")
+        results = run_pool(
+            lambda record: apply_edit(record, edit_journal),
+            edits,
+            get_workers(config("WORKERS", default=None)),
+        )
+        resume_muxes(
+            mux_journal,
+            {r["directory"] for r in read_plan(plan_file) if r["type"] == "mux"},
+        )
+        muxes = (r for r in read_plan(plan_file) if r["type"] == "mux")
+        jobs = get_workers(config("MUX_JOBS", default="1"))
+        if jobs == 1:
+            results += run_pool(
+                lambda record: apply_mux(record, mux_journal), muxes, jobs
+            )
+        else:
+            results += apply_muxes(muxes, jobs, mux_journal)
+        edit_journal.clear()
+        mux_journal.clear()
+    finally:
+        edit_journal.close()
+        mux_journal.close()
+    remove_empty_subs_folders(
+        record["directory"]
+        for record in read_plan(plan_file)
+        if record["type"] == "mux" and record["subs_folder"] and record["delete_subs"]
+    )
+    done = sum(1 for _, result, error in results if error is None and result)
+    failed = sum(1 for _, _, error in results if error is not None)
+    print(
+        f"--------------- Applied {done} of {len(results)} operations, {failed} failed ---------------"
+    )
+
+
+def get_plan_file(state_dir):
+    """
+    Get the path of the plan file from the PLAN_FILE env var.
+
+    Args:
+        state_dir (str): The state folder, where the plan is saved by default.
+
+    Returns:
+        str: The path of the plan file.
+    """
+    return config("PLAN_FILE", default="") or os.path.join(state_dir, "plan.ndjson")
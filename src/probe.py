@@ -0,0 +1,121 @@
+import json, time
+from dataclasses import dataclass, field
+from decouple import config
+import metrics
+from matroska import MatroskaError, identify
+
+
+@dataclass
+class Track:
+    """A track of a MKV file."""
+
+    id: int
+    number: int
+    type: str
+    codec: str = ""
+    name: str = ""
+    language: str = ""
+    language_ietf: str = ""
+    frames: int = 0
+    # the hash of the cues of a subtitle added by the renamer, see subtitle_fingerprint
+    fingerprint: str = ""
+
+
+@dataclass
+class Attachment:
+    """An attachment of a MKV file."""
+
+    id: int
+    file_name: str = ""
+    content_type: str = ""
+
+
+@dataclass
+class MkvInfo:
+    """The metadata of a MKV file that the renamer reads and changes."""
+
+    path: str
+    title: str = ""
+    tracks: list = field(default_factory=list)
+    attachments: list = field(default_factory=list)
+
+
+def parse_identification(path, data):
+    """
+    Build the MkvInfo of a file from the JSON output of mkvmerge -J.
+
+    Args:
+        path (str): The path of the MKV file.
+        data (dict): The decoded JSON output of mkvmerge.
+
+    Returns:
+        MkvInfo: The title, tracks and attachments of the file.
+    """
+    container = data.get("container", {}).get("properties", {})
+    tracks = []
+    for track in data.get("tracks", []):
+        properties = track.get("properties", {})
+        tracks.append(
+            Track(
+                id=track["id"],
+                number=properties.get("number", track["id"] + 1),
+                type=track.get("type", ""),
+                codec=properties.get("codec_id", track.get("codec", "")),
+                name=properties.get("track_name", ""),
+                language=properties.get("language", ""),
+                language_ietf=properties.get("language_ietf", ""),
+                frames=int(properties.get("tag_number_of_frames", 0) or 0),
+                fingerprint=properties.get("tag_metadatarenamer_subtitle_sha256", ""),
+            )
+        )
+    attachments = [
+        Attachment(
+            id=attachment["id"],
+            file_name=attachment.get("file_name", ""),
+            content_type=attachment.get("content_type", ""),
+        )
+        for attachment in data.get("attachments", [])
+    ]
+    return MkvInfo(path, container.get("title", ""), tracks, attachments)
+
+
+def probe_file(path):
+    """
+    Read the title, tracks and attachments of a MKV file.
+
+    The file is identified with a single mkvmerge -J call, whose JSON output does not
+    depend on the language of the installed MKVToolNix. With NATIVE_PROBE=True, the
+    header is read by the built-in Matroska reader instead, without starting a process,
+    and only other containers and the files it can't read are left to mkvmerge.
+
+    Args:
+        path (str): The path of the MKV file.
+
+    Returns:
+        MkvInfo: The title, tracks and attachments of the file.
+
+    Raises:
+        Exception: If mkvmerge could not identify the file.
+    """
+    if config("NATIVE_PROBE", default=False, cast=bool):
+        start = time.perf_counter()
+        try:
+            info = parse_identification(path, identify(path))
+        except MatroskaError:
+            pass
+        else:
+            # the files left to mkvmerge are only counted once, by metrics.run
+            metrics.record("probe", path, time.perf_counter() - start)
+            return info
+    result = metrics.run(
+        ["mkvmerge", "-J", path],
+        "probe",
+        path,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+    )
+    # mkvmerge exits with 1 when there were only warnings
+    if result.returncode > 1 or not result.stdout:
+        raise Exception(f"Error identifying tracks info of {path}")
+    return parse_identification(path, json.loads(result.stdout))
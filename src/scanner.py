@@ -0,0 +1,126 @@
+import os
+from fnmatch import fnmatch
+from decouple import config, Csv
+
+
+def get_scan_options():
+    """
+    Get the scan options from the env vars.
+
+    SCAN_INCLUDE and SCAN_EXCLUDE are comma separated globs matched against the path
+    relative to the library folder (e.g. "Show A/*,*/Season 1/*"), and SCAN_MAX_DEPTH is
+    the number of folder levels to go down (0 only reads the library folder itself).
+
+    Returns:
+        dict: The include, exclude and max_depth arguments for scan_files.
+    """
+    max_depth = config("SCAN_MAX_DEPTH", default="")
+    return {
+        "include": config("SCAN_INCLUDE", default="", cast=Csv()),
+        "exclude": config("SCAN_EXCLUDE", default="", cast=Csv()),
+        "max_depth": int(max_depth) if max_depth != "" else None,
+    }
+
+
+def _matches(relative_path, patterns):
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch(relative_path, pattern) or fnmatch(name, pattern)
+        for pattern in patterns
+    )
+
+
+def is_included(root, path, include):
+    """
+    Check if a file of a library matches the include globs, like scan_files does.
+
+    Args:
+        root (str): The library folder.
+        path (str): The path of the file.
+        include (list): Globs the file must match. Every file matches when it is empty.
+
+    Returns:
+        bool: True if the file is included, False otherwise.
+    """
+    if not include:
+        return True
+    relative = os.path.relpath(path, root).replace(os.sep, "/")
+    return _matches(relative, include)
+
+
+def _walk(root, exclude, max_depth):
+    """
+    Yield the entries of the root folder and its subfolders, using os.scandir lazily.
+
+    Hidden files and folders, excluded folders and folders deeper than max_depth are
+    neither entered nor yielded.
+    """
+    stack = [(root, "", 0)]
+    while stack:
+        path, relative, depth = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError as e:
+            print(f"Could not read the folder {path}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                # hidden files and folders (like the state folder and the temporary
+                # files written while muxing) are never part of the library
+                if entry.name.startswith("."):
+                    continue
+                entry_relative = f"{relative}/{entry.name}" if relative else entry.name
+                if exclude and _matches(entry_relative, exclude):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    stack.append((entry.path, entry_relative, depth + 1))
+                yield entry, entry_relative, is_dir
+
+
+def scan_files(root, extensions, include=None, exclude=None, max_depth=None):
+    """
+    Find the files with the given extensions in a folder and its subfolders.
+
+    The files are yielded as soon as they are found, so the processing can start
+    before the whole library is listed and the memory used does not grow with it.
+
+    Args:
+        root (str): The library folder.
+        extensions (tuple): The file extensions to look for (e.g. (".mkv",)).
+        include (list, optional): Globs a file must match to be yielded.
+        exclude (list, optional): Globs of files and folders to leave out.
+        max_depth (int, optional): How many folder levels to go down. No limit by default.
+
+    Yields:
+        str: The path of each file found.
+    """
+    for entry, relative, is_dir in _walk(root, exclude, max_depth):
+        if is_dir or not entry.name.endswith(extensions):
+            continue
+        if include and not _matches(relative, include):
+            continue
+        yield entry.path
+
+
+def scan_directories(root, exclude=None, max_depth=None):
+    """
+    Find the folder and subfolders of a library, yielding them as soon as they are found.
+
+    Args:
+        root (str): The library folder, it is always yielded first.
+        exclude (list, optional): Globs of folders to leave out.
+        max_depth (int, optional): How many folder levels to go down. No limit by default.
+
+    Yields:
+        str: The path of each folder.
+    """
+    yield root
+    for entry, _, is_dir in _walk(root, exclude, max_depth):
+        if is_dir:
+            yield entry.path
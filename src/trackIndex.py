@@ -0,0 +1,335 @@
+import os, shlex, sqlite3, threading
+from decouple import config
+from probe import probe_file
+from scanner import scan_files, get_scan_options
+from utils import get_state_dir, normalize_name
+from detectLanguage import to_iso639_2
+from workerPool import get_workers, run_pool
+
+# The query fields that look for a text in the names, and the names they look in
+_NAME_FIELDS = {
+    "name": ("title", "track", "attachment"),
+    "title": ("title",),
+    "track": ("track",),
+    "attachment": ("attachment",),
+}
+# The query fields that look for a language, and the type of track they look at
+_LANGUAGE_FIELDS = {"lang": None, "audio": "audio", "sub": "subtitles"}
+
+
+def parse_query(query):
+    """
+    Parse an index query made of field:value terms, all of which have to match.
+
+    The name fields (name, title, track and attachment) match the names that contain the
+    value, ignoring case and spaces like the keywords do. The language fields (lang,
+    audio and sub) match the tracks in that language, in any code form ("es", "spa" or
+    "es-ES"). A term that starts with "-" matches the files the term doesn't match.
+    Values with spaces are quoted.
+
+    Args:
+        query (str): The query (e.g. 'track:GRP -sub:spa').
+
+    Returns:
+        list: A (negated, field, value) tuple for each term.
+
+    Raises:
+        ValueError: If a term has no value or an unknown field.
+
+    >>> parse_query('name:"Release Group" -sub:es')
+    [(False, 'name', 'Release Group'), (True, 'sub', 'es')]
+    """
+    terms = []
+    for term in shlex.split(query):
+        negated = term.startswith("-")
+        field, _, value = term.lstrip("-").partition(":")
+        if field not in _NAME_FIELDS and field not in _LANGUAGE_FIELDS:
+            raise ValueError(f"Unknown field in the index query: {term}")
+        if not value:
+            raise ValueError(f"Missing value in the index query: {term}")
+        terms.append((negated, field, value))
+    return terms
+
+
+def _term_sql(field, value):
+    if field in _LANGUAGE_FIELDS:
+        condition = (
+            "iso639_2(CASE WHEN t.language_ietf != '' THEN t.language_ietf "
+            "ELSE t.language END) = ?"
+        )
+        parameters = [to_iso639_2(value)]
+        if _LANGUAGE_FIELDS[field]:
+            condition += " AND t.type = ?"
+            parameters.append(_LANGUAGE_FIELDS[field])
+        return (
+            f"EXISTS (SELECT 1 FROM tracks t WHERE t.path = f.path AND {condition})",
+            parameters,
+        )
+    value = normalize_name(value)
+    conditions = {
+        "title": "instr(normalize(f.title), ?)",
+        "track": "EXISTS (SELECT 1 FROM tracks t WHERE t.path = f.path "
+        "AND instr(normalize(t.name), ?))",
+        "attachment": "EXISTS (SELECT 1 FROM attachments a WHERE a.path = f.path "
+        "AND instr(normalize(a.file_name), ?))",
+    }
+    names = _NAME_FIELDS[field]
+    return (
+        "(" + " OR ".join(conditions[name] for name in names) + ")",
+        [value] * len(names),
+    )
+
+
+class TrackIndex:
+    """
+    On-disk index of the title, tracks and attachments of the MKV files of a library.
+
+    The files are read with the same mkvmerge -J probe used to change the metadata, and
+    a file is only probed again when its size or modification time change.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False
+        )
+        # the names are matched like the keywords, and the languages in any code form
+        self._connection.create_function(
+            "normalize", 1, normalize_name, deterministic=True
+        )
+        self._connection.create_function(
+            "iso639_2", 1, to_iso639_2, deterministic=True
+        )
+        self._connection.executescript(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                title TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                name TEXT NOT NULL,
+                language TEXT NOT NULL,
+                language_ietf TEXT NOT NULL,
+                frames INTEGER NOT NULL,
+                PRIMARY KEY (path, id)
+            );
+            CREATE TABLE IF NOT EXISTS attachments (
+                path TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                PRIMARY KEY (path, id)
+            )"""
+        )
+        self._connection.commit()
+
+    def is_current(self, file_path):
+        """
+        Check if a file is indexed and did not change since then.
+
+        Args:
+            file_path (str): The path of the MKV file.
+
+        Returns:
+            bool: True if the file doesn't have to be probed again, False otherwise.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns FROM files WHERE path = ?",
+                (os.path.abspath(file_path),),
+            ).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns)
+
+    def save(self, info, stat):
+        """
+        Save the metadata of a file, replacing the saved one.
+
+        Args:
+            info (MkvInfo): The probed metadata of the file.
+            stat (os.stat_result): The stat of the file taken before it was probed.
+        """
+        path = os.path.abspath(info.path)
+        with self._lock:
+            self._delete(path)
+            self._connection.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, info.title or ""),
+            )
+            self._connection.executemany(
+                "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        path,
+                        t.id,
+                        t.number,
+                        t.type,
+                        t.codec,
+                        t.name or "",
+                        t.language or "",
+                        t.language_ietf or "",
+                        t.frames,
+                    )
+                    for t in info.tracks
+                ],
+            )
+            self._connection.executemany(
+                "INSERT INTO attachments VALUES (?, ?, ?, ?)",
+                [
+                    (path, a.id, a.file_name or "", a.content_type or "")
+                    for a in info.attachments
+                ],
+            )
+            self._connection.commit()
+
+    def _delete(self, path):
+        for table in ("files", "tracks", "attachments"):
+            self._connection.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+    def refresh(self, directory, workers=None):
+        """
+        Probe the new and changed MKV files of a library and forget the removed ones.
+
+        Args:
+            directory (str): The library folder.
+            workers (int, optional): The number of files probed at the same time.
+
+        Returns:
+            tuple: The number of files in the library, probed, that could not be probed
+            and forgotten.
+        """
+        found = set()
+
+        def changed_files():
+            for input_file in scan_files(directory, (".mkv",), **get_scan_options()):
+                found.add(os.path.abspath(input_file))
+                if not self.is_current(input_file):
+                    yield input_file
+
+        def index_file(input_file):
+            stat = os.stat(input_file)
+            self.save(probe_file(input_file), stat)
+
+        results = run_pool(index_file, changed_files(), workers or 1)
+        root = os.path.join(os.path.abspath(directory), "")
+        with self._lock:
+            indexed = [
+                path
+                for (path,) in self._connection.execute("SELECT path FROM files")
+                if path.startswith(root)
+            ]
+            removed = [path for path in indexed if path not in found]
+            for path in removed:
+                self._delete(path)
+            self._connection.commit()
+        failed = sum(1 for _, _, error in results if error is not None)
+        return len(found), len(results) - failed, failed, len(removed)
+
+    def query(self, directory, query):
+        """
+        Find the indexed files of a library that match a query.
+
+        Args:
+            directory (str): The library folder.
+            query (str): The query, see parse_query.
+
+        Returns:
+            list: The paths of the matching files, sorted.
+        """
+        conditions, parameters = ["f.path LIKE ? ESCAPE '\\'"], []
+        root = os.path.join(os.path.abspath(directory), "")
+        parameters.append(
+            root.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        )
+        for negated, field, value in parse_query(query):
+            condition, values = _term_sql(field, value)
+            conditions.append(f"NOT {condition}" if negated else condition)
+            parameters += values
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT f.path FROM files f WHERE {' AND '.join(conditions)} "
+                "ORDER BY f.path",
+                parameters,
+            ).fetchall()
+        return [path for (path,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_index(directory):
+    """
+    Open the track index of a library, saved as index.sqlite in the state folder.
+
+    Args:
+        directory (str): The library folder.
+
+    Returns:
+        TrackIndex: The index.
+    """
+    return TrackIndex(os.path.join(get_state_dir(directory), "index.sqlite"))
+
+
+def select_files(directory, query):
+    """
+    Refresh the track index of a library and find the files that match a query.
+
+    Args:
+        directory (str): The library folder.
+        query (str): The query, see parse_query.
+
+    Returns:
+        list: The paths of the matching files.
+    """
+    index = open_index(directory)
+    try:
+        total, probed, failed, _ = index.refresh(
+            directory, get_workers(config("WORKERS", default=None))
+        )
+        files = index.query(directory, query)
+    finally:
+        index.close()
+    print(
+        f"--------------- The index query matched {len(files)} of {total} files "
+        f"({probed} indexed now, {failed} failed) ---------------"
+    )
+    return files
+
+
+def update_index(directory):
+    """
+    Refresh the track index of a library, and list the files that match INDEX_QUERY.
+
+    Args:
+        directory (str): The library folder.
+
+    Returns:
+        None
+    """
+    index = open_index(directory)
+    try:
+        total, probed, failed, removed = index.refresh(
+            directory, get_workers(config("WORKERS", default=None))
+        )
+        print(
+            f"--------------- Indexed {total} files: {probed} probed, {failed} failed, "
+            f"{total - probed - failed} unchanged, {removed} removed ---------------"
+        )
+        query = config("INDEX_QUERY", default="")
+        if query:
+            files = index.query(directory, query)
+            for path in files:
+                print(path)
+            print(f"--------------- {len(files)} files match {query} ---------------")
+    finally:
+        index.close()
@@ -1,4 +1,5 @@
-import os, re
+import json, os, re, shutil, subprocess
+from decouple import config
 
 
 def create_env_file():
@@ -120,6 +121,111 @@ def remove_keyword_from_name(track_name, keyword):
     return re.sub(r'\s{2,}', ' ', cleaned)
 
 
+class KeywordMatcher:
+    """
+    Keyword matching built once from the KEYWORDS list.
+
+    The keywords are normalized and compiled into two regular expressions when the matcher
+    is created: one that checks the normalized names (like checkName) and one that removes
+    the keywords, also when they are written with spaces between the letters
+    (like remove_keyword_from_name). Iterating the matcher gives back the keywords.
+
+    Args:
+        keywords (list): The keywords to look for.
+
+    Example:
+        >>> matcher = KeywordMatcher(["GDR", "XYZ"])
+        >>> matcher.matches("Summer Hit [G D R]")
+        ['GDR']
+        >>> matcher.clean("Summer Hit G D R XYZ", " new")
+        'Summer Hit'
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._normalized = [
+            (keyword, normalize_name(keyword))
+            for keyword in self.keywords
+            if normalize_name(keyword)
+        ]
+        longest_first = sorted(self._normalized, key=lambda k: -len(k[1]))
+        self._search = re.compile(
+            "|".join(re.escape(normalized) for _, normalized in longest_first)
+            or r"(?!)"
+        )
+        self._remove = re.compile(
+            "|".join(
+                r"\s*".join(re.escape(char) for char in keyword)
+                for keyword, _ in longest_first
+            )
+            or r"(?!)",
+            flags=re.IGNORECASE,
+        )
+        self._spaces = re.compile(r"\s{2,}")
+
+    @classmethod
+    def of(cls, keywords):
+        """
+        Get a matcher for the keywords, reusing it if it already is one.
+
+        Args:
+            keywords (list or KeywordMatcher): The keywords to look for.
+
+        Returns:
+            KeywordMatcher: The matcher of the keywords.
+        """
+        return keywords if isinstance(keywords, cls) else cls(keywords)
+
+    def __iter__(self):
+        return iter(self.keywords)
+
+    def is_match(self, name):
+        """
+        Check if any keyword is contained within the normalized name.
+
+        Args:
+            name (str): The name to check.
+
+        Returns:
+            bool: True if any keyword is found, False otherwise.
+        """
+        return self._search.search(normalize_name(name)) is not None
+
+    def matches(self, name):
+        """
+        Get the keywords contained within the normalized name.
+
+        Args:
+            name (str): The name to check.
+
+        Returns:
+            list: The matching keywords, in the order they were given.
+        """
+        normalized = normalize_name(name)
+        if self._search.search(normalized) is None:
+            return []
+        return [keyword for keyword, norm in self._normalized if norm in normalized]
+
+    def clean(self, name, new_name):
+        """
+        Remove every keyword from a name in a single pass.
+
+        If a keyword matches but can't be removed as written, it is replaced with the new name.
+
+        Args:
+            name (str): The name to clean.
+            new_name (str): The text that replaces the keywords that can't be removed.
+
+        Returns:
+            str: The cleaned name, with extra spaces removed.
+        """
+        cleaned = self._spaces.sub(" ", self._remove.sub("", name).strip())
+        if cleaned == name:
+            for keyword in self.matches(name):
+                cleaned = cleaned.replace(keyword.strip(), new_name)
+        return cleaned
+
+
 def checkFileExists(file_path):
     """
     Check if a file exists at the given file path.
@@ -147,6 +253,88 @@ def checkValidPath(path):
     return os.path.exists(path) and os.path.isdir(path)
 
 
+def get_state_dir(directory):
+    """
+    Get the folder where the renamer keeps its state files (like the metadata cache).
+
+    The folder is taken from the STATE_DIR env var and defaults to a hidden folder
+    inside the given directory. It is created if it doesn't exist.
+
+    Args:
+        directory (str): The library directory that is being processed.
+
+    Returns:
+        str: The path of the state folder.
+    """
+    state_dir = config("STATE_DIR", default="") or os.path.join(
+        directory, ".metadatarenamer"
+    )
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def get_user_cache_dir():
+    """
+    Get the folder where the renamer keeps the state that doesn't belong to a library.
+
+    The folder is taken from the STATE_DIR env var and defaults to the cache folder of
+    the user (XDG_CACHE_HOME or ~/.cache, LOCALAPPDATA on Windows).
+
+    Returns:
+        str: The path of the folder. It is not created.
+    """
+    cache_home = os.environ.get("LOCALAPPDATA") if os.name == "nt" else None
+    cache_home = cache_home or os.environ.get("XDG_CACHE_HOME")
+    cache_home = cache_home or os.path.join(os.path.expanduser("~"), ".cache")
+    return config("STATE_DIR", default="") or os.path.join(
+        cache_home, "metadatarenamer"
+    )
+
+
+def get_mkv_toolnix_version():
+    """
+    Find the MKVToolNix executables and get the version of mkvmerge.
+
+    The executables are looked up in the PATH without starting a shell. The version is
+    cached in toolchain.json in the user cache folder, keyed by the path, size and
+    modification time of mkvmerge, so mkvmerge -V only runs again after MKVToolNix
+    is updated or moved.
+
+    Returns:
+        str: The version line of mkvmerge, or None if MKVToolNix is not installed.
+    """
+    mkvmerge = shutil.which("mkvmerge")
+    if mkvmerge is None or shutil.which("mkvpropedit") is None:
+        return None
+    stat = os.stat(mkvmerge)
+    key = f"{os.path.realpath(mkvmerge)}:{stat.st_size}:{stat.st_mtime_ns}"
+    cache_file = os.path.join(get_user_cache_dir(), "toolchain.json")
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["version"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    try:
+        result = subprocess.run(
+            [mkvmerge, "-V"], capture_output=True, text=True, encoding="utf-8"
+        )
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    version = result.stdout.strip()
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(f"{cache_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"key": key, "version": version}, f)
+        os.replace(f"{cache_file}.tmp", cache_file)
+    except OSError:
+        pass
+    return version
+
+
 def check_mkv_toolnix_installed():
     """
     Check if mkvtoolnix is installed on the system.
@@ -154,4 +342,8 @@ def check_mkv_toolnix_installed():
     Returns:
         bool: True if mkvtoolnix is installed, False otherwise.
     """
-    return os.system("mkvmerge -V") == 0
+    version = get_mkv_toolnix_version()
+    if version is None:
+        return False
+    print(version)
+    return True
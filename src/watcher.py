@@ -0,0 +1,229 @@
+import ctypes, ctypes.util, os, queue, select, struct, sys, threading, time
+from decouple import config
+from scanner import scan_files, get_scan_options
+from workerPool import get_workers
+
+
+class _Inotify:
+    """
+    Minimal inotify wrapper (Linux only) that watches a folder and all its subfolders.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, root):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        """
+        Watch a folder and its subfolders, returning the files already inside them.
+
+        A new folder can get files before it is watched, so they are reported this way.
+        """
+        found = []
+        for folder, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Could not watch {folder}")
+            self._paths[wd] = folder
+            found += [os.path.join(folder, f) for f in files]
+        return found
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return the paths of the changed files."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                raise OSError("inotify queue overflow")
+            folder = self._paths.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed += self.add_tree(path)
+            else:
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Polling:
+    """
+    Fallback that scans the library every interval and reports new or modified files.
+    """
+
+    def __init__(self, root, extensions, interval):
+        self._root = root
+        self._extensions = extensions
+        self._interval = interval
+        self._known = self._snapshot()
+        self._next_scan = time.monotonic() + interval
+
+    def _snapshot(self):
+        snapshot = {}
+        for path in scan_files(self._root, self._extensions, **get_scan_options()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return the files changed since the last scan."""
+        # the library is only scanned every interval, but the watcher checks if it has to
+        # stop after each timeout
+        remaining = self._next_scan - time.monotonic()
+        if remaining > timeout:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(remaining, 0))
+        self._next_scan = time.monotonic() + self._interval
+        current = self._snapshot()
+        changed = [
+            path for path, state in current.items() if self._known.get(path) != state
+        ]
+        self._known = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def watch(directory, extensions, handler, key=None, stop=None):
+    """
+    Watch the library and run the handler on each new file once it is fully written.
+
+    Files are reported by inotify when it is available (or by scanning the library every
+    WATCH_POLL_INTERVAL seconds, e.g. on Windows, macOS or network shares, or when
+    WATCH_POLLING is True). A file is ready when its size and modification time did not
+    change for WATCH_SETTLE seconds. Ready files go to a queue of WATCH_QUEUE_SIZE entries
+    that is consumed by WORKERS threads, and the watcher waits when the queue is full.
+
+    Args:
+        directory (str): The library directory.
+        extensions (tuple): The file extensions to react to.
+        handler (callable): The function called with the key of each ready file.
+        key (callable, optional): Maps a file to the job that handles it (e.g. a subtitle
+            to its video), so files of the same job queued together run once. It can
+            return None to ignore the file. Defaults to the file path.
+        stop (threading.Event, optional): Stops the watcher when set. By default it runs
+            until it is interrupted.
+
+    Returns:
+        None
+    """
+    settle = config("WATCH_SETTLE", default=5.0, cast=float)
+    interval = config("WATCH_POLL_INTERVAL", default=10.0, cast=float)
+    jobs = queue.Queue(maxsize=config("WATCH_QUEUE_SIZE", default=100, cast=int))
+    queued = set()
+    queued_lock = threading.Lock()
+    stop = stop or threading.Event()
+    key = key or (lambda path: path)
+
+    source = None
+    if not config("WATCH_POLLING", default=False, cast=bool):
+        try:
+            source = _Inotify(directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), scanning every {interval} seconds.")
+    if source is None:
+        source = _Polling(directory, extensions, interval)
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            with queued_lock:
+                queued.discard(job)
+            try:
+                handler(job)
+            except Exception as e:
+                print(f"Error processing {job}: {e}")
+            finally:
+                jobs.task_done()
+
+    threads = [
+        threading.Thread(target=worker, daemon=True)
+        for _ in range(get_workers(config("WORKERS", default=None)))
+    ]
+    for thread in threads:
+        thread.start()
+
+    print(f"--------------- Watching {directory} ---------------")
+    pending = {}
+    try:
+        while not stop.is_set():
+            try:
+                changed = source.poll(settle if pending else 1.0)
+            except OSError as e:
+                print(f"inotify stopped working ({e}), scanning every {interval} seconds.")
+                source.close()
+                source = _Polling(directory, extensions, interval)
+                continue
+            now = time.monotonic()
+            for path in changed:
+                name = os.path.basename(path)
+                if name.endswith(extensions) and not name.startswith("."):
+                    pending[path] = (now, _stat(path))
+            for path, (since, state) in list(pending.items()):
+                if now - since < settle:
+                    continue
+                current = _stat(path)
+                if current is None:
+                    del pending[path]
+                elif current != state:
+                    # still being written
+                    pending[path] = (now, current)
+                else:
+                    del pending[path]
+                    job = key(path)
+                    with queued_lock:
+                        if job is None or job in queued:
+                            continue
+                        queued.add(job)
+                    jobs.put(job)
+    except KeyboardInterrupt:
+        print("Stopping the watcher...")
+    finally:
+        source.close()
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,265 @@
+import contextlib, os, socket, sqlite3, threading, time, uuid
+from decouple import config
+
+
+def file_signature(file_path, *extra):
+    """
+    Get a value that changes when a file (or the given extra values) change.
+
+    Args:
+        file_path (str): The path of the file.
+        *extra: Other values the work on the file depends on (e.g. its subtitle files).
+
+    Returns:
+        str: The size and modification time of the file, and the extra values.
+    """
+    stat = os.stat(file_path)
+    return "\t".join([str(stat.st_size), str(stat.st_mtime_ns), *map(str, extra)])
+
+
+class WorkQueue:
+    """
+    Queue of the files of a library shared by several workers (containers or nodes).
+
+    The queue is a SQLite database on a volume all the workers mount. Each worker adds the
+    files it finds and claims them one at a time: a claimed file is leased to the worker
+    for QUEUE_LEASE seconds, and a background thread renews the leases of the files the
+    worker holds while it works on them. The file of a worker that stops (crash, killed
+    container) is claimed again by another worker once its lease expires. A file that
+    fails QUEUE_ATTEMPTS times is left alone until it changes. The files are saved
+    relative to the library folder, so the workers can mount it at different paths.
+
+    The leases use the clock of each worker, so the clocks of the nodes have to be in
+    sync to a few seconds, and the volume has to support file locks (SQLite over NFS
+    needs working lockd).
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        root (str): The library folder, as this worker sees it.
+        kind (str): The kind of work ("edit" or "mux").
+        key (str): The settings of the work. All the workers have to use the same ones.
+    """
+
+    def __init__(self, db_path, root, kind, key=""):
+        self.root = os.path.abspath(root)
+        self.kind = kind
+        self.lease = config("QUEUE_LEASE", default=60, cast=float)
+        self.max_attempts = config("QUEUE_ATTEMPTS", default=3, cast=int)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self._lock = threading.Lock()
+        # the transactions are started by hand, see _transaction
+        self._connection = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        with self._transaction() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS queues (
+                    kind TEXT PRIMARY KEY,
+                    key TEXT NOT NULL
+                )"""
+            )
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS items (
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    signature TEXT NOT NULL,
+                    done_signature TEXT,
+                    state TEXT NOT NULL,
+                    owner TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (kind, path)
+                )"""
+            )
+            row = db.execute("SELECT key FROM queues WHERE kind = ?", (kind,)).fetchone()
+            if row is None or row[0] != key:
+                leased = db.execute(
+                    "SELECT COUNT(*) FROM items WHERE kind = ? AND state = 'leased' "
+                    "AND lease_until >= ?",
+                    (kind, time.time()),
+                ).fetchone()[0]
+                if leased:
+                    raise Exception(
+                        "Another worker is processing the library with different settings."
+                    )
+                db.execute("DELETE FROM items WHERE kind = ?", (kind,))
+                db.execute("INSERT OR REPLACE INTO queues VALUES (?, ?)", (kind, key))
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_leases, daemon=True)
+        self._heartbeat.start()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock at once, so two workers can't both read a
+        # file as pending and claim it
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _relative(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root).replace(os.sep, "/")
+
+    def _absolute(self, path):
+        return os.path.join(self.root, *path.split("/"))
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                with self._transaction() as db:
+                    db.execute(
+                        "UPDATE items SET lease_until = ? WHERE kind = ? AND owner = ? "
+                        "AND state = 'leased'",
+                        (time.time() + self.lease, self.kind, self.owner),
+                    )
+            except sqlite3.Error as e:
+                # the next renewal may work, the leases only expire after a while
+                print(f"Could not renew the leases of the work queue: {e}")
+
+    def add(self, files):
+        """
+        Add files to the queue.
+
+        A file that is already queued is left as it is, unless it was done or failed and
+        changed since then. A worker may have found the file before another worker
+        changed it, so the signatures from before and after the work both count as
+        unchanged.
+
+        Args:
+            files (iterable): The path and the file_signature of each file.
+        """
+        rows = [(self._relative(path), signature) for path, signature in files]
+        # small transactions, so the other workers can claim files in between
+        for start in range(0, len(rows), 500):
+            with self._transaction() as db:
+                for path, signature in rows[start : start + 500]:
+                    db.execute(
+                        "INSERT INTO items (kind, path, signature, state) "
+                        "VALUES (?, ?, ?, 'pending') ON CONFLICT (kind, path) DO UPDATE "
+                        "SET signature = excluded.signature, done_signature = NULL, "
+                        "state = 'pending', owner = NULL, attempts = 0 "
+                        "WHERE state IN ('done', 'failed') AND excluded.signature "
+                        "NOT IN (signature, IFNULL(done_signature, ''))",
+                        (self.kind, path, signature),
+                    )
+
+    def claim(self):
+        """
+        Lease the next pending file to this worker.
+
+        Returns:
+            str: The path of the file, or None if no file is left.
+        """
+        while True:
+            now = time.time()
+            with self._transaction() as db:
+                row = db.execute(
+                    "SELECT path, attempts FROM items WHERE kind = ? AND (state = 'pending' "
+                    "OR (state = 'leased' AND lease_until < ?)) ORDER BY path LIMIT 1",
+                    (self.kind, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                path, attempts = row
+                if attempts >= self.max_attempts:
+                    db.execute(
+                        "UPDATE items SET state = 'failed', owner = NULL "
+                        "WHERE kind = ? AND path = ?",
+                        (self.kind, path),
+                    )
+                    print(f"Giving up on {path} after {attempts} attempts.")
+                    continue
+                db.execute(
+                    "UPDATE items SET state = 'leased', owner = ?, lease_until = ?, "
+                    "attempts = attempts + 1 WHERE kind = ? AND path = ?",
+                    (self.owner, now + self.lease, self.kind, path),
+                )
+            return self._absolute(path)
+
+    def claims(self):
+        """
+        Claim the pending files one at a time until no file is left.
+
+        Returns:
+            iterator: The path of each claimed file, claimed when it is requested.
+        """
+        return iter(self.claim, None)
+
+    def complete(self, file_path, signature):
+        """
+        Mark a claimed file as done.
+
+        Args:
+            file_path (str): The path of the file.
+            signature (str): The file_signature of the file after the work.
+
+        Returns:
+            bool: True if the file was still leased to this worker, False if its lease
+                expired and it was claimed by another worker.
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE items SET state = 'done', done_signature = ?, owner = NULL "
+                "WHERE kind = ? AND path = ? AND owner = ?",
+                (signature, self.kind, self._relative(file_path), self.owner),
+            )
+        if cursor.rowcount != 1:
+            print(f"The lease of {file_path} expired while it was processed.")
+        return cursor.rowcount == 1
+
+    def release(self, file_path):
+        """
+        Give a claimed file back to the queue after it failed, so it is tried again.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE items SET state = 'pending', owner = NULL "
+                "WHERE kind = ? AND path = ? AND owner = ?",
+                (self.kind, self._relative(file_path), self.owner),
+            )
+
+    def is_drained(self):
+        """
+        Check if all the queued files are done or failed.
+
+        Returns:
+            bool: True if no file is pending or being processed by a worker.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(*) FROM items WHERE kind = ? AND state IN ('pending', 'leased')",
+                (self.kind,),
+            ).fetchone()
+        return row[0] == 0
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat.join()
+        with self._lock:
+            self._connection.close()
+
+
+def open_queue(directory, kind, key=""):
+    """
+    Open the work queue shared with the other workers, if the QUEUE_DIR env var is set.
+
+    Args:
+        directory (str): The library folder.
+        kind (str): The kind of work ("edit" or "mux").
+        key (str): The settings of the work.
+
+    Returns:
+        WorkQueue: The queue, or None when this worker runs alone.
+    """
+    queue_dir = config("QUEUE_DIR", default="")
+    if not queue_dir:
+        return None
+    os.makedirs(queue_dir, exist_ok=True)
+    return WorkQueue(os.path.join(queue_dir, "queue.sqlite"), directory, kind, key)
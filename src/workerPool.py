@@ -0,0 +1,139 @@
+import io, itertools, os, sys, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that sends the prints of every pool task into its own buffer.
+
+    Writes coming from threads that are not running a task go straight to the real stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def start_capture(self):
+        self._local.buffer = io.StringIO()
+
+    def stop_capture(self):
+        buffer = self._local.buffer
+        self._local.buffer = None
+        return buffer.getvalue()
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            return self._stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def get_workers(value=None):
+    """
+    Get the number of workers to use for the pool.
+
+    Args:
+        value (str, optional): The configured number of workers (e.g. the WORKERS env var).
+
+    Returns:
+        int: The number of workers, the CPU count when the value is empty or invalid.
+    """
+    try:
+        workers = int(value)
+    except (TypeError, ValueError):
+        workers = os.cpu_count() or 1
+    return max(workers, 1)
+
+
+def iter_chunks(items, size):
+    """
+    Split the given items in lists of a bounded size, taking them lazily.
+
+    Args:
+        items (iterable): The items to split. It is consumed lazily.
+        size (int): The maximum number of items of each list.
+
+    Yields:
+        list: The next items, up to size of them.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, max(size, 1)))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_task(output, func, item):
+    output.start_capture()
+    result, error = None, None
+    try:
+        result = func(item)
+    except Exception as e:
+        error = e
+    return result, error, output.stop_capture()
+
+
+def iter_pool(func, items, workers):
+    """
+    Run a function over the given items using a bounded pool of threads, yielding each
+    result as soon as it and the ones before it are done.
+
+    Each task prints into its own buffer, and the buffers are written to the console
+    in the same order as the items, so the output of different files never mixes.
+    An exception raised by one task is stored in its result and does not stop the others.
+
+    Args:
+        func (callable): The function to call with each item.
+        items (iterable): The items to process. It is consumed lazily.
+        workers (int): The maximum number of tasks running at the same time.
+
+    Yields:
+        tuple: An (item, result, error) tuple for each item, in the same order as the items.
+    """
+    pending = deque()
+    stdout = sys.stdout
+    output = _ThreadOutput(stdout)
+
+    def flush_done(block):
+        while pending and (block or pending[0][1].done()):
+            item, future = pending.popleft()
+            result, error, text = future.result()
+            stdout.write(text)
+            if error is not None:
+                print(f"Error processing {item}: {error}", file=stdout)
+            stdout.flush()
+            yield item, result, error
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for item in items:
+                pending.append((item, executor.submit(_run_task, output, func, item)))
+                yield from flush_done(block=False)
+                # keep a bounded number of queued tasks so big listings stay lazy
+                while len(pending) >= workers * 2:
+                    pending[0][1].result()
+                    yield from flush_done(block=False)
+            yield from flush_done(block=True)
+    finally:
+        sys.stdout = stdout
+
+
+def run_pool(func, items, workers):
+    """
+    Run a function over the given items using a bounded pool of threads, see iter_pool.
+
+    Args:
+        func (callable): The function to call with each item.
+        items (iterable): The items to process. It is consumed lazily.
+        workers (int): The maximum number of tasks running at the same time.
+
+    Returns:
+        list: A list of (item, result, error) tuples in the same order as the items.
+    """
+    return list(iter_pool(func, items, workers))
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules of src import each other by name, like when main.py is run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
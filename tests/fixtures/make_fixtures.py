@@ -0,0 +1,159 @@
+"""
+Write the Matroska files the tests read (tests/fixtures/*.mkv).
+
+The files are written with the EBML writer of benchmarks/bench_matroska.py, with tiny
+clusters, so they are small enough to commit. With --mkvtoolnix, a file is also muxed
+by the installed mkvmerge and a copy of it is edited by mkvpropedit, and their
+mkvmerge -J and mkvinfo outputs are recorded next to them in tests/fixtures/mkvmerge,
+for the tests that compare the built-in reader and editor with MKVToolNix.
+
+Usage:
+    python tests/fixtures/make_fixtures.py [--mkvtoolnix]
+"""
+
+import argparse, json, os, shutil, subprocess, sys, tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "src"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "benchmarks"))
+
+import matroska as mk
+from bench_matroska import crc, element, frames_tag, reference_layouts, text, uint, write_file
+from editBatch import EditBatch
+
+CLUSTER_SIZE = 64
+RECORDED = os.path.join(HERE, "mkvmerge")
+
+SUBTITLES = {
+    "spanish.srt": "1\n00:00:01,000 --> 00:00:02,000\n¿A dónde vas esta noche?\n\n"
+    "2\n00:00:03,000 --> 00:00:04,000\nTe dije que no era mi culpa.\n",
+    "english.srt": "1\n00:00:01,000 --> 00:00:02,000\nWhere are you going tonight?\n\n"
+    "2\n00:00:03,000 --> 00:00:04,000\nI told you it was not my fault.\n",
+}
+# the changes mkvpropedit writes to the recorded file: a shorter title, a renamed track
+# and a name added to a track without one
+EDITS = {"title": "Show S01E01", "track_names": {"1": "Spanish", "2": "English"}}
+
+
+def tagged_layout():
+    """A subtitle track with the frame count and the hash tag written by the renamer."""
+    tracks = element(
+        mk.TRACKS,
+        element(
+            mk.TRACK_ENTRY,
+            uint(mk.TRACK_NUMBER, 1) + uint(mk.TRACK_UID, 1001) + uint(mk.TRACK_TYPE, 0x11)
+            + text(mk.CODEC_ID, "S_TEXT/UTF8") + text(mk.LANGUAGE, "spa"),
+        ),
+    )
+    targets = element(mk.TARGETS, uint(0x68CA, 50) + uint(mk.TAG_TRACK_UID, 1001))
+    simple = element(
+        mk.SIMPLE_TAG,
+        text(mk.TAG_NAME, "METADATARENAMER_SUBTITLE_SHA256") + text(mk.TAG_STRING, "ab" * 32),
+    )
+    tags = element(mk.TAGS, frames_tag(1001, 2) + element(mk.TAG, targets + simple))
+    return dict(before=[(mk.TRACKS, tracks), (mk.TAGS, tags)], after=[])
+
+
+def padded_layout():
+    """
+    The mkvmerge layout with Void padding after the Info and the Tracks, and an Info
+    without title, for the in-place editor.
+    """
+    layout, _ = reference_layouts()["seekhead.mkv"]
+    tracks = dict(layout["before"])[mk.TRACKS]
+    info = element(mk.INFO, crc(uint(0x2AD7B1, 1000000)))
+    return dict(
+        layout,
+        before=[
+            (mk.INFO, info),
+            (mk.VOID, element(mk.VOID, b"\0" * 64)),
+            (mk.TRACKS, tracks),
+            (mk.VOID, element(mk.VOID, b"\0" * 256)),
+        ],
+    )
+
+
+def write_fixtures():
+    layouts = {name: layout for name, (layout, _) in reference_layouts().items()}
+    layouts["tagged.mkv"] = tagged_layout()
+    layouts["padded.mkv"] = padded_layout()
+    for name, layout in layouts.items():
+        write_file(os.path.join(HERE, name), cluster_size=CLUSTER_SIZE, **layout)
+    # a file shorter than its segment, a streamed file cut in the middle of its Tracks,
+    # and a file that is not Matroska
+    for name, truncated, size in (
+        ("seekhead.mkv", "truncated.mkv", 200),
+        ("streamed.webm", "truncated.webm", 100),
+    ):
+        with open(os.path.join(HERE, name), "rb") as f:
+            header = f.read(size)
+        with open(os.path.join(HERE, truncated), "wb") as f:
+            f.write(header)
+    with open(os.path.join(HERE, "not-matroska.mkv"), "wb") as f:
+        f.write(b"RIFF\0\0\0\0AVI LIST")
+    open(os.path.join(HERE, "empty.mkv"), "wb").close()
+
+
+def run(command):
+    result = subprocess.run(
+        command, cwd=RECORDED, capture_output=True, text=True, encoding="utf-8"
+    )
+    # MKVToolNix exits with 1 when there were only warnings
+    if result.returncode > 1:
+        raise SystemExit(f"{' '.join(command)} failed: {result.stdout}{result.stderr}")
+    return result.stdout
+
+
+def record(name):
+    with open(os.path.join(RECORDED, f"{name}.json"), "w", encoding="utf-8") as f:
+        f.write(run(["mkvmerge", "-J", f"{name}.mkv"]))
+    with open(os.path.join(RECORDED, f"{name}.mkvinfo.txt"), "w", encoding="utf-8") as f:
+        f.write(run(["mkvinfo", "--ui-language", "en_US", f"{name}.mkv"]))
+
+
+def record_mkvtoolnix():
+    os.makedirs(RECORDED, exist_ok=True)
+    work = tempfile.mkdtemp(prefix="mdr-fixtures-")
+    try:
+        for name, content in SUBTITLES.items():
+            with open(os.path.join(work, name), "w", encoding="utf-8") as f:
+                f.write(content)
+        with open(os.path.join(work, "GRP-info.txt"), "w", encoding="utf-8") as f:
+            f.write("Released by GRP\n")
+        run(
+            [
+                "mkvmerge", "--no-date", "-o", "muxed.mkv",
+                "--title", "Show S01E01 GRP",
+                "--language", "0:spa", "--track-name", "0:Spanish GRP",
+                os.path.join(work, "spanish.srt"),
+                "--language", "0:eng", os.path.join(work, "english.srt"),
+                "--attachment-mime-type", "text/plain",
+                "--attach-file", os.path.join(work, "GRP-info.txt"),
+            ]
+        )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    record("muxed")
+    shutil.copyfile(os.path.join(RECORDED, "muxed.mkv"), os.path.join(RECORDED, "edited.mkv"))
+    # the same mkvpropedit command the renamer runs when it can't edit the file itself
+    batch = EditBatch("edited.mkv")
+    batch.set_title(EDITS["title"])
+    for number, name in EDITS["track_names"].items():
+        batch.set_track_name(int(number), name)
+    run(batch.command())
+    with open(os.path.join(RECORDED, "edited.edits.json"), "w", encoding="utf-8") as f:
+        json.dump(EDITS, f, ensure_ascii=False, indent=2)
+    record("edited")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mkvtoolnix", action="store_true")
+    args = parser.parse_args()
+    write_fixtures()
+    if args.mkvtoolnix:
+        record_mkvtoolnix()
+
+
+if __name__ == "__main__":
+    main()
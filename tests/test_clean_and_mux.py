@@ -0,0 +1,46 @@
+import json, os, sys
+from collections import Counter
+import pytest
+from main import clean_and_mux_directory
+from utils import KeywordMatcher
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+
+from bench_library import KEYWORDS, make_library
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    root = tmp_path / "library"
+    make_library(str(root), videos=3, tracks=4, subs=1)
+    # the MKVToolNix stubs of the benchmarks, which log their calls
+    stubs = os.path.join(BENCHMARKS, "stubs")
+    monkeypatch.setenv("PATH", stubs + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("STUB_LOG", str(tmp_path / "calls.log"))
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("DELETE_SUBS", "n")
+    for name in ("CACHE", "QUEUE_DIR", "INDEX_QUERY", "SCAN_INCLUDE", "SCAN_EXCLUDE"):
+        monkeypatch.delenv(name, raising=False)
+    return root
+
+
+def calls(tmp_path):
+    with open(tmp_path / "calls.log", encoding="utf-8") as f:
+        return Counter(line.split("\t", 1)[0] for line in f)
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_the_remuxed_videos_are_not_probed_again(
+    library, tmp_path, monkeypatch, capsys, jobs
+):
+    monkeypatch.setenv("MUX_JOBS", jobs)
+    clean_and_mux_directory(str(library), KeywordMatcher(KEYWORDS), " ")
+    # each video is probed once, before its remux
+    assert calls(tmp_path) == {"mkvmerge -J": 3, "mkvmerge": 3}
+    assert "3 files, 0 changed, 0 unchanged, 3 skipped" in capsys.readouterr().out
+    for name in os.listdir(library):
+        if name.endswith(".mkv"):
+            with open(library / name, encoding="utf-8") as f:
+                description = json.load(f)
+            assert not KeywordMatcher(KEYWORDS).is_match(description["title"])
@@ -0,0 +1,77 @@
+import os
+import pytest
+import detectLanguage
+import languageCache
+from detectLanguage import DetectionPool, detect_subtitle_language, get_languages_codes
+
+ENGLISH = "Where are you going tonight?\nI told you it was not my fault.\n" * 20
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("DETECT_CACHE_SIZE", "0")
+    monkeypatch.setattr(detectLanguage, "_detector", None)
+    monkeypatch.setattr(detectLanguage, "_unavailable", None)
+
+
+def write_subtitles(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"video{i}.srt"
+        path.write_text(f"1\n00:00:01,000 --> 00:00:02,000\n{ENGLISH}\n", encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_unknown_detect_languages_fall_back_to_langdetect(tmp_path, monkeypatch, capsys, workers):
+    monkeypatch.setenv("DETECT_LANGUAGES", "en,zh")
+    paths = write_subtitles(tmp_path, 4)
+    with DetectionPool(workers) as pool:
+        detected = pool.detect(paths)
+        detected.update(pool.detect(paths[:1]))
+    assert {language for language, _ in detected.values()} == {"eng"}
+    # the setting is reported once, not for each file or each chunk
+    assert capsys.readouterr().out.count("Unknown DETECT_LANGUAGES: zh.") == 1
+
+
+def test_an_unreadable_subtitle_is_unknown(tmp_path):
+    language, confidence, _ = detect_subtitle_language(str(tmp_path / "missing.srt"))
+    assert (language, confidence) == ("Unknown", 0.0)
+
+
+def test_errors_that_are_not_about_the_file_are_not_hidden(tmp_path, monkeypatch):
+    path = write_subtitles(tmp_path, 1)[0]
+
+    def broken():
+        raise RuntimeError("broken detector")
+
+    monkeypatch.setattr(detectLanguage, "get_detector", broken)
+    with pytest.raises(RuntimeError):
+        detect_subtitle_language(path)
+
+
+def test_the_language_cache_is_opened_once_per_process(tmp_path, monkeypatch):
+    monkeypatch.setenv("DETECT_CACHE_SIZE", "100")
+    monkeypatch.setenv("DETECT_LANGUAGES", "en,es")
+    monkeypatch.setattr(detectLanguage, "_shared_pool", None)
+    opened = []
+    open_language_cache = languageCache.open_language_cache
+
+    def counted(version):
+        opened.append(version)
+        return open_language_cache(version)
+
+    monkeypatch.setattr(languageCache, "open_language_cache", counted)
+    paths = write_subtitles(tmp_path, 3)
+    # the videos of the watch mode are detected one at a time
+    for path in paths:
+        assert get_languages_codes([os.path.basename(path)], str(tmp_path), False) == ["eng"]
+    assert len(opened) == 1
+    detectLanguage.shared_detection_pool().close()
+    # a run passes the pool it detects its chunks with
+    with DetectionPool(1) as pool:
+        get_languages_codes(["video0.srt"], str(tmp_path), False, {}, pool)
+        get_languages_codes(["video1.srt"], str(tmp_path), False, {}, pool)
+    assert len(opened) == 2
@@ -0,0 +1,54 @@
+from utils import KeywordMatcher, normalize_name
+
+KEYWORDS = [" GRP", " RlsGroup", " www.example.org"]
+
+
+def test_normalize_name_ignores_case_and_spaces():
+    assert normalize_name("  Release  Group ") == "releasegroup"
+    assert normalize_name("G R P\tx") == "grpx"
+
+
+def test_is_match_ignores_case_and_spaces():
+    matcher = KeywordMatcher(KEYWORDS)
+    assert matcher.is_match("Spanish GRP")
+    assert matcher.is_match("Spanish g r p")
+    assert matcher.is_match("English [RLSGROUP]")
+    assert not matcher.is_match("English")
+    assert not matcher.is_match("Groupie")
+
+
+def test_blank_keywords_match_nothing():
+    matcher = KeywordMatcher([" ", ""])
+    assert not matcher.is_match("anything")
+    assert matcher.clean("anything", " new") == "anything"
+
+
+def test_matches_lists_every_keyword_in_the_given_order():
+    matcher = KeywordMatcher(KEYWORDS)
+    assert matcher.matches("Spanish www.example.org GRP") == [" GRP", " www.example.org"]
+    assert matcher.matches("English") == []
+
+
+def test_clean_removes_every_matching_keyword():
+    matcher = KeywordMatcher(KEYWORDS)
+    assert matcher.clean("Spanish GRP", " new") == "Spanish"
+    assert matcher.clean("Spanish G R P RlsGroup", " new") == "Spanish"
+    assert matcher.clean("Spanish www.example.org GRP", " new") == "Spanish"
+    assert matcher.clean("English", " new") == "English"
+
+
+def test_clean_prefers_the_longest_keyword():
+    matcher = KeywordMatcher(["ab", "abc"])
+    assert matcher.clean("x abc y", " new") == "x y"
+
+
+def test_clean_replaces_keywords_it_cant_remove():
+    # "GRP" matches the normalized name but not as written with the space before it
+    matcher = KeywordMatcher([" GRP"])
+    assert matcher.clean("Show-GRP", " NEW") == "Show- NEW"
+
+
+def test_of_reuses_a_matcher():
+    matcher = KeywordMatcher(KEYWORDS)
+    assert KeywordMatcher.of(matcher) is matcher
+    assert list(KeywordMatcher.of(KEYWORDS)) == KEYWORDS
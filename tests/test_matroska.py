@@ -0,0 +1,302 @@
+import json, os, re, shutil, subprocess, zlib
+import pytest
+import matroska as mk
+import probe
+from editBatch import EditBatch
+from matroska import MatroskaError, edit_header, identify
+from probe import Attachment, MkvInfo, Track, parse_identification, probe_file
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# the files written by the real mkvmerge, see fixtures/make_fixtures.py
+RECORDED = os.path.join(FIXTURES, "mkvmerge")
+
+needs_recording = pytest.mark.skipif(
+    not os.path.exists(os.path.join(RECORDED, "muxed.json")),
+    reason="no files written by MKVToolNix in tests/fixtures/mkvmerge, record them "
+    "with python tests/fixtures/make_fixtures.py --mkvtoolnix",
+)
+
+TRACKS = [
+    Track(0, 1, "video", "V_MPEGH/ISO/HEVC", "", "eng", "", 0),
+    Track(1, 2, "audio", "A_AAC", "Spanish GRP", "spa", "", 0),
+    Track(2, 3, "subtitles", "S_TEXT/UTF8", "Español", "spa", "es-419", 412),
+]
+ATTACHMENTS = [
+    Attachment(1, "font.ttf", "font/ttf"),
+    Attachment(2, "GRP-logo.png", "image/png"),
+]
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def read(path):
+    return parse_identification(path, identify(path))
+
+
+def recorded(name):
+    """Get the path of a recorded file and what mkvmerge -J printed for it."""
+    path = os.path.join(RECORDED, f"{name}.mkv")
+    with open(os.path.join(RECORDED, f"{name}.json"), encoding="utf-8") as f:
+        return path, parse_identification(path, json.load(f))
+
+
+def like_mkvmerge(info, expected):
+    # mkvmerge derives language_ietf from the legacy language when the file has none
+    for track, reference in zip(info.tracks, expected.tracks):
+        if not track.language_ietf:
+            track.language_ietf = reference.language_ietf
+    return info
+
+
+@pytest.mark.parametrize(
+    "name, title, attachments",
+    [
+        # SeekHead, Info, Tracks, clusters, then attachments and tags, like mkvmerge
+        ("seekhead.mkv", "Show S01E01 GRP", ATTACHMENTS),
+        # the tags are only listed in a second SeekHead at the end of the file
+        ("second-seekhead.mkv", "Show S01E01 GRP", ATTACHMENTS),
+        # no SeekHead and an unknown segment size, like a stream
+        ("streamed.webm", "", []),
+    ],
+)
+def test_the_header_is_read_without_mkvmerge(name, title, attachments):
+    path = fixture(name)
+    assert read(path) == MkvInfo(path, title, TRACKS, attachments)
+
+
+def test_the_tags_of_the_renamer_are_read():
+    track = read(fixture("tagged.mkv")).tracks[0]
+    assert (track.frames, track.fingerprint) == (2, "ab" * 32)
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "truncated.mkv",
+        "truncated.webm",
+        "complex-track.mkv",
+        "no-seekhead.mkv",
+        "not-matroska.mkv",
+        "empty.mkv",
+    ],
+)
+def test_the_files_the_reader_cant_read_are_left_to_mkvmerge(name):
+    with pytest.raises(MatroskaError):
+        identify(fixture(name))
+
+
+def mkvmerge_probe(monkeypatch):
+    """Replace mkvmerge -J by one that names every file "From mkvmerge"."""
+    commands = []
+
+    def run(command, *args, **kwargs):
+        commands.append(command)
+        output = {"container": {"properties": {"title": "From mkvmerge"}}, "tracks": []}
+        return subprocess.CompletedProcess(command, 0, json.dumps(output), "")
+
+    monkeypatch.setattr(probe.metrics, "run", run)
+    return commands
+
+
+def test_probe_file_asks_mkvmerge_by_default(monkeypatch):
+    monkeypatch.delenv("NATIVE_PROBE", raising=False)
+    commands = mkvmerge_probe(monkeypatch)
+    path = fixture("seekhead.mkv")
+    assert probe_file(path) == MkvInfo(path, "From mkvmerge")
+    assert commands == [["mkvmerge", "-J", path]]
+
+
+def test_probe_file_asks_mkvmerge_when_the_reader_gives_up(monkeypatch):
+    monkeypatch.setenv("NATIVE_PROBE", "True")
+    commands = mkvmerge_probe(monkeypatch)
+    path = fixture("truncated.mkv")
+    assert probe_file(path) == MkvInfo(path, "From mkvmerge")
+    assert commands == [["mkvmerge", "-J", path]]
+    # a file the reader understands doesn't start mkvmerge
+    probe_file(fixture("seekhead.mkv"))
+    assert len(commands) == 1
+
+
+@needs_recording
+@pytest.mark.parametrize("name", ["muxed", "edited"])
+def test_identify_matches_the_recorded_mkvmerge_output(name):
+    path, expected = recorded(name)
+    assert like_mkvmerge(read(path), expected) == expected
+
+
+def copy(tmp_path, name, folder=FIXTURES):
+    path = str(tmp_path / name)
+    shutil.copyfile(os.path.join(folder, name), path)
+    return path
+
+
+def header_elements(path):
+    """Get the start, data start and data end of the Info and Tracks of a file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    _, found = mk._segment(data)
+    return data, {element_id: found[element_id] for element_id in (mk.INFO, mk.TRACKS)}
+
+
+def room_end(path):
+    """Get the end of the Info, the Tracks and the Void elements after them."""
+    data, elements = header_elements(path)
+    segment_end, _ = mk._segment(data)
+    end = max(element_end for _, _, element_end in elements.values())
+    while end < segment_end and mk.read_id(data, end)[0] == mk.VOID:
+        end = mk.read_element(data, end, segment_end)[2]
+    return end
+
+
+def changed_range(before, after):
+    """Get the first and the last position (excluded) where two files differ."""
+    assert len(before) == len(after)
+    changed = [i for i, (a, b) in enumerate(zip(before, after)) if a != b]
+    return changed[0], changed[-1] + 1
+
+
+def test_names_and_title_are_added_in_the_padding(tmp_path):
+    path = copy(tmp_path, "padded.mkv")
+    before, elements = header_elements(path)
+    long_name = "Spanish (Latin America) commentary by the director and cast"
+    assert edit_header(path, "Show S01E01", {1: "Video", 2: long_name})
+    info = read(path)
+    assert info.title == "Show S01E01"
+    assert [track.name for track in info.tracks] == ["Video", long_name, "Español"]
+    assert info.attachments == ATTACHMENTS
+    # only the Info, the Tracks and the Void elements after them were written
+    after, _ = header_elements(path)
+    start, end = changed_range(before, after)
+    assert start >= elements[mk.INFO][0]
+    assert end <= room_end(path)
+
+
+def test_the_crc_of_the_edited_elements_is_computed_again(tmp_path):
+    path = copy(tmp_path, "padded.mkv")
+    before, _ = header_elements(path)
+    assert edit_header(path, "Show", {3: "Spanish"})
+    data, elements = header_elements(path)
+    for element_id, (_, start, end) in elements.items():
+        child_id, crc_start, crc_end = mk.read_element(data, start, end)
+        assert child_id == mk.CRC32
+        assert data[crc_start:crc_end] == zlib.crc32(data[crc_end:end]).to_bytes(4, "little")
+        assert data[crc_start:crc_end] not in before
+
+
+def test_a_single_spare_byte_goes_to_a_longer_size(tmp_path):
+    # one character less, with the Tracks right after the Info and no Void to grow
+    path = copy(tmp_path, "seekhead.mkv")
+    before, elements = header_elements(path)
+    assert edit_header(path, "Show S01E01 GR")
+    assert read(path).title == "Show S01E01 GR"
+    after, new_elements = header_elements(path)
+    start, old_data_start, old_end = elements[mk.INFO]
+    _, new_data_start, new_end = new_elements[mk.INFO]
+    assert new_data_start == old_data_start + 1
+    assert new_end == old_end
+    assert after[old_end:] == before[old_end:]
+
+
+def test_a_change_without_room_is_left_to_mkvpropedit(tmp_path):
+    path = copy(tmp_path, "seekhead.mkv")
+    with open(path, "rb") as f:
+        before = f.read()
+    long_name = "Spanish (Latin America) commentary by the director and cast"
+    assert not edit_header(path, None, {2: long_name})
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def test_the_header_is_restored_when_it_cant_be_read_back(tmp_path, monkeypatch):
+    path = copy(tmp_path, "padded.mkv")
+    with open(path, "rb") as f:
+        before = f.read()
+
+    def identify_written(path):
+        # the new header was written, but it reads back wrong
+        with open(path, "rb") as f:
+            assert f.read() != before
+        raise MatroskaError("damaged")
+
+    monkeypatch.setattr(mk, "identify", identify_written)
+    with pytest.raises(MatroskaError):
+        edit_header(path, "Show S01E01", {2: "Spanish"})
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def mkvpropedit_edit(monkeypatch):
+    """Replace mkvpropedit by one that only records its commands."""
+    commands = []
+    monkeypatch.setattr(
+        "editBatch.metrics.run",
+        lambda command, *args, **kwargs: commands.append(command)
+        or subprocess.CompletedProcess(command, 0, "", ""),
+    )
+    return commands
+
+
+def test_the_batch_uses_mkvpropedit_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv("NATIVE_EDIT", raising=False)
+    commands = mkvpropedit_edit(monkeypatch)
+    path = copy(tmp_path, "padded.mkv")
+    with open(path, "rb") as f:
+        before = f.read()
+    batch = EditBatch(path)
+    batch.set_title("Show")
+    assert batch.apply()
+    assert commands == [batch.command()]
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def test_the_batch_edits_in_place_and_leaves_the_rest_to_mkvpropedit(tmp_path, monkeypatch):
+    monkeypatch.setenv("NATIVE_EDIT", "True")
+    commands = mkvpropedit_edit(monkeypatch)
+    path = copy(tmp_path, "padded.mkv")
+    batch = EditBatch(path)
+    batch.set_title("Show")
+    batch.set_track_name(2, "Spanish")
+    assert batch.apply()
+    assert commands == []
+    assert read(path).title == "Show"
+    # attachments can only be removed by mkvpropedit
+    batch.delete_attachment(2)
+    assert batch.apply()
+    assert commands == [batch.command()]
+
+
+def mkvinfo_values(path):
+    """Get the title and the track names listed by a recorded mkvinfo output."""
+    with open(path, encoding="utf-8") as f:
+        return [
+            match.groups()
+            for match in map(re.compile(r"\+ (Title|Name): (.*)$").search, f)
+            if match
+        ]
+
+
+@needs_recording
+def test_the_edit_matches_the_file_edited_by_mkvpropedit(tmp_path):
+    path = copy(tmp_path, "muxed.mkv", RECORDED)
+    with open(os.path.join(RECORDED, "edited.edits.json"), encoding="utf-8") as f:
+        edits = json.load(f)
+    track_names = {int(number): name for number, name in edits["track_names"].items()}
+    with open(path, "rb") as f:
+        before = f.read()
+    assert edit_header(path, edits["title"], track_names)
+    _, expected = recorded("edited")
+    info = read(path)
+    assert like_mkvmerge(info, expected).title == expected.title
+    assert info.tracks == expected.tracks
+    assert info.attachments == expected.attachments
+    values = [("Title", info.title)] + [
+        ("Name", track.name) for track in info.tracks if track.name
+    ]
+    assert values == mkvinfo_values(os.path.join(RECORDED, "edited.mkvinfo.txt"))
+    # the rest of the file was not moved
+    with open(path, "rb") as f:
+        after = f.read()
+    assert changed_range(before, after)[1] <= room_end(path)
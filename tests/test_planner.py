@@ -0,0 +1,44 @@
+import json
+import pytest
+import planner
+from workerPool import iter_pool
+
+
+def test_iter_pool_yields_results_before_the_items_run_out():
+    consumed = []
+
+    def items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    results = iter_pool(lambda i: i * 2, items(), 2)
+    assert next(results) == (0, 0, None)
+    # only the first few items were taken from the listing
+    assert len(consumed) < 10
+    assert [result for _, result, _ in results] == [i * 2 for i in range(1, 100)]
+
+
+def test_create_plan_writes_each_record_as_it_is_planned(tmp_path, monkeypatch):
+    monkeypatch.setenv("PLAN", "edits")
+    monkeypatch.setenv("WORKERS", "2")
+    plan_file = tmp_path / "plan.ndjson"
+    written = []
+
+    def scan_files(directory, extensions, **options):
+        for i in range(20):
+            yield f"video{i}.mkv"
+            written.append(len(plan_file.read_text(encoding="utf-8").splitlines()))
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(planner, "scan_files", scan_files)
+    monkeypatch.setattr(
+        planner, "plan_edit", lambda input_file, keywords, new_name: {"file": input_file}
+    )
+    with pytest.raises(RuntimeError):
+        planner.create_plan(str(tmp_path), ["GRP"], " ", str(plan_file))
+    # the plan grew while the library was scanned, and the interrupted run kept it
+    assert written[-1] > 0
+    records = [json.loads(line) for line in plan_file.read_text(encoding="utf-8").splitlines()]
+    assert records == [{"file": f"video{i}.mkv"} for i in range(len(records))]
+    assert len(records) >= 15
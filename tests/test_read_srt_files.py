@@ -0,0 +1,100 @@
+import pytest
+import detectLanguage
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    directory = tmp_path / "library"
+    directory.mkdir()
+    for i in range(10):
+        (directory / f"video{i}.mkv").write_bytes(b"mkv")
+        (directory / f"video{i}.srt").write_text("1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("DELETE_SUBS", "n")
+    monkeypatch.setenv("DETECT_CHUNK_SIZE", "3")
+    monkeypatch.delenv("QUEUE_DIR", raising=False)
+    monkeypatch.delenv("MUX_JOBS", raising=False)
+    return directory
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Record the groups the scanner yields, the detected chunks and the muxed videos."""
+    events = []
+    iter_subtitle_groups = detectLanguage.iter_subtitle_groups
+
+    def scan(directory):
+        for video in iter_subtitle_groups(directory):
+            events.append(("scan", video[2]))
+            yield video
+
+    class Pool:
+        def __init__(self, workers=None):
+            events.append(("pool",))
+
+        def detect(self, paths):
+            paths = list(paths)
+            events.append(("detect", len(paths)))
+            return {path: ("eng", 1.0) for path in paths}
+
+        def close(self):
+            events.append(("close",))
+
+    def add_subtitles_to_video(directory, subsFolder, fileWithoutExtension, *args, **kwargs):
+        events.append(("mux", fileWithoutExtension))
+        return True
+
+    monkeypatch.setattr(detectLanguage, "iter_subtitle_groups", scan)
+    monkeypatch.setattr(detectLanguage, "DetectionPool", Pool)
+    monkeypatch.setattr(detectLanguage, "add_subtitles_to_video", add_subtitles_to_video)
+    return events
+
+
+def test_videos_are_detected_and_muxed_in_chunks_as_they_are_scanned(library, events):
+    detectLanguage.read_srt_files(str(library))
+    kinds = [event[0] for event in events]
+    # the first videos are muxed before the rest of the library is scanned
+    assert kinds[: kinds.index("mux")].count("scan") == 3
+    assert kinds.count("scan") == kinds.count("mux") == 10
+    assert [event[1] for event in events if event[0] == "detect"] == [3, 3, 3, 1]
+    # the same processes detect all the chunks
+    assert kinds.count("pool") == kinds.count("close") == 1
+
+
+def test_queued_videos_are_added_and_claimed_in_chunks(library, events, tmp_path, monkeypatch):
+    monkeypatch.setenv("QUEUE_DIR", str(tmp_path / "queue"))
+    detectLanguage.read_srt_files(str(library))
+    kinds = [event[0] for event in events]
+    assert kinds[: kinds.index("mux")].count("scan") == 3
+    muxed = [event[1] for event in events if event[0] == "mux"]
+    assert sorted(muxed) == [f"video{i}" for i in range(10)]
+    assert max(event[1] for event in events if event[0] == "detect") <= 3
+
+
+def test_only_the_included_videos_get_their_subtitles(library, events, monkeypatch):
+    monkeypatch.setenv("SCAN_INCLUDE", "video1*,video2.mkv")
+    detectLanguage.read_srt_files(str(library))
+    muxed = [event[1] for event in events if event[0] == "mux"]
+    assert muxed == ["video1", "video2"]
+
+
+@pytest.mark.parametrize("queued", [False, True])
+def test_a_video_that_fails_does_not_stop_the_others(
+    library, events, tmp_path, monkeypatch, queued
+):
+    if queued:
+        monkeypatch.setenv("QUEUE_DIR", str(tmp_path / "queue"))
+        monkeypatch.setenv("QUEUE_ATTEMPTS", "2")
+
+    def add_subtitles_to_video(directory, subsFolder, fileWithoutExtension, *args, **kwargs):
+        events.append(("mux", fileWithoutExtension))
+        if fileWithoutExtension == "video3":
+            raise RuntimeError("mkvmerge crashed")
+        return True
+
+    monkeypatch.setattr(detectLanguage, "add_subtitles_to_video", add_subtitles_to_video)
+    detectLanguage.read_srt_files(str(library))
+    muxed = [event[1] for event in events if event[0] == "mux"]
+    assert sorted(set(muxed)) == [f"video{i}" for i in range(10)]
+    # the failed video was given back to the queue and tried again
+    assert muxed.count("video3") == (2 if queued else 1)
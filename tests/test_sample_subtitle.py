@@ -0,0 +1,37 @@
+import pytest
+from detectLanguage import sample_subtitle_text
+
+DIALOGUE = ["Where are you going tonight?", "¿A dónde vas esta noche?", "Je t'ai dit ça."]
+
+
+def write_srt(path, encoding, cues=400):
+    lines = []
+    for i in range(cues):
+        lines += [str(i + 1), "00:00:01,000 --> 00:00:02,000", DIALOGUE[i % 3], ""]
+    path.write_bytes("\r\n".join(lines).encode(encoding))
+    return str(path)
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "utf-16", "utf-16-be"])
+@pytest.mark.parametrize("max_bytes", [4096, 3001, 5555])
+def test_every_window_is_decoded_with_the_encoding_of_the_file(tmp_path, encoding, max_bytes):
+    if encoding == "utf-16-be":
+        # with its byte order mark, like the files written by subtitle editors
+        path = tmp_path / "sub.srt"
+        path.write_bytes(b"\xfe\xff")
+        with open(path, "ab") as f:
+            f.write(open(write_srt(tmp_path / "body.srt", encoding), "rb").read())
+        path = str(path)
+    else:
+        path = write_srt(tmp_path / "sub.srt", encoding)
+    sample = sample_subtitle_text(path, max_chars=100000, max_bytes=max_bytes)
+    lines = sample.splitlines()
+    # the start, middle and end of the file are sampled, and nothing else
+    assert len(lines) > 20
+    assert set(lines) <= set(DIALOGUE)
+    assert set(lines) == set(DIALOGUE)
+
+
+def test_small_files_are_read_whole(tmp_path):
+    path = write_srt(tmp_path / "sub.srt", "utf-16", cues=3)
+    assert sample_subtitle_text(path).splitlines() == DIALOGUE
@@ -0,0 +1,91 @@
+import os
+from detectLanguage import (
+    build_mkvmerge_command,
+    find_missing_subtitles,
+    finish_subtitles_mux,
+    finalize_mkvmerge,
+    subtitle_fingerprint,
+)
+from probe import MkvInfo, Track
+
+CUES = [
+    ("00:00:01,000 --> 00:00:02,000", "¿A dónde vas esta noche?"),
+    ("00:00:03,000 --> 00:00:04,000", "Te dije que no era mi culpa."),
+]
+
+
+def write_srt(path, cues=CUES, encoding="utf-8", newline="\n", numbers=True):
+    lines = []
+    for i, (timing, text) in enumerate(cues):
+        lines += ([str(i + 1)] if numbers else []) + [timing, text, ""]
+    path.write_bytes(newline.join(lines).encode(encoding))
+    return str(path)
+
+
+def test_fingerprint_ignores_encoding_line_endings_and_cue_numbers(tmp_path):
+    fingerprint = subtitle_fingerprint(write_srt(tmp_path / "a.srt"))
+    assert subtitle_fingerprint(write_srt(tmp_path / "b.srt", encoding="utf-16")) == fingerprint
+    assert subtitle_fingerprint(write_srt(tmp_path / "c.srt", newline="\r\n")) == fingerprint
+    assert subtitle_fingerprint(write_srt(tmp_path / "d.srt", numbers=False)) == fingerprint
+
+
+def test_fingerprint_changes_with_corrected_or_resynced_cues(tmp_path):
+    fingerprint = subtitle_fingerprint(write_srt(tmp_path / "a.srt"))
+    corrected = [CUES[0], (CUES[1][0], "Te dije que no fue mi culpa.")]
+    resynced = [("00:00:01,500 --> 00:00:02,500", CUES[0][1]), CUES[1]]
+    assert subtitle_fingerprint(write_srt(tmp_path / "b.srt", corrected)) != fingerprint
+    assert subtitle_fingerprint(write_srt(tmp_path / "c.srt", resynced)) != fingerprint
+
+
+def video_with(track):
+    return MkvInfo("video.mkv", "", [Track(0, 1, "video"), track], [])
+
+
+def subtitle_track(**properties):
+    return Track(1, 2, "subtitles", "S_TEXT/UTF8", "Español", "spa", "", **properties)
+
+
+def test_a_subtitle_with_the_same_hash_is_embedded(tmp_path):
+    sub = write_srt(tmp_path / "Ep1.srt")
+    info = video_with(subtitle_track(frames=2, fingerprint=subtitle_fingerprint(sub)))
+    assert find_missing_subtitles("video.mkv", str(tmp_path), ["spa"], ["Ep1.srt"], info) == ([], [])
+
+
+def test_a_corrected_subtitle_with_the_same_cue_count_is_muxed(tmp_path):
+    old = write_srt(tmp_path / "old.srt")
+    write_srt(tmp_path / "Ep1.srt", [CUES[0], (CUES[1][0], "Te dije que no fue mi culpa.")])
+    info = video_with(subtitle_track(frames=2, fingerprint=subtitle_fingerprint(old)))
+    assert find_missing_subtitles("video.mkv", str(tmp_path), ["spa"], ["Ep1.srt"], info) == ([0], [])
+
+
+def test_a_track_without_hash_is_not_muxed_again_but_not_verified(tmp_path):
+    write_srt(tmp_path / "Ep1.srt")
+    info = video_with(subtitle_track(frames=2))
+    assert find_missing_subtitles("video.mkv", str(tmp_path), ["spa"], ["Ep1.srt"], info) == ([], [0])
+
+
+def test_unverified_subtitles_are_never_deleted(tmp_path):
+    (tmp_path / "subs").mkdir()
+    kept = write_srt(tmp_path / "subs" / "Ep1.es.srt")
+    muxed = write_srt(tmp_path / "subs" / "Ep1.en.srt")
+    finish_subtitles_mux(
+        str(tmp_path), True, "Ep1", ".mkv", ["Ep1.es.srt", "Ep1.en.srt"], "y", [1], None, [0]
+    )
+    assert os.path.exists(kept)
+    assert not os.path.exists(muxed)
+
+
+def test_the_mux_saves_the_hash_in_the_track_tags(tmp_path):
+    video = tmp_path / "Ep1.mkv"
+    video.write_bytes(b"video")
+    sub = write_srt(tmp_path / "Ep1.srt")
+    command, output_file, _, _, tags_files = build_mkvmerge_command(
+        False, "Ep1", str(tmp_path), ["spa"], ["Ep1.srt"]
+    )
+    assert command[command.index(sub) - 2 : command.index(sub)] == ["--tags", f"0:{tags_files[0]}"]
+    with open(tags_files[0], encoding="utf-8") as f:
+        assert subtitle_fingerprint(sub) in f.read()
+    # a failed mux removes the temporary output and tags files
+    finalize_mkvmerge(2, output_file, str(video), None, tags_files)
+    assert not os.path.exists(tags_files[0])
+    assert not os.path.exists(output_file)
@@ -0,0 +1,36 @@
+import pytest
+import trackIndex
+from probe import MkvInfo, Track
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    root = tmp_path / "library"
+    root.mkdir()
+    for i in range(4):
+        (root / f"video{i}.mkv").write_bytes(b"mkv")
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    for name in ("SCAN_INCLUDE", "SCAN_EXCLUDE", "INDEX_QUERY"):
+        monkeypatch.delenv(name, raising=False)
+    return root
+
+
+def test_the_files_that_fail_to_probe_are_not_counted_as_probed(library, monkeypatch):
+    probed = []
+
+    def probe_file(path):
+        probed.append(path)
+        if path.endswith("video2.mkv"):
+            raise RuntimeError("mkvmerge crashed")
+        return MkvInfo(path, "Show", [Track(0, 1, "audio", "A_AAC", "", "spa", "", 0)])
+
+    monkeypatch.setattr(trackIndex, "probe_file", probe_file)
+    index = trackIndex.open_index(str(library))
+    try:
+        assert index.refresh(str(library)) == (4, 3, 1, 0)
+        # the failed file is probed again next time, the others are current
+        assert index.refresh(str(library)) == (4, 0, 1, 0)
+        assert len(index.query(str(library), "audio:spa")) == 3
+    finally:
+        index.close()
+    assert len(probed) == 5
@@ -0,0 +1,37 @@
+import threading, time
+from watcher import _Polling, watch
+
+
+def test_polling_returns_at_the_timeout_before_the_interval(tmp_path):
+    source = _Polling(str(tmp_path), (".mkv",), 60)
+    start = time.monotonic()
+    assert source.poll(0.05) == []
+    assert time.monotonic() - start < 1
+
+
+def test_polling_reports_changes_once_the_interval_elapsed(tmp_path):
+    source = _Polling(str(tmp_path), (".mkv",), 0.2)
+    (tmp_path / "new.mkv").write_bytes(b"data")
+    changed = []
+    deadline = time.monotonic() + 5
+    while not changed and time.monotonic() < deadline:
+        changed = source.poll(0.05)
+    assert changed == [str(tmp_path / "new.mkv")]
+    assert source.poll(0.05) == []
+
+
+def test_watch_stops_without_waiting_for_the_poll_interval(tmp_path, monkeypatch):
+    monkeypatch.setenv("WATCH_POLLING", "True")
+    monkeypatch.setenv("WATCH_POLL_INTERVAL", "60")
+    monkeypatch.setenv("WORKERS", "1")
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch, args=(str(tmp_path), (".mkv",), lambda job: None), kwargs={"stop": stop}
+    )
+    thread.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    stop.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 3
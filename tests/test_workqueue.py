@@ -0,0 +1,135 @@
+import json, os, sqlite3, time
+import multiprocessing
+import pytest
+from workQueue import WorkQueue
+
+# spawn, like on Windows and macOS: the workers share nothing but the queue database
+context = multiprocessing.get_context("spawn")
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    root = tmp_path / "library"
+    root.mkdir()
+    for i in range(40):
+        (root / f"video{i:02}.mkv").write_bytes(b"mkv")
+    monkeypatch.setenv("QUEUE_LEASE", "60")
+    monkeypatch.delenv("QUEUE_ATTEMPTS", raising=False)
+    return root
+
+
+def files(root):
+    return [(os.path.join(root, name), "signature") for name in sorted(os.listdir(root))]
+
+
+def states(db_path):
+    with sqlite3.connect(db_path) as db:
+        return dict(db.execute("SELECT path, state FROM items"))
+
+
+def claim_all(db_path, root, barrier, output):
+    queue = WorkQueue(db_path, root, "mux", "settings")
+    # every worker finds all the files, like the workers of a real library
+    queue.add(files(root))
+    barrier.wait()
+    claimed = []
+    for path in queue.claims():
+        claimed.append(path)
+        time.sleep(0.001)
+        assert queue.complete(path, "done")
+    queue.close()
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(claimed, f)
+
+
+def claim_and_die(db_path, root, output):
+    queue = WorkQueue(db_path, root, "mux", "settings")
+    path = queue.claim()
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump([path, time.time()], f)
+    # a killed container: no complete, no release and no more heartbeats
+    os._exit(0)
+
+
+def claim_and_work(db_path, root, claimed, seconds):
+    queue = WorkQueue(db_path, root, "mux", "settings")
+    path = queue.claim()
+    claimed.set()
+    time.sleep(seconds)
+    assert queue.complete(path, "done")
+    queue.close()
+
+
+def run(target, *args):
+    process = context.Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def test_each_file_is_claimed_by_exactly_one_worker(library, tmp_path):
+    db_path = str(tmp_path / "queue.sqlite")
+    barrier = context.Barrier(4)
+    outputs = [str(tmp_path / f"worker{i}.json") for i in range(4)]
+    processes = [run(claim_all, db_path, str(library), barrier, output) for output in outputs]
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    claimed = []
+    for output in outputs:
+        with open(output, encoding="utf-8") as f:
+            claimed += json.load(f)
+    assert sorted(claimed) == [path for path, _ in files(library)]
+    assert set(states(db_path).values()) == {"done"}
+
+
+def test_the_file_of_a_stopped_worker_is_taken_over_once_its_lease_expires(
+    library, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("QUEUE_LEASE", "3")
+    db_path = str(tmp_path / "queue.sqlite")
+    queue = WorkQueue(db_path, str(library), "mux", "settings")
+    queue.add(files(library)[:1])
+    output = str(tmp_path / "stopped.json")
+    process = run(claim_and_die, db_path, str(library), output)
+    process.join(60)
+    with open(output, encoding="utf-8") as f:
+        path, claimed_at = json.load(f)
+    assert path == files(library)[0][0]
+    if time.time() < claimed_at + 3:
+        assert queue.claim() is None
+    time.sleep(max(0.0, claimed_at + 3.1 - time.time()))
+    assert queue.claim() == path
+    assert queue.complete(path, "done")
+    queue.close()
+    assert states(db_path) == {"video00.mkv": "done"}
+
+
+def test_the_lease_of_a_working_worker_is_renewed(library, tmp_path, monkeypatch):
+    monkeypatch.setenv("QUEUE_LEASE", "1.5")
+    db_path = str(tmp_path / "queue.sqlite")
+    queue = WorkQueue(db_path, str(library), "mux", "settings")
+    queue.add(files(library)[:1])
+    claimed = context.Event()
+    # the worker holds the file for more than two leases
+    process = run(claim_and_work, db_path, str(library), claimed, 4)
+    assert claimed.wait(60)
+    while process.is_alive():
+        assert queue.claim() is None
+        time.sleep(0.2)
+    assert process.exitcode == 0
+    queue.close()
+    assert states(db_path) == {"video00.mkv": "done"}
+
+
+def test_a_file_that_keeps_failing_is_given_up(library, tmp_path, monkeypatch):
+    monkeypatch.setenv("QUEUE_ATTEMPTS", "2")
+    db_path = str(tmp_path / "queue.sqlite")
+    queue = WorkQueue(db_path, str(library), "mux", "settings")
+    queue.add(files(library)[:1])
+    for _ in range(2):
+        path = queue.claim()
+        queue.release(path)
+    assert queue.claim() is None
+    assert queue.is_drained()
+    queue.close()
+    assert states(db_path) == {"video00.mkv": "failed"}